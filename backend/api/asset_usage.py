@@ -0,0 +1,222 @@
+from datetime import date
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# Пересчитываемые окна: по одному на автомобиль/водителя, дни [date_from, date_to]
+ASSET_TARGETS = '''
+    targets AS (
+        SELECT * FROM unnest(%(asset_types)s::text[], %(asset_ids)s::int[],
+                             %(dates_from)s::date[], %(dates_to)s::date[])
+            AS t(asset_type, asset_id, date_from, date_to)
+    )
+'''
+
+# Пересчёты одного автомобиля/водителя идут по очереди до конца транзакции:
+# иначе конкурирующий запрос записал бы сводку по своему (устаревшему) снимку.
+# Блокировки берутся в порядке (asset_type, asset_id), чтобы не было взаимоблокировок
+ASSET_USAGE_LOCK = f'''
+    WITH {ASSET_TARGETS}
+    SELECT pg_advisory_xact_lock(hashtext('daily_asset_usage'), hashtext(asset_type || ':' || asset_id))
+    FROM (SELECT asset_type, asset_id FROM targets ORDER BY asset_type, asset_id) ordered_targets
+'''
+
+ASSET_USAGE_DELETE = f'''
+    WITH {ASSET_TARGETS}
+    DELETE FROM daily_asset_usage u
+    USING targets t
+    WHERE u.asset_type = t.asset_type AND u.asset_id = t.asset_id
+      AND u.usage_date BETWEEN t.date_from AND t.date_to
+'''
+
+# Раскладка этапов по дням окна: в какие сутки и сколько часов автомобиль/водитель
+# был занят по плану (planned_period) и по факту (actual_departure..actual_arrival).
+# Число этапов, завершённые этапы и километры относятся к дню начала этапа.
+# Этапы отменённых и мягко удалённых заказов не учитываются.
+ASSET_USAGE_ROLLUP = f'''
+    WITH {ASSET_TARGETS},
+    stage_assets AS (
+        SELECT t.asset_type, t.asset_id, t.date_from, t.date_to, s.status, s.distance_km,
+               s.planned_period, s.actual_departure, s.actual_arrival
+        FROM targets t
+        JOIN order_transport_stages s ON s.vehicle_id = t.asset_id
+        WHERE t.asset_type = 'vehicle'
+          AND NOT EXISTS (SELECT 1 FROM orders o WHERE o.id = s.order_id AND o.deleted_at IS NOT NULL)
+        UNION ALL
+        SELECT t.asset_type, t.asset_id, t.date_from, t.date_to, s.status, s.distance_km,
+               s.planned_period, s.actual_departure, s.actual_arrival
+        FROM targets t
+        JOIN order_transport_stages s ON s.driver_id = t.asset_id
+        WHERE t.asset_type = 'driver'
+          AND NOT EXISTS (SELECT 1 FROM orders o WHERE o.id = s.order_id AND o.deleted_at IS NOT NULL)
+    ),
+    periods AS (
+        SELECT asset_type, asset_id, date_from, date_to, status, distance_km, planned_period,
+               CASE WHEN actual_arrival > actual_departure
+                    THEN tsrange(actual_departure, actual_arrival) END AS actual_period
+        FROM stage_assets
+        WHERE COALESCE(status, '') <> 'cancelled'
+    ),
+    stage_days AS (
+        SELECT p.*,
+               usage_day::date AS usage_date,
+               tsrange(usage_day, usage_day + interval '1 day') AS day_range,
+               usage_day = date_trunc('day', COALESCE(lower(p.actual_period), lower(p.planned_period))) AS is_start_day
+        FROM periods p
+        CROSS JOIN LATERAL generate_series(
+            GREATEST(date_trunc('day', LEAST(lower(p.actual_period), lower(p.planned_period))), p.date_from::timestamp),
+            LEAST(GREATEST(upper(p.actual_period), upper(p.planned_period)) - interval '1 microsecond', p.date_to::timestamp),
+            interval '1 day'
+        ) AS usage_day
+        WHERE COALESCE(p.actual_period, p.planned_period) IS NOT NULL
+    )
+    INSERT INTO daily_asset_usage (
+        asset_type, asset_id, usage_date, stage_count, completed_stages,
+        planned_hours, actual_hours, distance_km, updated_at
+    )
+    SELECT
+        asset_type, asset_id, usage_date,
+        COUNT(*) FILTER (WHERE is_start_day),
+        COUNT(*) FILTER (WHERE is_start_day AND status = 'completed'),
+        COALESCE(SUM(EXTRACT(EPOCH FROM upper(planned_period * day_range) - lower(planned_period * day_range))), 0) / 3600,
+        COALESCE(SUM(EXTRACT(EPOCH FROM upper(actual_period * day_range) - lower(actual_period * day_range))), 0) / 3600,
+        COALESCE(SUM(distance_km) FILTER (WHERE is_start_day), 0),
+        CURRENT_TIMESTAMP
+    FROM stage_days
+    GROUP BY asset_type, asset_id, usage_date
+    ON CONFLICT (asset_type, asset_id, usage_date) DO UPDATE
+    SET stage_count = EXCLUDED.stage_count, completed_stages = EXCLUDED.completed_stages,
+        planned_hours = EXCLUDED.planned_hours, actual_hours = EXCLUDED.actual_hours,
+        distance_km = EXCLUDED.distance_km, updated_at = EXCLUDED.updated_at
+'''
+
+# Дни, которые этап может занимать: от начала до конца планового и фактического периодов
+USAGE_SPANS = '''
+    SELECT vehicle_id, driver_id,
+           LEAST(lower(planned_period), actual_departure)::date AS date_from,
+           GREATEST(upper(planned_period), actual_arrival)::date AS date_to
+    FROM order_transport_stages
+    WHERE (id = ANY(%(stage_ids)s) OR order_id = ANY(%(order_ids)s))
+      AND (vehicle_id IS NOT NULL OR driver_id IS NOT NULL)
+      AND (planned_period IS NOT NULL OR actual_arrival > actual_departure)
+'''
+
+UsageSpan = Tuple[Optional[int], Optional[int], date, date]
+
+
+def _ids(values: Iterable[Any]) -> List[int]:
+    return sorted({int(value) for value in values if value})
+
+
+def usage_spans(cur: Any, stage_ids: Iterable[Any] = (), order_ids: Iterable[Any] = ()) -> List[UsageSpan]:
+    '''
+    Периоды этапов (vehicle_id, driver_id, первый день, последний день).
+    Снимаются до изменения этапов (старые дни) и после (новые)
+    Returns: список для refresh_asset_usage
+    '''
+    cur.execute(USAGE_SPANS, {'stage_ids': _ids(stage_ids), 'order_ids': _ids(order_ids)})
+    return cur.fetchall()
+
+
+def refresh_asset_usage(cur: Any, spans: Iterable[UsageSpan]) -> None:
+    '''
+    Пересчитывает дневные сводки автомобилей и водителей только за дни переданных
+    периодов (старых и новых) изменённых этапов. Вызывается в той же транзакции,
+    что и изменение этапов.
+    '''
+    windows: Dict[Tuple[str, int], Tuple[date, date]] = {}
+    for vehicle_id, driver_id, date_from, date_to in spans:
+        for key in (('vehicle', vehicle_id), ('driver', driver_id)):
+            if not key[1]:
+                continue
+            window_from, window_to = windows.get(key, (date_from, date_to))
+            windows[key] = (min(window_from, date_from), max(window_to, date_to))
+    if not windows:
+        return
+
+    keys = sorted(windows)
+    params = {
+        'asset_types': [key[0] for key in keys],
+        'asset_ids': [key[1] for key in keys],
+        'dates_from': [windows[key][0] for key in keys],
+        'dates_to': [windows[key][1] for key in keys]
+    }
+    cur.execute(ASSET_USAGE_LOCK, params)
+    cur.execute(ASSET_USAGE_DELETE, params)
+    cur.execute(ASSET_USAGE_ROLLUP, params)
+
+
+def parse_date_range(date_from: Optional[str], date_to: Optional[str]) -> Optional[Tuple[date, date]]:
+    '''
+    Период отчёта из дат YYYY-MM-DD (обе включительно); None, если даты некорректны
+    '''
+    try:
+        start = date.fromisoformat(date_from)
+        end = date.fromisoformat(date_to)
+    except (TypeError, ValueError):
+        return None
+    return (start, end) if start <= end else None
+
+
+def utilization_report(cur: Any, date_from: date, date_to: date, asset_type: Optional[str] = None) -> Dict[str, Any]:
+    '''
+    Загрузка автомобилей и водителей за [date_from, date_to] только по дневным
+    сводкам, без чтения этапов. Занятые часы дня - большее из фактических и плановых;
+    utilization - доля занятых часов от всех часов периода.
+    Returns: {days, assets: [...], companies: [...]}
+    '''
+    days = (date_to - date_from).days + 1
+    period_hours = days * 24
+
+    cur.execute('''
+        SELECT
+            u.asset_type, u.asset_id,
+            CASE WHEN u.asset_type = 'vehicle' THEN v.license_plate
+                 ELSE d.last_name || ' ' || d.first_name END AS name,
+            v.company_name,
+            SUM(u.stage_count) AS stages,
+            SUM(u.completed_stages) AS completed_stages,
+            SUM(u.planned_hours) AS planned_hours,
+            SUM(u.actual_hours) AS actual_hours,
+            SUM(GREATEST(u.actual_hours, u.planned_hours)) AS busy_hours,
+            SUM(u.distance_km) AS distance_km,
+            COUNT(*) FILTER (WHERE u.planned_hours > 0 OR u.actual_hours > 0) AS busy_days
+        FROM daily_asset_usage u
+        LEFT JOIN vehicles v ON u.asset_type = 'vehicle' AND v.id = u.asset_id
+        LEFT JOIN drivers d ON u.asset_type = 'driver' AND d.id = u.asset_id
+        WHERE u.usage_date BETWEEN %(date_from)s AND %(date_to)s
+          AND (%(asset_type)s::text IS NULL OR u.asset_type = %(asset_type)s)
+        GROUP BY u.asset_type, u.asset_id, v.license_plate, v.company_name, d.last_name, d.first_name
+        ORDER BY u.asset_type, busy_hours DESC
+    ''', {'date_from': date_from, 'date_to': date_to, 'asset_type': asset_type})
+    columns = [desc[0] for desc in cur.description]
+    assets = [dict(zip(columns, row)) for row in cur.fetchall()]
+    for asset in assets:
+        asset['utilization'] = round(float(asset['busy_hours']) / period_hours, 4)
+
+    companies = []
+    if asset_type in (None, 'vehicle'):
+        cur.execute('''
+            SELECT
+                COALESCE(v.company_name, '') AS company_name,
+                COUNT(*) AS vehicles,
+                COALESCE(SUM(u.stages), 0) AS stages,
+                COALESCE(SUM(u.busy_hours), 0) AS busy_hours,
+                COALESCE(SUM(u.distance_km), 0) AS distance_km
+            FROM vehicles v
+            LEFT JOIN (
+                SELECT asset_id,
+                       SUM(stage_count) AS stages,
+                       SUM(GREATEST(actual_hours, planned_hours)) AS busy_hours,
+                       SUM(distance_km) AS distance_km
+                FROM daily_asset_usage
+                WHERE asset_type = 'vehicle' AND usage_date BETWEEN %(date_from)s AND %(date_to)s
+                GROUP BY asset_id
+            ) u ON u.asset_id = v.id
+            GROUP BY COALESCE(v.company_name, '')
+            ORDER BY busy_hours DESC
+        ''', {'date_from': date_from, 'date_to': date_to})
+        columns = [desc[0] for desc in cur.description]
+        companies = [dict(zip(columns, row)) for row in cur.fetchall()]
+        for company in companies:
+            company['utilization'] = round(float(company['busy_hours']) / (period_hours * company['vehicles']), 4)
+
+    return {'days': days, 'assets': assets, 'companies': companies}
@@ -0,0 +1,219 @@
+import asyncio
+import os
+import threading
+import time
+from typing import Any, Coroutine, Dict, List, Optional, Sequence, Tuple
+
+from db_schema import current_schema, use_schema
+from order_stages import CUSTOMS_QUERY, STAGES_QUERY, WAYPOINTS_QUERY, group_order_stages
+from query_stats import current_stats, finish_request, start_request
+from replica import CAUGHT_UP_QUERY, READ_URL, add_route_headers, replica_eligible
+from response_utils import compress_response, dumps
+
+# ASYNC_DB=1 включает асинхронный путь (psycopg 3, AsyncConnectionPool) для ресурсов
+# из нескольких независимых запросов; остальные запросы идут в синхронный handler.
+# Асинхронный путь ведёт себя как синхронный: статистика запросов (query_stats),
+# выбор реплики по DATABASE_READ_URL и X-Read-After, заголовки X-Read-Source
+ASYNC_DB = os.environ.get('ASYNC_DB', '0') == '1'
+ASYNC_POOL_SIZE = int(os.environ.get('ASYNC_DB_POOL_SIZE', '4'))
+
+# Счётчики дашборда: четыре независимых COUNT
+STATS_QUERIES = {
+    'active_orders': "SELECT COUNT(*) FROM orders WHERE status != 'delivered' AND deleted_at IS NULL",
+    'in_transit': "SELECT COUNT(*) FROM orders WHERE status = 'in_transit' AND deleted_at IS NULL",
+    'total_drivers': 'SELECT COUNT(*) FROM drivers',
+    'total_vehicles': 'SELECT COUNT(*) FROM vehicles'
+}
+
+ASYNC_RESOURCES = ('stats', 'order_stages')
+
+
+class AsyncDatabase:
+    '''
+    Цикл событий в фоновом потоке и пул асинхронных соединений. Цикл и пул
+    живут между вызовами тёплой функции (и между запросами server/wsgi.py),
+    синхронный код отдаёт им корутины через run()
+    '''
+
+    def __init__(self) -> None:
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._pools: Dict[str, Any] = {}
+        self._pools_lock: Optional[asyncio.Lock] = None
+        self._lock = threading.Lock()
+
+    def run(self, coro: Coroutine[Any, Any, Any]) -> Any:
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name='async-db', daemon=True).start()
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    async def pool(self, dsn: Optional[str] = None) -> Any:
+        '''
+        Пул соединений к dsn (по умолчанию DATABASE_URL, основная база).
+        Создание под asyncio.Lock: иначе две корутины, пропустившие проверку,
+        открыли бы по пулу, и один остался бы висеть со своими соединениями
+        '''
+        dsn = dsn or os.environ['DATABASE_URL']
+        if dsn in self._pools:
+            return self._pools[dsn]
+        if self._pools_lock is None:
+            self._pools_lock = asyncio.Lock()
+        async with self._pools_lock:
+            if dsn not in self._pools:
+                from psycopg_pool import AsyncConnectionPool
+
+                pool = AsyncConnectionPool(dsn, min_size=1, max_size=ASYNC_POOL_SIZE, open=False)
+                await pool.open()
+                self._pools[dsn] = pool
+        return self._pools[dsn]
+
+
+database = AsyncDatabase()
+
+
+async def replica_caught_up_async(pool: Any, lsn: str) -> bool:
+    '''
+    То же, что replica.replica_caught_up, на соединении из асинхронного пула
+    '''
+    import psycopg
+
+    async with pool.connection() as conn:
+        try:
+            async with conn.transaction():
+                cur = await conn.execute(CAUGHT_UP_QUERY, (lsn,))
+                in_recovery, reached = await cur.fetchone()
+        except psycopg.DataError:
+            return False
+    return not in_recovery or bool(reached)
+
+
+async def choose_pool(event: Dict[str, Any], route: Dict[str, Any]) -> Any:
+    '''
+    Пул для запроса по тем же правилам, что replica.choose_connect: реплика для
+    читающих запросов, если она доступна и догнала X-Read-After, иначе основная база.
+    Выбранный источник пишется в route['source']
+    '''
+    eligible, lsn = replica_eligible(event) if READ_URL else (False, None)
+    if eligible:
+        import psycopg
+        from psycopg_pool import PoolTimeout
+
+        try:
+            pool = await database.pool(READ_URL)
+            if not lsn or await replica_caught_up_async(pool, lsn):
+                route['source'] = 'replica'
+                return pool
+        except (psycopg.OperationalError, PoolTimeout):
+            pass
+    return await database.pool()
+
+
+async def fetch_pipelined(pool: Any, queries: Sequence[Tuple[str, Any]]) -> List[List[Dict[str, Any]]]:
+    '''
+    Выполняет независимые запросы одним конвейером в одной транзакции на одном
+    соединении из пула: все запросы уходят сразу, ответы читаются за один круг
+    до базы, соединение возвращается в пул вне транзакции. Схема филиала
+    запроса задаётся SET LOCAL search_path в том же конвейере - без лишнего круга.
+    Запросы попадают в статистику текущего запроса (query_stats)
+    Returns: строки (словари) каждого запроса в том же порядке
+    '''
+    from psycopg import sql
+    from psycopg.rows import dict_row
+
+    schema = current_schema()
+    started = time.perf_counter()
+    async with pool.connection() as conn:
+        async with conn.transaction():
+            cursors = [conn.cursor(row_factory=dict_row) for _ in queries]
+            async with conn.pipeline():
+                if schema:
+                    await conn.execute(sql.SQL('SET LOCAL search_path TO {}, public').format(sql.Identifier(schema)))
+                for cur, (query, params) in zip(cursors, queries):
+                    await cur.execute(query, params)
+            results = [await cur.fetchall() for cur in cursors]
+
+    stats = current_stats()
+    if stats is not None:
+        # Время отдельного запроса в конвейере не измерить: делим общее поровну
+        duration = (time.perf_counter() - started) / len(queries)
+        for (query, _), rows in zip(queries, results):
+            stats.record(query, duration, len(rows))
+    return results
+
+
+def json_response(status_code: int, data: Any) -> Dict[str, Any]:
+    return {
+        'statusCode': status_code,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': dumps(data),
+        'isBase64Encoded': False
+    }
+
+
+async def stats_response(event: Dict[str, Any], route: Dict[str, Any]) -> Dict[str, Any]:
+    pool = await choose_pool(event, route)
+    results = await fetch_pipelined(pool, [(query, None) for query in STATS_QUERIES.values()])
+    return json_response(200, {
+        name: next(iter(rows[0].values())) for name, rows in zip(STATS_QUERIES, results)
+    })
+
+
+async def order_stages_response(event: Dict[str, Any], route: Dict[str, Any]) -> Dict[str, Any]:
+    query_params = event.get('queryStringParameters') or {}
+    order_id = query_params.get('order_id')
+    order_ids_param = query_params.get('order_ids')
+    if not order_id and not order_ids_param:
+        return json_response(400, {'error': 'order_id or order_ids required'})
+    if order_ids_param:
+        try:
+            order_ids = list(dict.fromkeys(int(oid) for oid in order_ids_param.split(',') if oid.strip()))
+        except ValueError:
+            return json_response(400, {'error': 'order_ids must be comma-separated integers'})
+    else:
+        try:
+            order_ids = [int(order_id)]
+        except ValueError:
+            return json_response(400, {'error': 'order_id must be an integer'})
+
+    pool = await choose_pool(event, route)
+    stages, customs, waypoints = await fetch_pipelined(pool, [
+        (STAGES_QUERY, (order_ids,)),
+        (CUSTOMS_QUERY, (order_ids,)),
+        (WAYPOINTS_QUERY, (order_ids,))
+    ])
+    stages_by_order = group_order_stages(order_ids, stages, customs, waypoints)
+
+    if order_ids_param:
+        return json_response(200, {'stages_by_order': {str(oid): items for oid, items in stages_by_order.items()}})
+    return json_response(200, {'stages': stages_by_order[order_ids[0]]})
+
+
+def is_async_request(event: Dict[str, Any]) -> bool:
+    query_params = event.get('queryStringParameters') or {}
+    return event.get('httpMethod', 'GET') == 'GET' and query_params.get('resource', 'orders') in ASYNC_RESOURCES
+
+
+async def async_handler(event: Dict[str, Any], context: Any, schema: Optional[str] = None) -> Dict[str, Any]:
+    '''
+    Асинхронный вариант handler для is_async_request: stats и order_stages отвечают
+    из конвейера запросов (со статистикой, выбором реплики и заголовками маршрута,
+    как в синхронном handle_request). Остальные запросы index.dispatch_request
+    сюда не передаёт. schema - схема филиала запроса (db_schema.request_schema)
+    '''
+    # Корутина выполняется в своей задаче цикла: контекст статистики и схемы у неё свой
+    with use_schema(schema):
+        stats = start_request()
+        route: Dict[str, Any] = {'source': 'primary', 'token': None}
+        query_params = event.get('queryStringParameters') or {}
+        if query_params.get('resource') == 'stats':
+            response = await stats_response(event, route)
+        else:
+            response = await order_stages_response(event, route)
+        response = add_route_headers(event, response, route)
+        response = finish_request(stats, event, response)
+    return compress_response(event, response)
+
+
+def run_async(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    return database.run(async_handler(event, context, current_schema()))
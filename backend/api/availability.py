@@ -0,0 +1,181 @@
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from response_utils import dumps
+
+# Этапы с этими статусами не занимают автомобиль и водителя
+INACTIVE_STAGE_STATUSES = ['completed', 'cancelled']
+
+# Этапы мягко удалённых заказов (orders.deleted_at) тоже ничего не занимают
+LIVE_ORDER_SQL = 'NOT EXISTS (SELECT 1 FROM orders del WHERE del.id = s.order_id AND del.deleted_at IS NOT NULL)'
+
+# То же выражение, что у сгенерированной колонки planned_period (V0006)
+PERIOD_SQL = '''
+    CASE
+        WHEN {departure} IS NULL THEN NULL
+        WHEN {arrival} IS NULL OR {arrival} <= {departure}
+            THEN tsrange({departure}, {departure} + interval '1 day')
+        ELSE tsrange({departure}, {arrival})
+    END
+'''
+
+# Бронь автомобиля и водителя: блокировка до конца транзакции, поэтому проверка
+# пересечений и вставка этапов конкурирующих запросов идут по очереди и второй
+# видит этапы первого. Ограничение EXCLUDE здесь не подходит: allow_overlap
+# разрешает пересечения, а этапы одного заказа, завершённые и удалённые не мешают.
+# Блокировки берутся в одном порядке - без взаимоблокировок
+BOOKING_LOCK = '''
+    SELECT pg_advisory_xact_lock(hashtext('stage_booking'), hashtext(k.resource_key))
+    FROM (SELECT DISTINCT resource_key FROM unnest(%s::text[]) AS resource_key ORDER BY resource_key) k
+'''
+
+CONFLICTS_QUERY = f'''
+    WITH requested AS (
+        SELECT r.stage_index, r.vehicle_id, r.driver_id,
+               {PERIOD_SQL.format(departure='r.planned_departure', arrival='r.planned_arrival')} AS period
+        FROM unnest(%(stage_indexes)s::int[], %(vehicle_ids)s::int[], %(driver_ids)s::int[],
+                    %(departures)s::timestamp[], %(arrivals)s::timestamp[])
+             AS r(stage_index, vehicle_id, driver_id, planned_departure, planned_arrival)
+    ),
+    conflicts AS (
+        SELECT r.stage_index, 'vehicle' AS resource, s.vehicle_id AS resource_id, s.id AS stage_id,
+               s.order_id, s.stage_number, s.planned_period
+        FROM requested r
+        JOIN order_transport_stages s ON s.vehicle_id = r.vehicle_id AND s.planned_period && r.period
+        WHERE COALESCE(s.status, '') <> ALL(%(inactive)s)
+          AND s.order_id IS DISTINCT FROM %(order_id)s
+        UNION ALL
+        SELECT r.stage_index, 'driver', s.driver_id, s.id, s.order_id, s.stage_number, s.planned_period
+        FROM requested r
+        JOIN order_transport_stages s ON s.driver_id = r.driver_id AND s.planned_period && r.period
+        WHERE COALESCE(s.status, '') <> ALL(%(inactive)s)
+          AND s.order_id IS DISTINCT FROM %(order_id)s
+    )
+    SELECT c.stage_index, c.resource, c.resource_id, c.stage_id, c.order_id, o.order_number,
+           c.stage_number, lower(c.planned_period), upper(c.planned_period)
+    FROM conflicts c
+    LEFT JOIN orders o ON o.id = c.order_id
+    WHERE o.deleted_at IS NULL
+    ORDER BY c.stage_index, c.resource, lower(c.planned_period)
+'''
+
+
+def find_stage_conflicts(cur: Any, stages: List[Dict[str, Any]], order_id: Optional[int] = None) -> List[Dict[str, Any]]:
+    '''
+    Ищет этапы других заказов, которые занимают те же автомобиль или водителя
+    в пересекающийся период. Этапы одного заказа друг другу не мешают (один рейс),
+    поэтому этапы order_id не учитываются. Все этапы проверяются одним запросом.
+    Автомобили и водители этапов блокируются (BOOKING_LOCK) до конца транзакции:
+    вызывать до вставки этапов в той же транзакции.
+    Returns: [{stage_index, resource, resource_id, stage_id, order_id, order_number, ...}]
+    '''
+    stage_indexes, vehicle_ids, driver_ids, departures, arrivals = [], [], [], [], []
+    for stage_index, stage in enumerate(stages):
+        if not stage.get('planned_departure') or not (stage.get('vehicle_id') or stage.get('driver_id')):
+            continue
+        stage_indexes.append(stage_index)
+        vehicle_ids.append(stage.get('vehicle_id') or None)
+        driver_ids.append(stage.get('driver_id') or None)
+        departures.append(stage.get('planned_departure'))
+        arrivals.append(stage.get('planned_arrival') or None)
+
+    if not stage_indexes:
+        return []
+
+    resource_keys = [f'vehicle:{vehicle_id}' for vehicle_id in vehicle_ids if vehicle_id]
+    resource_keys += [f'driver:{driver_id}' for driver_id in driver_ids if driver_id]
+    cur.execute(BOOKING_LOCK, (resource_keys,))
+
+    cur.execute(CONFLICTS_QUERY, {
+        'stage_indexes': stage_indexes,
+        'vehicle_ids': vehicle_ids,
+        'driver_ids': driver_ids,
+        'departures': departures,
+        'arrivals': arrivals,
+        'inactive': INACTIVE_STAGE_STATUSES,
+        'order_id': order_id
+    })
+    return [
+        {
+            'stage_index': stage_index,
+            'resource': resource,
+            'resource_id': resource_id,
+            'stage_id': stage_id,
+            'order_id': conflict_order_id,
+            'order_number': order_number,
+            'stage_number': stage_number,
+            'busy_from': busy_from,
+            'busy_to': busy_to
+        }
+        for (stage_index, resource, resource_id, stage_id, conflict_order_id, order_number,
+             stage_number, busy_from, busy_to) in cur.fetchall()
+    ]
+
+
+def conflict_response(conflicts: List[Dict[str, Any]]) -> Dict[str, Any]:
+    '''
+    Ответ 409 со списком пересечений. Клиент может повторить запрос с
+    allow_overlap: true - тогда этапы сохраняются, а пересечения возвращаются в conflicts.
+    '''
+    return {
+        'statusCode': 409,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': dumps({
+            'success': False,
+            'message': 'Автомобиль или водитель уже заняты в этот период',
+            'conflicts': conflicts
+        }),
+        'isBase64Encoded': False
+    }
+
+
+def parse_window(date_from: Optional[str], date_to: Optional[str]) -> Optional[Tuple[datetime, datetime]]:
+    '''
+    Окно поиска из ISO-дат (2024-05-01 или 2024-05-01T08:00); None, если даты
+    не заданы, не разбираются или from не раньше to
+    '''
+    try:
+        start = datetime.fromisoformat(date_from)
+        end = datetime.fromisoformat(date_to)
+    except (TypeError, ValueError):
+        return None
+    return (start, end) if start < end else None
+
+
+def find_available(cur: Any, date_from: datetime, date_to: datetime) -> Dict[str, List[Dict[str, Any]]]:
+    '''
+    Автомобили и водители без активных этапов в окне [date_from, date_to)
+    '''
+    params = {'date_from': date_from, 'date_to': date_to, 'inactive': INACTIVE_STAGE_STATUSES}
+
+    cur.execute(f'''
+        SELECT v.id, v.license_plate, v.model, v.trailer_plate, v.company_name, v.driver_id
+        FROM vehicles v
+        WHERE NOT EXISTS (
+            SELECT 1 FROM order_transport_stages s
+            WHERE s.vehicle_id = v.id
+              AND s.planned_period && tsrange(%(date_from)s, %(date_to)s)
+              AND COALESCE(s.status, '') <> ALL(%(inactive)s)
+              AND {LIVE_ORDER_SQL}
+        )
+        ORDER BY v.license_plate
+    ''', params)
+    columns = [desc[0] for desc in cur.description]
+    vehicles = [dict(zip(columns, row)) for row in cur.fetchall()]
+
+    cur.execute(f'''
+        SELECT d.id, d.last_name, d.first_name, d.middle_name, d.phone
+        FROM drivers d
+        WHERE NOT EXISTS (
+            SELECT 1 FROM order_transport_stages s
+            WHERE s.driver_id = d.id
+              AND s.planned_period && tsrange(%(date_from)s, %(date_to)s)
+              AND COALESCE(s.status, '') <> ALL(%(inactive)s)
+              AND {LIVE_ORDER_SQL}
+        )
+        ORDER BY d.last_name, d.first_name
+    ''', params)
+    columns = [desc[0] for desc in cur.description]
+    drivers = [dict(zip(columns, row)) for row in cur.fetchall()]
+
+    return {'vehicles': vehicles, 'drivers': drivers}
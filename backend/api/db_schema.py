@@ -0,0 +1,91 @@
+import os
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, Optional
+
+from psycopg2 import sql
+
+# Схема развёртывания (например, отдельная на филиал). Запросы пишутся без
+# префикса схемы, привязка делается через search_path при выдаче соединения.
+# Не задана - используется search_path базы по умолчанию.
+DB_SCHEMA = os.environ.get('DB_SCHEMA')
+
+# Несколько филиалов на одном кластере и общем тёплом пуле: схема запроса
+# выбирается по заголовку X-Tenant (его выставляет шлюз филиала) из
+# DB_TENANT_SCHEMAS вида "msk=transport_msk,spb=transport_spb".
+# Без заголовка используется DB_SCHEMA
+TENANT_HEADER = 'X-Tenant'
+TENANT_SCHEMAS: Dict[str, str] = {
+    tenant.strip(): schema.strip()
+    for tenant, schema in (item.split('=', 1) for item in os.environ.get('DB_TENANT_SCHEMAS', '').split(',') if '=' in item)
+}
+
+_current: ContextVar[Optional[str]] = ContextVar('db_schema', default=None)
+
+
+class UnknownTenant(ValueError):
+    pass
+
+
+def request_schema(event: Dict[str, Any]) -> Optional[str]:
+    '''
+    Схема запроса по заголовку X-Tenant (без учёта регистра имени).
+    Raises: UnknownTenant, если филиал не из DB_TENANT_SCHEMAS или заголовка нет,
+    а DB_SCHEMA при настроенных филиалах не задана. OPTIONS (preflight) к базе
+    не обращается и заголовка не требует
+    '''
+    if event.get('httpMethod') == 'OPTIONS':
+        return DB_SCHEMA
+    headers = event.get('headers') or {}
+    tenant = next((value.strip() for name, value in headers.items()
+                   if name.lower() == TENANT_HEADER.lower() and value and value.strip()), None)
+    if tenant is None:
+        if TENANT_SCHEMAS and not DB_SCHEMA:
+            raise UnknownTenant(f'{TENANT_HEADER} required')
+        return DB_SCHEMA
+    if tenant not in TENANT_SCHEMAS:
+        raise UnknownTenant(f'unknown tenant: {tenant}')
+    return TENANT_SCHEMAS[tenant]
+
+
+@contextmanager
+def use_schema(schema: Optional[str]) -> Iterator[None]:
+    '''
+    Схема, которую bind_schema привяжет к соединениям в этом контексте (запросе)
+    '''
+    token = _current.set(schema)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+def current_schema() -> Optional[str]:
+    return _current.get() or DB_SCHEMA
+
+
+def bind_schema(conn: Any) -> Any:
+    '''
+    SET search_path TO <схема запроса>, public на новом или выданном из пула
+    соединении. Соединение пула помнит привязанную схему (bound_schema) и
+    переключается только при смене филиала. SET коммитится сразу, чтобы откат
+    транзакции запроса его не отменил
+    '''
+    schema = current_schema()
+    if getattr(conn, 'bound_schema', None) == schema:
+        return conn
+    cur = conn.cursor()
+    try:
+        if schema:
+            cur.execute(sql.SQL('SET search_path TO {}, public').format(sql.Identifier(schema)))
+        else:
+            cur.execute('RESET search_path')
+    finally:
+        cur.close()
+    conn.commit()
+    try:
+        conn.bound_schema = schema
+    except AttributeError:
+        # Обычное соединение psycopg2 без пула: атрибутов не принимает и не переиспользуется
+        pass
+    return conn
@@ -0,0 +1,192 @@
+import csv
+import io
+import os
+import shutil
+import tempfile
+import uuid
+from datetime import date, datetime
+from typing import Any, Callable, Iterable, Iterator, Optional, Tuple
+
+from response_utils import encode_value
+
+EXPORT_ITERSIZE = 2000
+EXPORT_SPOOL_BYTES = 8 * 1024 * 1024
+
+EXPORT_COLUMNS = [
+    ('order_number', 'Номер заказа'),
+    ('order_date', 'Дата заказа'),
+    ('order_status', 'Статус заказа'),
+    ('client_name', 'Перевозчик (компания)'),
+    ('customer_display', 'Заказчики'),
+    ('cargo_type', 'Тип груза'),
+    ('cargo_weight', 'Вес груза'),
+    ('invoice', 'Инвойс'),
+    ('track_number', 'Трек-номер'),
+    ('stage_number', 'Этап'),
+    ('from_location', 'Откуда'),
+    ('to_location', 'Куда'),
+    ('license_plate', 'Автомобиль'),
+    ('trailer_plate', 'Прицеп'),
+    ('driver_name', 'Водитель'),
+    ('driver_phone', 'Телефон водителя'),
+    ('carrier', 'Перевозчик'),
+    ('border_crossing', 'Граница'),
+    ('planned_departure', 'План отправления'),
+    ('planned_arrival', 'План прибытия'),
+    ('actual_departure', 'Факт отправления'),
+    ('actual_arrival', 'Факт прибытия'),
+    ('distance_km', 'Расстояние, км'),
+    ('stage_status', 'Статус этапа'),
+    ('customs_points', 'Таможня'),
+    ('waypoints', 'Промежуточные точки')
+]
+
+EXPORT_CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+}
+
+
+def parse_export_range(date_from: Optional[str], date_to: Optional[str]) -> Optional[Tuple[Optional[date], Optional[date]]]:
+    '''
+    Необязательные границы выгрузки YYYY-MM-DD (обе включительно); None, если
+    заданная дата не разбирается или from позже to
+    '''
+    try:
+        start = date.fromisoformat(date_from) if date_from else None
+        end = date.fromisoformat(date_to) if date_to else None
+    except (TypeError, ValueError):
+        return None
+    if start and end and start > end:
+        return None
+    return start, end
+
+
+def iter_export_rows(conn: Any, date_from: Optional[date], date_to: Optional[date]) -> Iterator[Tuple]:
+    '''
+    Построчно читает заказы с этапами, таможней и точками через серверный курсор:
+    в памяти одновременно находится не больше EXPORT_ITERSIZE строк
+    '''
+    cur = conn.cursor(name='orders_export')
+    cur.itersize = EXPORT_ITERSIZE
+    try:
+        cur.execute('''
+            SELECT
+                o.order_number, o.order_date::date, o.status,
+                c.name, COALESCE(os.customer_display, '—'),
+                o.cargo_type, o.cargo_weight, o.invoice, o.track_number,
+                s.stage_number, s.from_location, s.to_location,
+                v.license_plate, v.trailer_plate,
+                d.full_name, d.phone,
+                s.carrier, s.border_crossing,
+                s.planned_departure, s.planned_arrival,
+                s.actual_departure, s.actual_arrival,
+                s.distance_km, s.status,
+                (SELECT string_agg(cp.customs_name, '; ' ORDER BY cp.id)
+                 FROM order_customs_points cp WHERE cp.stage_id = s.id),
+                (SELECT string_agg(w.location, '; ' ORDER BY w.waypoint_order)
+                 FROM stage_waypoints w WHERE w.stage_id = s.id)
+            FROM orders o
+            LEFT JOIN clients c ON o.client_id = c.id
+            LEFT JOIN order_summary os ON os.order_id = o.id
+            LEFT JOIN order_transport_stages s ON s.order_id = o.id
+            LEFT JOIN vehicles v ON s.vehicle_id = v.id
+            LEFT JOIN drivers d ON s.driver_id = d.id
+            WHERE o.deleted_at IS NULL
+              AND (%(date_from)s::date IS NULL OR o.order_date >= %(date_from)s::date)
+              AND (%(date_to)s::date IS NULL OR o.order_date <= %(date_to)s::date)
+            ORDER BY o.order_date, o.id, s.stage_number
+        ''', {'date_from': date_from, 'date_to': date_to})
+
+        for row in cur:
+            yield row
+    finally:
+        cur.close()
+
+
+def export_value(value: Any) -> Any:
+    if isinstance(value, (date, datetime)):
+        return encode_value(value)
+    return value
+
+
+def write_csv(rows: Iterable[Tuple], fileobj: Any) -> int:
+    '''
+    Пишет строки в CSV (UTF-8 с BOM, разделитель ';' - открывается в Excel)
+    '''
+    text = io.TextIOWrapper(fileobj, encoding='utf-8-sig', newline='')
+    writer = csv.writer(text, delimiter=';')
+    writer.writerow([title for _, title in EXPORT_COLUMNS])
+    count = 0
+    for row in rows:
+        writer.writerow([export_value(value) for value in row])
+        count += 1
+    text.flush()
+    text.detach()
+    return count
+
+
+def write_xlsx(rows: Iterable[Tuple], fileobj: Any) -> int:
+    '''
+    Пишет строки в XLSX в потоковом режиме openpyxl (write_only)
+    '''
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Заказы')
+    sheet.append([title for _, title in EXPORT_COLUMNS])
+    count = 0
+    for row in rows:
+        sheet.append([export_value(value) for value in row])
+        count += 1
+    workbook.save(fileobj)
+    return count
+
+
+def upload_export(fileobj: Any, filename: str, content_type: str) -> str:
+    '''
+    Загружает файл выгрузки в S3 и возвращает ссылку на CDN.
+    Если задан EXPORT_LOCAL_DIR, файл кладётся в локальную папку (для тестов и разработки).
+    '''
+    fileobj.seek(0)
+    local_dir = os.environ.get('EXPORT_LOCAL_DIR')
+    if local_dir:
+        path = os.path.join(local_dir, filename)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as target:
+            shutil.copyfileobj(fileobj, target)
+        return f'file://{os.path.abspath(path)}'
+
+    import boto3
+
+    s3 = boto3.client('s3',
+        endpoint_url='https://bucket.poehali.dev',
+        aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
+        aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY']
+    )
+    s3.upload_fileobj(fileobj, 'files', filename, ExtraArgs={'ContentType': content_type})
+    return f"https://cdn.poehali.dev/projects/{os.environ['AWS_ACCESS_KEY_ID']}/bucket/{filename}"
+
+
+def export_orders(conn: Any, file_format: str, date_from: Optional[date], date_to: Optional[date],
+                  release: Callable[[], None]) -> Tuple[str, int]:
+    '''
+    Выгрузка заказов: серверный курсор -> генератор строк -> CSV/XLSX во временный
+    файл (в памяти до EXPORT_SPOOL_BYTES, дальше на диске) -> S3.
+    release() отпускает соединение после записи файла - загрузка в S3 идёт без
+    открытой транзакции
+    Returns: (ссылка на файл, количество строк)
+    '''
+    rows = iter_export_rows(conn, date_from, date_to)
+    # uuid в ключе: выгрузки, начатые в одну секунду, не перезаписывают друг друга
+    filename = f"exports/orders_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex}.{file_format}"
+
+    with tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_BYTES) as buffer:
+        if file_format == 'xlsx':
+            count = write_xlsx(rows, buffer)
+        else:
+            count = write_csv(rows, buffer)
+        release()
+        url = upload_export(buffer, filename, EXPORT_CONTENT_TYPES[file_format])
+
+    return url, count
@@ -0,0 +1,127 @@
+import hashlib
+import json
+import os
+from typing import Any, Callable, Dict, Optional
+
+from response_utils import dumps
+from unit_of_work import UnitOfWork
+
+# Действия, повтор которых создаёт дубликаты (и повторные уведомления)
+IDEMPOTENT_ACTIONS = {
+    'create_multi_stage_order',
+    'create_driver',
+    'create_vehicle',
+    'create_customer',
+    'create_contract_application'
+}
+
+IDEMPOTENCY_TTL_HOURS = int(os.environ.get('IDEMPOTENCY_TTL_HOURS', '24'))
+# Ключ без сохранённого ответа старше этого считается брошенным (функция упала)
+IDEMPOTENCY_STALE_SECONDS = int(os.environ.get('IDEMPOTENCY_STALE_SECONDS', '120'))
+# Сколько просроченных ключей удаляет каждый новый ключ
+IDEMPOTENCY_CLEANUP_BATCH = 50
+MAX_KEY_LENGTH = 255
+
+# Новый ключ вставляется; просроченный или брошенный перезанимается. Конкурирующий
+# запрос с тем же ключом ждёт на уникальном индексе, пока первый не завершит транзакцию
+CLAIM_KEY = '''
+    INSERT INTO idempotency_keys (idempotency_key, action, request_hash, expires_at)
+    VALUES (%(key)s, %(action)s, %(request_hash)s, CURRENT_TIMESTAMP + make_interval(hours => %(ttl)s))
+    ON CONFLICT (idempotency_key, action) DO UPDATE
+    SET request_hash = EXCLUDED.request_hash, expires_at = EXCLUDED.expires_at,
+        status_code = NULL, response = NULL, created_at = CURRENT_TIMESTAMP
+    WHERE idempotency_keys.expires_at < CURRENT_TIMESTAMP
+       OR (idempotency_keys.response IS NULL
+           AND idempotency_keys.created_at < CURRENT_TIMESTAMP - make_interval(secs => %(stale)s))
+    RETURNING 1
+'''
+
+CLEANUP_EXPIRED = '''
+    DELETE FROM idempotency_keys
+    WHERE ctid IN (
+        SELECT ctid FROM idempotency_keys
+        WHERE expires_at < CURRENT_TIMESTAMP
+        LIMIT %s
+    )
+'''
+
+
+def idempotency_key(event: Dict[str, Any]) -> Optional[str]:
+    '''
+    Значение заголовка Idempotency-Key (без учёта регистра имени)
+    '''
+    headers = event.get('headers') or {}
+    value = next((value for name, value in headers.items() if name.lower() == 'idempotency-key'), None)
+    return value.strip() if value and value.strip() else None
+
+
+def error(status_code: int, message: str, extra_headers: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    return {
+        'statusCode': status_code,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*', **(extra_headers or {})},
+        'body': dumps({'success': False, 'message': message}),
+        'isBase64Encoded': False
+    }
+
+
+def run_idempotent(event: Dict[str, Any], uow: UnitOfWork, work: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+    '''
+    Выполняет work() не больше одного раза на пару (Idempotency-Key, action).
+    Ключ и ответ пишутся в той же транзакции, что и сами изменения (обработчики
+    не коммитят сами, коммит делает run_in_unit_of_work): ответ с ошибкой
+    откатывается вместе с ключом, и запрос можно повторить.
+    Повтор с тем же ключом и телом получает сохранённый ответ без выполнения
+    (и без уведомлений), с другим телом - 422, пока первый не завершён - 409.
+    '''
+    key = idempotency_key(event)
+    if not key or event.get('httpMethod') != 'POST':
+        return work()
+    try:
+        body = json.loads(event.get('body') or '{}')
+    except ValueError:
+        return work()
+    action = body.get('action') if isinstance(body, dict) else None
+    if action not in IDEMPOTENT_ACTIONS:
+        return work()
+    if len(key) > MAX_KEY_LENGTH:
+        return error(400, f'Idempotency-Key длиннее {MAX_KEY_LENGTH} символов')
+
+    request_hash = hashlib.sha256(
+        json.dumps(body, sort_keys=True, ensure_ascii=False).encode('utf-8')
+    ).hexdigest()
+    params = {
+        'key': key,
+        'action': action,
+        'request_hash': request_hash,
+        'ttl': IDEMPOTENCY_TTL_HOURS,
+        'stale': IDEMPOTENCY_STALE_SECONDS
+    }
+
+    cur = uow.cursor
+    cur.execute(CLAIM_KEY, params)
+    if cur.fetchone() is None:
+        cur.execute('''
+            SELECT request_hash, response FROM idempotency_keys
+            WHERE idempotency_key = %(key)s AND action = %(action)s
+        ''', params)
+        row = cur.fetchone()
+        if row is None or row[1] is None:
+            return error(409, 'Запрос с этим Idempotency-Key ещё выполняется', {'Retry-After': '1'})
+        stored_hash, stored = row
+        if stored_hash != request_hash:
+            return error(422, 'Idempotency-Key уже использован с другим запросом')
+        return {**stored, 'headers': {**stored.get('headers', {}), 'Idempotent-Replayed': 'true'}}
+
+    cur.execute(CLEANUP_EXPIRED, (IDEMPOTENCY_CLEANUP_BATCH,))
+
+    response = work()
+    if uow.released:
+        # Изменения уже закоммичены без ответа: ключ останется ожидающим до
+        # IDEMPOTENCY_STALE_SECONDS. Идемпотентные действия так делать не должны
+        raise RuntimeError(f'{action} released the unit of work before its idempotent response was stored')
+    if response.get('statusCode', 200) < 400:
+        uow.cursor.execute('''
+            UPDATE idempotency_keys SET status_code = %(status_code)s, response = %(response)s
+            WHERE idempotency_key = %(key)s AND action = %(action)s
+        ''', {**params, 'status_code': response.get('statusCode', 200), 'response': json.dumps(response)})
+    return response
@@ -1,19 +1,97 @@
 import json
 import os
 import psycopg2
+import psycopg2.errors
 from typing import Dict, Any
-import urllib.request
-import urllib.parse
-import urllib.error
+from response_utils import compress_response, dumps, fetch_rows
+from query_stats import InstrumentedCursor, finish_request, start_request
+from db_schema import UnknownTenant, bind_schema, request_schema, use_schema
+from prepared import execute_prepared
+from order_numbers import (
+    MAX_DIRECTION_LENGTH,
+    allocate_order_number,
+    consume_order_number,
+    duplicate_number_response,
+    is_duplicate_order_number,
+    valid_direction
+)
+from search import SEARCH_QUERIES, search_entities
+from stage_fields import stage_carrier_fields
+from order_stages import load_order_stages
+from export import EXPORT_CONTENT_TYPES, export_orders, parse_export_range
+from availability import conflict_response, find_available, find_stage_conflicts, parse_window
+from asset_usage import parse_date_range, refresh_asset_usage, usage_spans, utilization_report
+from unit_of_work import UnitOfWork, run_in_unit_of_work
+from soft_delete import detach_deleted_orders, soft_delete_order
+from idempotency import run_idempotent
+from replica import READ_URL as REPLICA_READ_URL, add_route_headers, choose_connect, track_write_token
+from async_api import ASYNC_DB, STATS_QUERIES, is_async_request, run_async
+from single_flight import coalesce, flights
+from versioning import (
+    bump_order_version,
+    invalid_version_response,
+    missing_version_response,
+    parse_expected_version,
+    version_conflict_response
+)
+from notifications import notify_telegram
+from order_summary import (
+    refresh_order_summary,
+    refresh_order_summary_for_customer,
+    refresh_order_summary_for_driver,
+    refresh_order_summary_for_vehicle
+)
 
 def get_db_connection():
     dsn = os.environ['DATABASE_URL']
-    return psycopg2.connect(dsn)
+    return bind_schema(psycopg2.connect(dsn, cursor_factory=InstrumentedCursor))
+
+def get_read_connection():
+    return bind_schema(psycopg2.connect(os.environ['DATABASE_READ_URL'], cursor_factory=InstrumentedCursor))
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     API для управления транспортным порталом: заказы, водители, автомобили, клиенты, настройки Telegram бота
     '''
+    try:
+        schema = request_schema(event)
+    except UnknownTenant as e:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': dumps({'error': str(e)}),
+            'isBase64Encoded': False
+        }
+    # Схема филиала привязывается к каждому соединению запроса (db_schema.bind_schema)
+    with use_schema(schema):
+        return coalesce(event, lambda: dispatch_request(event, context))
+
+def dispatch_request(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    if ASYNC_DB and is_async_request(event):
+        return run_async(event, context)
+    return handle_request(event, context)
+
+def handle_request(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''
+    Синхронная обработка: единица работы на соединении psycopg2
+    '''
+    stats = start_request()
+    connect, route = choose_connect(event, get_db_connection, get_read_connection if REPLICA_READ_URL else None)
+    
+    def work(uow: UnitOfWork) -> Dict[str, Any]:
+        track_write_token(event, uow, route)
+        return run_idempotent(event, uow, lambda: route_request(event, context, uow))
+    
+    response = run_in_unit_of_work(connect, work)
+    response = add_route_headers(event, response, route)
+    response = finish_request(stats, event, response)
+    return compress_response(event, response)
+
+def route_request(event: Dict[str, Any], context: Any, uow: UnitOfWork) -> Dict[str, Any]:
+    '''
+    Маршрутизация запроса по методу, resource и action.
+    Соединением и транзакцией владеет uow: коммит/откат и закрытие - в run_in_unit_of_work
+    '''
     method = event.get('httpMethod', 'GET')
     
     if method == 'OPTIONS':
@@ -22,7 +100,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
+                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, Idempotency-Key, X-Read-After, X-Tenant',
                 'Access-Control-Max-Age': '86400'
             },
             'body': '',
@@ -32,601 +110,561 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     path = event.get('path', '/')
     query_params = event.get('queryStringParameters', {}) or {}
     
-    conn = get_db_connection()
-    cur = conn.cursor()
+    conn = uow.connection
+    cur = uow.cursor
     
-    try:
-        if method == 'GET':
-            resource = query_params.get('resource', 'orders')
+    if method == 'GET':
+        resource = query_params.get('resource', 'orders')
+        
+        if resource == 'orders':
+            # Все вычисляемые поля берутся из read-модели order_summary
+            cur.execute('''
+                SELECT 
+                    o.id, o.order_number, o.order_date::date as order_date,
+                    to_char(o.order_date, 'DD.MM.YYYY') as order_date_display,
+                    o.status,
+                    c.name as client_name,
+                    c.id as client_id,
+                    o.customer_items,
+                    o.invoice, o.track_number, o.cargo_type, 
+                    o.cargo_weight, o.notes,
+                    o.fito_order_date::date as fito_order_date,
+                    o.fito_ready_date::date as fito_ready_date,
+                    o.fito_received_date::date as fito_received_date,
+                    COALESCE(s.customer_display, '—') as customer_display,
+                    s.route_from, s.route_to,
+                    s.license_plate, s.vehicle_model, s.vehicle_id,
+                    s.driver_name, s.driver_id,
+                    s.carrier, s.phone, s.border_crossing,
+                    COALESCE(s.stage_count, 0) as stage_count,
+                    o.version
+                FROM orders o
+                LEFT JOIN clients c ON o.client_id = c.id
+                LEFT JOIN order_summary s ON s.order_id = o.id
+                WHERE o.deleted_at IS NULL
+                ORDER BY o.order_date DESC
+            ''')
             
-            if resource == 'orders':
-                cur.execute('''
-                    SELECT 
-                        o.id, o.order_number, o.order_date, o.status,
-                        c.name as client_name,
-                        c.id as client_id,
-                        o.customer_items,
-                        o.invoice, o.track_number, o.cargo_type, 
-                        o.cargo_weight, o.notes,
-                        o.fito_order_date, o.fito_ready_date, o.fito_received_date
-                    FROM orders o
-                    LEFT JOIN clients c ON o.client_id = c.id
-                    ORDER BY o.order_date DESC
-                ''')
-                
-                columns = [desc[0] for desc in cur.description]
-                orders = [dict(zip(columns, row)) for row in cur.fetchall()]
-                
-                for order in orders:
-                    if order.get('order_date'):
-                        order['order_date_display'] = order['order_date'].strftime('%d.%m.%Y')
-                        order['order_date'] = order['order_date'].strftime('%Y-%m-%d')
-                    
-                    if order.get('fito_order_date'):
-                        order['fito_order_date'] = order['fito_order_date'].strftime('%Y-%m-%d')
-                    if order.get('fito_ready_date'):
-                        order['fito_ready_date'] = order['fito_ready_date'].strftime('%Y-%m-%d')
-                    if order.get('fito_received_date'):
-                        order['fito_received_date'] = order['fito_received_date'].strftime('%Y-%m-%d')
-                    
-                    if order.get('customer_items'):
-                        customer_items = order['customer_items']
-                        customer_names = []
-                        for item in customer_items:
-                            cur.execute('SELECT nickname, company_name FROM customers WHERE id = %s', (item.get('customer_id'),))
-                            customer = cur.fetchone()
-                            if customer:
-                                note = f" ({item['note']})" if item.get('note') else ''
-                                customer_names.append(f"{customer[0]}{note}")
-                        order['customer_display'] = ', '.join(customer_names) if customer_names else '—'
-                    else:
-                        order['customer_display'] = '—'
-                    
-                    # Получаем первый этап для обратной совместимости
-                    cur.execute('''
-                        SELECT 
-                            s.from_location, s.to_location, s.notes,
-                            v.license_plate, v.model as vehicle_model, v.id as vehicle_id,
-                            d.full_name as driver_name, d.id as driver_id
-                        FROM order_transport_stages s
-                        LEFT JOIN vehicles v ON s.vehicle_id = v.id
-                        LEFT JOIN drivers d ON s.driver_id = d.id
-                        WHERE s.order_id = %s
-                        ORDER BY s.stage_number
-                        LIMIT 1
-                    ''', (order['id'],))
-                    
-                    stage = cur.fetchone()
-                    if stage:
-                        stage_cols = [desc[0] for desc in cur.description]
-                        stage_data = dict(zip(stage_cols, stage))
-                        order['route_from'] = stage_data.get('from_location')
-                        order['route_to'] = stage_data.get('to_location')
-                        order['license_plate'] = stage_data.get('license_plate')
-                        order['vehicle_model'] = stage_data.get('vehicle_model')
-                        order['vehicle_id'] = stage_data.get('vehicle_id')
-                        order['driver_name'] = stage_data.get('driver_name')
-                        order['driver_id'] = stage_data.get('driver_id')
-                        
-                        notes = stage_data.get('notes', '')
-                        if notes:
-                            if 'Перевозчик:' in notes:
-                                carrier_part = notes.split('Перевозчик:')[1].split(',')[0].strip()
-                                order['carrier'] = carrier_part
-                            if 'Тел:' in notes:
-                                phone_part = notes.split('Тел:')[1].split(',')[0].strip()
-                                order['phone'] = phone_part
-                            if 'Граница:' in notes:
-                                border_part = notes.split('Граница:')[1].split(',')[0].strip()
-                                order['border_crossing'] = border_part
-                    
-                    # Получаем количество этапов
-                    cur.execute('''
-                        SELECT COUNT(*) FROM order_transport_stages WHERE order_id = %s
-                    ''', (order['id'],))
-                    stage_count = cur.fetchone()[0]
-                    order['stage_count'] = stage_count
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'orders': orders}),
-                    'isBase64Encoded': False
-                }
+            orders = fetch_rows(cur, query_params, (
+                'status', 'client_name', 'customer_display', 'route_from', 'route_to',
+                'carrier', 'border_crossing', 'cargo_type'
+            ))
             
-            elif resource == 'drivers':
-                cur.execute('''
-                    SELECT id, last_name, first_name, middle_name, 
-                           phone, additional_phone,
-                           passport_series, passport_number, 
-                           passport_issued_by, passport_issue_date,
-                           license_series, license_number, 
-                           license_issued_by, license_issue_date, 
-                           status, created_at, updated_at
-                    FROM drivers 
-                    ORDER BY last_name, first_name
-                ''')
-                columns = [desc[0] for desc in cur.description]
-                drivers = [dict(zip(columns, row)) for row in cur.fetchall()]
-                
-                for driver in drivers:
-                    if driver.get('created_at'):
-                        driver['created_at'] = driver['created_at'].strftime('%d.%m.%Y %H:%M')
-                    if driver.get('updated_at'):
-                        driver['updated_at'] = driver['updated_at'].strftime('%d.%m.%Y %H:%M')
-                    if driver.get('passport_issue_date'):
-                        driver['passport_issue_date'] = driver['passport_issue_date'].strftime('%Y-%m-%d')
-                    if driver.get('license_issue_date'):
-                        driver['license_issue_date'] = driver['license_issue_date'].strftime('%Y-%m-%d')
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'drivers': drivers}),
-                    'isBase64Encoded': False
-                }
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': dumps({'orders': orders}),
+                'isBase64Encoded': False
+            }
+        
+        elif resource == 'drivers':
+            cur.execute('''
+                SELECT id, last_name, first_name, middle_name, 
+                       phone, additional_phone,
+                       passport_series, passport_number, 
+                       passport_issued_by, passport_issue_date::date as passport_issue_date,
+                       license_series, license_number, 
+                       license_issued_by, license_issue_date::date as license_issue_date, 
+                       status, created_at, updated_at
+                FROM drivers 
+                ORDER BY last_name, first_name
+            ''')
+            drivers = fetch_rows(cur, query_params, ('status',))
             
-            elif resource == 'vehicles':
-                cur.execute('''
-                    SELECT id, license_plate, model, capacity, status, 
-                           vehicle_brand, trailer_plate, body_type, 
-                           company_name, driver_id, 
-                           COALESCE(
-                               vehicle_brand || ' ' || license_plate || 
-                               CASE WHEN trailer_plate IS NOT NULL AND trailer_plate != '' 
-                                    THEN ' / ' || trailer_plate 
-                                    ELSE '' 
-                               END,
-                               license_plate
-                           ) as display_name
-                    FROM vehicles 
-                    ORDER BY license_plate
-                ''')
-                columns = [desc[0] for desc in cur.description]
-                vehicles = [dict(zip(columns, row)) for row in cur.fetchall()]
-                
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': dumps({'drivers': drivers}),
+                'isBase64Encoded': False
+            }
+        
+        elif resource == 'vehicles':
+            cur.execute('''
+                SELECT id, license_plate, model, capacity, status, 
+                       vehicle_brand, trailer_plate, body_type, 
+                       company_name, driver_id, 
+                       COALESCE(
+                           vehicle_brand || ' ' || license_plate || 
+                           CASE WHEN trailer_plate IS NOT NULL AND trailer_plate != '' 
+                                THEN ' / ' || trailer_plate 
+                                ELSE '' 
+                           END,
+                           license_plate
+                       ) as display_name
+                FROM vehicles 
+                ORDER BY license_plate
+            ''')
+            vehicles = fetch_rows(cur, query_params, ('status', 'vehicle_brand', 'body_type', 'company_name'))
+            
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': dumps({'vehicles': vehicles}),
+                'isBase64Encoded': False
+            }
+        
+        elif resource == 'clients':
+            cur.execute('SELECT id, name, contact_person, phone, email, address FROM clients ORDER BY name')
+            clients = fetch_rows(cur, query_params)
+            
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': dumps({'clients': clients}),
+                'isBase64Encoded': False
+            }
+        
+        elif resource == 'customer_addresses':
+            customer_id = query_params.get('customer_id')
+            if not customer_id:
                 return {
-                    'statusCode': 200,
+                    'statusCode': 400,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'vehicles': vehicles}),
+                    'body': dumps({'error': 'customer_id required'}),
                     'isBase64Encoded': False
                 }
             
-            elif resource == 'clients':
-                cur.execute('SELECT id, name, contact_person, phone, email, address FROM clients ORDER BY name')
-                columns = [desc[0] for desc in cur.description]
-                clients = [dict(zip(columns, row)) for row in cur.fetchall()]
-                
+            cur.execute('''
+                SELECT id, customer_id, address_name, address, contact_person, phone, is_primary
+                FROM customer_delivery_addresses
+                WHERE customer_id = %s
+                ORDER BY is_primary DESC, address_name
+            ''', (customer_id,))
+            columns = [desc[0] for desc in cur.description]
+            addresses = [dict(zip(columns, row)) for row in cur.fetchall()]
+            
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': dumps({'addresses': addresses}),
+                'isBase64Encoded': False
+            }
+        
+        elif resource == 'order_stages':
+            order_id = query_params.get('order_id')
+            order_ids_param = query_params.get('order_ids')
+            if not order_id and not order_ids_param:
                 return {
-                    'statusCode': 200,
+                    'statusCode': 400,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'clients': clients}),
+                    'body': dumps({'error': 'order_id or order_ids required'}),
                     'isBase64Encoded': False
                 }
             
-            elif resource == 'customer_addresses':
-                customer_id = query_params.get('customer_id')
-                if not customer_id:
+            if order_ids_param:
+                # Пакетный режим: order_ids=1,2,3 - три запроса на весь набор
+                try:
+                    order_ids = list(dict.fromkeys(int(oid) for oid in order_ids_param.split(',') if oid.strip()))
+                except ValueError:
                     return {
                         'statusCode': 400,
                         'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'customer_id required'}),
+                        'body': dumps({'error': 'order_ids must be comma-separated integers'}),
                         'isBase64Encoded': False
                     }
                 
-                cur.execute('''
-                    SELECT id, customer_id, address_name, address, contact_person, phone, is_primary
-                    FROM customer_delivery_addresses
-                    WHERE customer_id = %s
-                    ORDER BY is_primary DESC, address_name
-                ''', (customer_id,))
-                columns = [desc[0] for desc in cur.description]
-                addresses = [dict(zip(columns, row)) for row in cur.fetchall()]
+                stages_by_order = load_order_stages(cur, order_ids)
                 
                 return {
                     'statusCode': 200,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'addresses': addresses}),
+                    'body': dumps({'stages_by_order': {str(oid): stages for oid, stages in stages_by_order.items()}}),
                     'isBase64Encoded': False
                 }
             
-            elif resource == 'order_stages':
-                order_id = query_params.get('order_id')
-                if not order_id:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'order_id required'}),
-                        'isBase64Encoded': False
-                    }
-                
-                # Получаем этапы перевозки из order_transport_stages
-                cur.execute('''
-                    SELECT 
-                        s.id, 
-                        s.stage_number,
-                        s.from_location || ' → ' || s.to_location as stage_name,
-                        s.from_location,
-                        s.to_location,
-                        s.vehicle_id,
-                        s.driver_id,
-                        s.notes,
-                        s.status,
-                        v.license_plate,
-                        v.model as vehicle_model,
-                        d.last_name || ' ' || d.first_name as driver_name,
-                        d.phone as driver_phone,
-                        d.additional_phone as driver_additional_phone,
-                        s.planned_departure,
-                        s.planned_arrival,
-                        s.actual_departure,
-                        s.actual_arrival
-                    FROM order_transport_stages s
-                    LEFT JOIN vehicles v ON s.vehicle_id = v.id
-                    LEFT JOIN drivers d ON s.driver_id = d.id
-                    WHERE s.order_id = %s
-                    ORDER BY s.stage_number
-                ''', (order_id,))
-                
-                columns = [desc[0] for desc in cur.description]
-                stages = [dict(zip(columns, row)) for row in cur.fetchall()]
-                
-                # Форматируем этапы для отображения
-                formatted_stages = []
-                for stage in stages:
-                    # Получаем таможенные пункты для этого этапа
-                    cur.execute('''
-                        SELECT id, customs_name 
-                        FROM order_customs_points 
-                        WHERE stage_id = %s
-                        ORDER BY id
-                    ''', (stage['id'],))
-                    customs_columns = [desc[0] for desc in cur.description]
-                    customs_points = [dict(zip(customs_columns, row)) for row in cur.fetchall()]
-                    
-                    # Получаем промежуточные точки для этого этапа
-                    cur.execute('''
-                        SELECT id, waypoint_order, customer_id, delivery_address_id, location, waypoint_type, planned_time, actual_time, cargo_description, notes
-                        FROM stage_waypoints
-                        WHERE stage_id = %s
-                        ORDER BY waypoint_order
-                    ''', (stage['id'],))
-                    waypoints_columns = [desc[0] for desc in cur.description]
-                    waypoints = [dict(zip(waypoints_columns, row)) for row in cur.fetchall()]
-                    
-                    formatted_stage = {
-                        'id': stage['id'],
-                        'stage_number': stage['stage_number'],
-                        'stage_name': f"Этап {stage['stage_number']}: {stage['stage_name']}",
-                        'from_location': stage['from_location'],
-                        'to_location': stage['to_location'],
-                        'planned_departure': stage.get('planned_departure').strftime('%Y-%m-%d') if stage.get('planned_departure') else None,
-                        'vehicle_id': stage['vehicle_id'],
-                        'driver_id': stage['driver_id'],
-                        'driver_phone': stage.get('driver_phone') or '',
-                        'driver_additional_phone': stage.get('driver_additional_phone') or '',
-                        'customs_points': customs_points,
-                        'waypoints': waypoints,
-                        'notes': stage.get('notes') or '',
-                        'description': f"{stage['driver_name']} | {stage['license_plate']} {stage['vehicle_model']}" if stage.get('driver_name') else '',
-                        'is_completed': stage['status'] == 'completed',
-                        'completed_by': None,
-                        'completed_at': stage.get('actual_arrival')
-                    }
-                    
-                    if stage.get('notes'):
-                        formatted_stage['description'] += f"\n{stage['notes']}"
-                    
-                    if formatted_stage['is_completed'] and stage.get('actual_arrival'):
-                        formatted_stage['completed_at'] = stage['actual_arrival'].strftime('%d.%m.%Y %H:%M')
-                    
-                    formatted_stages.append(formatted_stage)
-                
+            try:
+                order_id = int(order_id)
+            except ValueError:
                 return {
-                    'statusCode': 200,
+                    'statusCode': 400,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'stages': formatted_stages}),
+                    'body': dumps({'error': 'order_id must be an integer'}),
                     'isBase64Encoded': False
                 }
             
-            elif resource == 'stats':
-                cur.execute("SELECT COUNT(*) FROM orders WHERE status != 'delivered'")
-                active_orders = cur.fetchone()[0]
-                
-                cur.execute("SELECT COUNT(*) FROM orders WHERE status = 'in_transit'")
-                in_transit = cur.fetchone()[0]
-                
-                cur.execute("SELECT COUNT(*) FROM drivers")
-                total_drivers = cur.fetchone()[0]
-                
-                cur.execute("SELECT COUNT(*) FROM vehicles")
-                total_vehicles = cur.fetchone()[0]
-                
+            formatted_stages = load_order_stages(cur, [order_id])[order_id]
+            
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': dumps({'stages': formatted_stages}),
+                'isBase64Encoded': False
+            }
+        
+        elif resource == 'stats':
+            counts = {}
+            for name, query in STATS_QUERIES.items():
+                cur.execute(query)
+                counts[name] = cur.fetchone()[0]
+            
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': dumps(counts),
+                'isBase64Encoded': False
+            }
+        
+        elif resource == 'single_flight':
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': dumps(flights.counters()),
+                'isBase64Encoded': False
+            }
+        
+        elif resource == 'activity_log':
+            order_id = query_params.get('order_id')
+            if order_id:
+                cur.execute('''
+                    SELECT al.id, al.order_id, al.user_role, al.user_name, al.action_type, al.description, al.created_at
+                    FROM activity_log al
+                    JOIN orders o ON o.id = al.order_id
+                    WHERE al.order_id = %s AND o.deleted_at IS NULL
+                    ORDER BY al.created_at DESC
+                ''', (order_id,))
+            else:
+                cur.execute('''
+                    SELECT al.id, al.order_id, al.user_role, al.user_name, al.action_type, al.description, al.created_at,
+                           o.order_number
+                    FROM activity_log al
+                    LEFT JOIN orders o ON al.order_id = o.id
+                    WHERE o.deleted_at IS NULL
+                    ORDER BY al.created_at DESC
+                    LIMIT 100
+                ''')
+            
+            logs = fetch_rows(cur, query_params, ('user_role', 'user_name', 'action_type', 'order_number'))
+            
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': dumps({'logs': logs}),
+                'isBase64Encoded': False
+            }
+        
+        elif resource == 'last_order_number':
+            direction = query_params.get('direction', 'EU')
+            date_str = query_params.get('date', '')
+            
+            if not valid_direction(direction) or not (len(date_str) == 8 and date_str.isdigit()):
                 return {
-                    'statusCode': 200,
+                    'statusCode': 400,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({
-                        'active_orders': active_orders,
-                        'in_transit': in_transit,
-                        'total_drivers': total_drivers,
-                        'total_vehicles': total_vehicles
-                    }),
+                    'body': dumps({'error': f'direction (up to {MAX_DIRECTION_LENGTH} letters) and date (ddmmyyyy) required'}),
                     'isBase64Encoded': False
                 }
             
-            elif resource == 'activity_log':
-                order_id = query_params.get('order_id')
-                if order_id:
-                    cur.execute('''
-                        SELECT id, order_id, user_role, user_name, action_type, description, created_at
-                        FROM activity_log
-                        WHERE order_id = %s
-                        ORDER BY created_at DESC
-                    ''', (order_id,))
-                else:
-                    cur.execute('''
-                        SELECT al.id, al.order_id, al.user_role, al.user_name, al.action_type, al.description, al.created_at,
-                               o.order_number
-                        FROM activity_log al
-                        LEFT JOIN orders o ON al.order_id = o.id
-                        ORDER BY al.created_at DESC
-                        LIMIT 100
-                    ''')
-                
-                columns = [desc[0] for desc in cur.description]
-                logs = [dict(zip(columns, row)) for row in cur.fetchall()]
-                
-                for log in logs:
-                    if log.get('created_at'):
-                        log['created_at'] = log['created_at'].strftime('%d.%m.%Y %H:%M')
-                
+            # Выделяем номер из счётчика (направление, дата) или просроченного резерва
+            next_number, order_number = allocate_order_number(cur, direction, date_str)
+            
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': dumps({'next_number': next_number, 'order_number': order_number}),
+                'isBase64Encoded': False
+            }
+        
+        elif resource == 'users':
+            cur.execute('''
+                SELECT id, username, full_name, email, phone, role, is_active, created_at,
+                       invite_code, telegram_chat_id, telegram_connected_at,
+                       COALESCE(telegram_chat_id::text, '') <> '' as telegram_connected
+                FROM users
+                ORDER BY created_at DESC
+            ''')
+            users = fetch_rows(cur, query_params, ('role',))
+            
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': dumps({'users': users}),
+                'isBase64Encoded': False
+            }
+        
+        elif resource == 'roles':
+            cur.execute('''
+                SELECT id, role_name, display_name, permissions
+                FROM roles
+                ORDER BY id
+            ''')
+            roles = fetch_rows(cur, query_params)
+            
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': dumps({'roles': roles}),
+                'isBase64Encoded': False
+            }
+        
+        elif resource == 'customers':
+            cur.execute('''
+                SELECT id, company_name, inn, kpp, legal_address, director_name, 
+                       delivery_address, nickname, contact_person, phone, email,
+                       to_char(created_at, 'DD.MM.YYYY') as created_at
+                FROM customers
+                ORDER BY company_name
+            ''')
+            customers = fetch_rows(cur, query_params)
+            
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': dumps({'customers': customers}),
+                'isBase64Encoded': False
+            }
+        
+        elif resource == 'customer_addresses':
+            customer_id = query_params.get('customer_id')
+            if not customer_id:
                 return {
-                    'statusCode': 200,
+                    'statusCode': 400,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'logs': logs}),
+                    'body': dumps({'error': 'customer_id required'}),
                     'isBase64Encoded': False
                 }
             
-            elif resource == 'last_order_number':
-                direction = query_params.get('direction', 'EU')
-                date_str = query_params.get('date', '')
-                
-                # Получаем последний номер заказа с таким направлением и датой
-                cur.execute('''
-                    SELECT order_number FROM orders 
-                    WHERE order_number LIKE %s 
-                    ORDER BY id DESC 
-                    LIMIT 1
-                ''', (f'{direction}{date_str}-%',))
+            cur.execute('''
+                SELECT id, customer_id, address_name, address, contact_person, phone, is_primary,
+                       to_char(created_at, 'DD.MM.YYYY') as created_at
+                FROM customer_delivery_addresses
+                WHERE customer_id = %s
+                ORDER BY is_primary DESC, address_name
+            ''', (customer_id,))
+            columns = [desc[0] for desc in cur.description]
+            addresses = [dict(zip(columns, row)) for row in cur.fetchall()]
+            
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': dumps({'addresses': addresses}),
+                'isBase64Encoded': False
+            }
+        
+        elif resource == 'telegram_settings':
+            cur.execute('''
+                SELECT bot_token, chat_id, is_active
+                FROM telegram_bot_settings
+                ORDER BY id DESC
+                LIMIT 1
+            ''')
+            row = cur.fetchone()
+            # Дальше только запрос к api.telegram.org - соединение с базой больше не держим
+            uow.release(commit=True)
+            
+            if row:
+                bot_token = row[0]
+                bot_username = None
                 
-                result = cur.fetchone()
-                if result:
-                    # Извлекаем номер после последнего дефиса
-                    last_num = result[0].split('-')[-1]
+                if bot_token:
                     try:
-                        next_num = int(last_num) + 1
-                        next_number = str(next_num).zfill(3)
-                    except ValueError:
-                        next_number = '001'
-                else:
-                    next_number = '001'
+                        import urllib.request as req_module
+                        url = f'https://api.telegram.org/bot{bot_token}/getMe'
+                        req = req_module.Request(url)
+                        with req_module.urlopen(req, timeout=5) as response:
+                            result = json.loads(response.read().decode('utf-8'))
+                            if result.get('ok'):
+                                bot_username = result.get('result', {}).get('username')
+                    except:
+                        pass
                 
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'next_number': next_number}),
-                    'isBase64Encoded': False
+                settings = {
+                    'bot_token': bot_token,
+                    'chat_id': row[1],
+                    'is_active': row[2],
+                    'bot_username': bot_username
                 }
+            else:
+                settings = {'bot_token': '', 'chat_id': '', 'is_active': False, 'bot_username': None}
+            
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': dumps({'settings': settings}),
+                'isBase64Encoded': False
+            }
+        
+        elif resource == 'active_sessions':
+            section_name = query_params.get('section')
+            
+            cur.execute('''
+                UPDATE user_sessions 
+                SET last_activity = CURRENT_TIMESTAMP 
+                WHERE last_activity < NOW() - INTERVAL '5 minutes'
+            ''')
             
-            elif resource == 'users':
+            if section_name:
                 cur.execute('''
-                    SELECT id, username, full_name, email, phone, role, is_active, created_at,
-                           invite_code, telegram_chat_id, telegram_connected_at
-                    FROM users
-                    ORDER BY created_at DESC
+                    SELECT user_id, full_name, role, is_editing, editing_item_id,
+                           to_char(last_activity, 'YYYY-MM-DD HH24:MI:SS') as last_activity
+                    FROM user_sessions
+                    WHERE section_name = %s 
+                    AND last_activity >= NOW() - INTERVAL '5 minutes'
+                    ORDER BY last_activity DESC
+                ''', (section_name,))
+            else:
+                cur.execute('''
+                    SELECT section_name, COUNT(*) as user_count
+                    FROM user_sessions
+                    WHERE last_activity >= NOW() - INTERVAL '5 minutes'
+                    GROUP BY section_name
                 ''')
-                columns = [desc[0] for desc in cur.description]
-                users = [dict(zip(columns, row)) for row in cur.fetchall()]
-                
-                for user in users:
-                    if user.get('created_at'):
-                        user['created_at'] = user['created_at'].strftime('%d.%m.%Y %H:%M')
-                    if user.get('telegram_connected_at'):
-                        user['telegram_connected_at'] = user['telegram_connected_at'].strftime('%d.%m.%Y %H:%M')
-                    user['telegram_connected'] = bool(user.get('telegram_chat_id'))
-                
+            
+            columns = [desc[0] for desc in cur.description]
+            sessions = [dict(zip(columns, row)) for row in cur.fetchall()]
+            
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': dumps({'sessions': sessions}),
+                'isBase64Encoded': False
+            }
+        
+        elif resource == 'contract_applications':
+            cur.execute('''
+                SELECT 
+                    ca.id, ca.contract_number, ca.contract_date::date as contract_date,
+                    ca.customer_id, ca.carrier_id,
+                    cust.nickname as customer_nickname,
+                    cust.full_legal_name as customer_full_name,
+                    cl.name as carrier_name,
+                    ca.loading_address, ca.unloading_address,
+                    ca.created_at
+                FROM contract_applications ca
+                LEFT JOIN customers cust ON ca.customer_id = cust.id
+                LEFT JOIN clients cl ON ca.carrier_id = cl.id
+                ORDER BY ca.created_at DESC
+            ''')
+            contracts = fetch_rows(cur, query_params, ('customer_nickname', 'carrier_name'))
+            
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': dumps({'contracts': contracts}),
+                'isBase64Encoded': False
+            }
+        
+        elif resource == 'export':
+            file_format = query_params.get('file_format', 'csv')
+            if file_format not in EXPORT_CONTENT_TYPES:
                 return {
-                    'statusCode': 200,
+                    'statusCode': 400,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'users': users}),
+                    'body': dumps({'error': 'file_format must be csv or xlsx'}),
                     'isBase64Encoded': False
                 }
             
-            elif resource == 'roles':
-                cur.execute('''
-                    SELECT id, role_name, display_name, permissions
-                    FROM roles
-                    ORDER BY id
-                ''')
-                columns = [desc[0] for desc in cur.description]
-                roles = [dict(zip(columns, row)) for row in cur.fetchall()]
-                
+            date_range = parse_export_range(query_params.get('from'), query_params.get('to'))
+            if date_range is None:
                 return {
-                    'statusCode': 200,
+                    'statusCode': 400,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'roles': roles}),
+                    'body': dumps({'error': 'from and to must be YYYY-MM-DD, from not after to'}),
                     'isBase64Encoded': False
                 }
             
-            elif resource == 'customers':
-                cur.execute('''
-                    SELECT id, company_name, inn, kpp, legal_address, director_name, 
-                           delivery_address, nickname, contact_person, phone, email, created_at
-                    FROM customers
-                    ORDER BY company_name
-                ''')
-                columns = [desc[0] for desc in cur.description]
-                customers = [dict(zip(columns, row)) for row in cur.fetchall()]
-                
-                for customer in customers:
-                    if customer.get('created_at'):
-                        customer['created_at'] = customer['created_at'].strftime('%d.%m.%Y')
-                
+            url, rows_count = export_orders(conn, file_format, date_range[0], date_range[1],
+                                            lambda: uow.release(commit=True))
+            
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': dumps({'success': True, 'url': url, 'rows': rows_count}),
+                'isBase64Encoded': False
+            }
+        
+        elif resource == 'search':
+            q = (query_params.get('q') or '').strip()
+            if len(q) < 2:
                 return {
-                    'statusCode': 200,
+                    'statusCode': 400,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'customers': customers}),
+                    'body': dumps({'error': 'q must be at least 2 characters'}),
                     'isBase64Encoded': False
                 }
             
-            elif resource == 'customer_addresses':
-                customer_id = query_params.get('customer_id')
-                if not customer_id:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'customer_id required'}),
-                        'isBase64Encoded': False
-                    }
-                
-                cur.execute('''
-                    SELECT id, customer_id, address_name, address, contact_person, phone, is_primary, created_at
-                    FROM customer_delivery_addresses
-                    WHERE customer_id = %s
-                    ORDER BY is_primary DESC, address_name
-                ''', (customer_id,))
-                columns = [desc[0] for desc in cur.description]
-                addresses = [dict(zip(columns, row)) for row in cur.fetchall()]
-                
-                for addr in addresses:
-                    if addr.get('created_at'):
-                        addr['created_at'] = addr['created_at'].strftime('%d.%m.%Y')
-                
+            types_param = query_params.get('types')
+            types = types_param.split(',') if types_param else list(SEARCH_QUERIES.keys())
+            try:
+                limit = min(max(int(query_params.get('limit', 20)), 1), 100)
+                offset = max(int(query_params.get('offset', 0)), 0)
+            except ValueError:
                 return {
-                    'statusCode': 200,
+                    'statusCode': 400,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'addresses': addresses}),
+                    'body': dumps({'error': 'limit and offset must be integers'}),
                     'isBase64Encoded': False
                 }
             
-            elif resource == 'telegram_settings':
-                cur.execute('''
-                    SELECT bot_token, chat_id, is_active
-                    FROM telegram_bot_settings
-                    ORDER BY id DESC
-                    LIMIT 1
-                ''')
-                row = cur.fetchone()
-                
-                if row:
-                    bot_token = row[0]
-                    bot_username = None
-                    
-                    if bot_token:
-                        try:
-                            import urllib.request as req_module
-                            url = f'https://api.telegram.org/bot{bot_token}/getMe'
-                            req = req_module.Request(url)
-                            with req_module.urlopen(req, timeout=5) as response:
-                                result = json.loads(response.read().decode('utf-8'))
-                                if result.get('ok'):
-                                    bot_username = result.get('result', {}).get('username')
-                        except:
-                            pass
-                    
-                    settings = {
-                        'bot_token': bot_token,
-                        'chat_id': row[1],
-                        'is_active': row[2],
-                        'bot_username': bot_username
-                    }
-                else:
-                    settings = {'bot_token': '', 'chat_id': '', 'is_active': False, 'bot_username': None}
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'settings': settings}),
-                    'isBase64Encoded': False
-                }
+            found = search_entities(cur, q, types, limit, offset)
             
-            elif resource == 'active_sessions':
-                section_name = query_params.get('section')
-                
-                cur.execute('''
-                    UPDATE user_sessions 
-                    SET last_activity = CURRENT_TIMESTAMP 
-                    WHERE last_activity < NOW() - INTERVAL '5 minutes'
-                ''')
-                
-                if section_name:
-                    cur.execute('''
-                        SELECT user_id, full_name, role, is_editing, editing_item_id, last_activity
-                        FROM user_sessions
-                        WHERE section_name = %s 
-                        AND last_activity >= NOW() - INTERVAL '5 minutes'
-                        ORDER BY last_activity DESC
-                    ''', (section_name,))
-                else:
-                    cur.execute('''
-                        SELECT section_name, COUNT(*) as user_count
-                        FROM user_sessions
-                        WHERE last_activity >= NOW() - INTERVAL '5 minutes'
-                        GROUP BY section_name
-                    ''')
-                
-                columns = [desc[0] for desc in cur.description]
-                sessions = [dict(zip(columns, row)) for row in cur.fetchall()]
-                
-                for session in sessions:
-                    if session.get('last_activity'):
-                        session['last_activity'] = session['last_activity'].strftime('%Y-%m-%d %H:%M:%S')
-                
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': dumps({
+                    'results': found['results'],
+                    'has_more': found['has_more'],
+                    'limit': limit,
+                    'offset': offset
+                }),
+                'isBase64Encoded': False
+            }
+        
+        elif resource == 'availability':
+            window = parse_window(query_params.get('from'), query_params.get('to'))
+            if window is None:
                 return {
-                    'statusCode': 200,
+                    'statusCode': 400,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'sessions': sessions}),
+                    'body': dumps({'error': 'from and to (YYYY-MM-DD) required, from < to'}),
                     'isBase64Encoded': False
                 }
             
-            elif resource == 'contract_applications':
-                cur.execute('''
-                    SELECT 
-                        ca.id, ca.contract_number, ca.contract_date,
-                        ca.customer_id, ca.carrier_id,
-                        cust.nickname as customer_nickname,
-                        cust.full_legal_name as customer_full_name,
-                        cl.name as carrier_name,
-                        ca.loading_address, ca.unloading_address,
-                        ca.created_at
-                    FROM t_p96093837_transport_portal_fir.contract_applications ca
-                    LEFT JOIN t_p96093837_transport_portal_fir.customers cust ON ca.customer_id = cust.id
-                    LEFT JOIN t_p96093837_transport_portal_fir.clients cl ON ca.carrier_id = cl.id
-                    ORDER BY ca.created_at DESC
-                ''')
-                columns = [desc[0] for desc in cur.description]
-                contracts = [dict(zip(columns, row)) for row in cur.fetchall()]
-                
-                for contract in contracts:
-                    if contract.get('contract_date'):
-                        contract['contract_date'] = contract['contract_date'].strftime('%Y-%m-%d')
-                    if contract.get('created_at'):
-                        contract['created_at'] = contract['created_at'].strftime('%d.%m.%Y %H:%M')
-                
+            available = find_available(cur, *window)
+            
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': dumps({
+                    'from': query_params.get('from'),
+                    'to': query_params.get('to'),
+                    'vehicles': available['vehicles'],
+                    'drivers': available['drivers']
+                }),
+                'isBase64Encoded': False
+            }
+        
+        elif resource == 'utilization':
+            date_range = parse_date_range(query_params.get('from'), query_params.get('to'))
+            asset_type = query_params.get('asset_type')
+            if date_range is None or asset_type not in (None, 'vehicle', 'driver'):
                 return {
-                    'statusCode': 200,
+                    'statusCode': 400,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'contracts': contracts}),
+                    'body': dumps({'error': 'from and to (YYYY-MM-DD) required, asset_type is vehicle or driver'}),
                     'isBase64Encoded': False
                 }
+            
+            report = utilization_report(cur, date_range[0], date_range[1], asset_type)
+            
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': dumps({
+                    'from': query_params.get('from'),
+                    'to': query_params.get('to'),
+                    **report
+                }),
+                'isBase64Encoded': False
+            }
+    
+    elif method == 'POST':
+        body_data = json.loads(event.get('body', '{}'))
+        action = body_data.get('action')
         
-        elif method == 'POST':
-            body_data = json.loads(event.get('body', '{}'))
-            action = body_data.get('action')
+        if action == 'create_order':
+            data = body_data.get('data', {})
             
-            if action == 'create_order':
-                data = body_data.get('data', {})
-                
+            try:
                 cur.execute('''
                     INSERT INTO orders (
                         order_number, client_id, carrier, vehicle_id, driver_id,
@@ -650,47 +688,53 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     data.get('delivery_address'),
                     data.get('overload')
                 ))
-                
-                order_id = cur.fetchone()[0]
-                
-                stages = [
-                    'Заказ подтвержден поставщиком',
-                    'Заказ отгружен',
-                    'В пути к клиенту',
-                    'Доставлен клиенту'
-                ]
-                
-                for idx, stage_name in enumerate(stages, 1):
-                    cur.execute('''
-                        INSERT INTO order_stages (order_id, stage_name, stage_order, is_completed)
-                        VALUES (%s, %s, %s, %s)
-                    ''', (order_id, stage_name, idx, False))
-                
-                user_role = body_data.get('user_role', 'Пользователь')
-                user_name = body_data.get('user_name', user_role)
-                
+            except psycopg2.errors.UniqueViolation as e:
+                if not is_duplicate_order_number(e):
+                    raise
+                return duplicate_number_response(data.get('order_number'))
+            
+            order_id = cur.fetchone()[0]
+            
+            stages = [
+                'Заказ подтвержден поставщиком',
+                'Заказ отгружен',
+                'В пути к клиенту',
+                'Доставлен клиенту'
+            ]
+            
+            for idx, stage_name in enumerate(stages, 1):
                 cur.execute('''
-                    INSERT INTO activity_log (order_id, user_role, user_name, action_type, description)
-                    VALUES (%s, %s, %s, %s, %s)
-                ''', (order_id, user_role, user_name, 'create_order', f'создал заказ {data.get("order_number")}'))
-                
-                conn.commit()
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': True, 'order_id': order_id}),
-                    'isBase64Encoded': False
-                }
+                    INSERT INTO order_stages (order_id, stage_name, stage_order, is_completed)
+                    VALUES (%s, %s, %s, %s)
+                ''', (order_id, stage_name, idx, False))
             
-            elif action == 'create_multi_stage_order':
-                data = body_data.get('data', {})
-                order_data = data.get('order', {})
-                stages_data = data.get('stages', [])
-                customs_data = data.get('customs_points', [])
-                attachments = order_data.get('attachments', [])
-                customer_items = order_data.get('customer_items', [])
-                
+            user_role = body_data.get('user_role', 'Пользователь')
+            user_name = body_data.get('user_name', user_role)
+            
+            execute_prepared(cur, 'activity_log_insert', (order_id, user_role, user_name, 'create_order', f'создал заказ {data.get("order_number")}'))
+            
+            refresh_order_summary(cur, [order_id])
+            
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': dumps({'success': True, 'order_id': order_id}),
+                'isBase64Encoded': False
+            }
+        
+        elif action == 'create_multi_stage_order':
+            data = body_data.get('data', {})
+            order_data = data.get('order', {})
+            stages_data = data.get('stages', [])
+            customs_data = data.get('customs_points', [])
+            attachments = order_data.get('attachments', [])
+            customer_items = order_data.get('customer_items', [])
+            
+            conflicts = find_stage_conflicts(cur, stages_data)
+            if conflicts and not body_data.get('allow_overlap'):
+                return conflict_response(conflicts)
+            
+            try:
                 cur.execute('''
                     INSERT INTO orders (
                         order_number, client_id, order_date, status, attachments, customer_items,
@@ -710,196 +754,209 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     order_data.get('track_number'),
                     order_data.get('notes')
                 ))
+            except psycopg2.errors.UniqueViolation as e:
+                if not is_duplicate_order_number(e):
+                    raise
+                return duplicate_number_response(order_data.get('order_number'))
+            
+            order_id = cur.fetchone()[0]
+            consume_order_number(cur, order_data.get('order_number'), order_id)
+            
+            user_role = body_data.get('user_role', 'Пользователь')
+            user_name = body_data.get('user_name', user_role)
+            
+            for stage in stages_data:
+                carrier_fields = stage_carrier_fields(stage)
+                cur.execute('''
+                    INSERT INTO order_transport_stages (
+                        order_id, stage_number, vehicle_id, driver_id,
+                        from_location, to_location, planned_departure, planned_arrival,
+                        distance_km, notes, status, carrier, phone, border_crossing
+                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                    RETURNING id
+                ''', (
+                    order_id,
+                    stage.get('stage_number'),
+                    stage.get('vehicle_id') if stage.get('vehicle_id') else None,
+                    stage.get('driver_id') if stage.get('driver_id') else None,
+                    stage.get('from_location'),
+                    stage.get('to_location'),
+                    stage.get('planned_departure') if stage.get('planned_departure') else None,
+                    stage.get('planned_arrival') if stage.get('planned_arrival') else None,
+                    stage.get('distance_km') if stage.get('distance_km') else None,
+                    stage.get('notes'),
+                    'planned',
+                    carrier_fields['carrier'],
+                    carrier_fields['phone'],
+                    carrier_fields['border_crossing']
+                ))
+                stage_id = cur.fetchone()[0]
                 
-                order_id = cur.fetchone()[0]
+                waypoints_data = stage.get('waypoints', [])
+                for waypoint in waypoints_data:
+                    execute_prepared(cur, 'stage_waypoint_insert', (
+                        stage_id,
+                        waypoint.get('waypoint_order'),
+                        waypoint.get('customer_id') if waypoint.get('customer_id') else None,
+                        waypoint.get('delivery_address_id') if waypoint.get('delivery_address_id') else None,
+                        waypoint.get('location'),
+                        waypoint.get('waypoint_type'),
+                        waypoint.get('planned_time') if waypoint.get('planned_time') else None,
+                        waypoint.get('cargo_description'),
+                        waypoint.get('notes')
+                    ))
                 
-                user_role = body_data.get('user_role', 'Пользователь')
-                user_name = body_data.get('user_name', user_role)
+                route_desc = f"{stage.get('from_location')} → {stage.get('to_location')}"
+                execute_prepared(cur, 'activity_log_insert', (order_id, user_role, user_name, 'add_stage', f'добавил маршрут "{route_desc}"'))
                 
-                for stage in stages_data:
-                    cur.execute('''
-                        INSERT INTO order_transport_stages (
-                            order_id, stage_number, vehicle_id, driver_id,
-                            from_location, to_location, planned_departure, planned_arrival,
-                            distance_km, notes, status
-                        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                        RETURNING id
-                    ''', (
-                        order_id,
-                        stage.get('stage_number'),
-                        stage.get('vehicle_id') if stage.get('vehicle_id') else None,
-                        stage.get('driver_id') if stage.get('driver_id') else None,
-                        stage.get('from_location'),
-                        stage.get('to_location'),
-                        stage.get('planned_departure') if stage.get('planned_departure') else None,
-                        stage.get('planned_arrival') if stage.get('planned_arrival') else None,
-                        stage.get('distance_km') if stage.get('distance_km') else None,
-                        stage.get('notes'),
-                        'planned'
-                    ))
-                    stage_id = cur.fetchone()[0]
-                    
-                    waypoints_data = stage.get('waypoints', [])
-                    for waypoint in waypoints_data:
+                for customs in customs_data:
+                    if customs.get('customs_name'):
                         cur.execute('''
-                            INSERT INTO stage_waypoints (
-                                stage_id, waypoint_order, customer_id, delivery_address_id, location, waypoint_type,
-                                planned_time, cargo_description, notes
-                            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+                            INSERT INTO order_customs_points (
+                                order_id, stage_id, customs_name, country, crossing_date, notes
+                            ) VALUES (%s, %s, %s, %s, %s, %s)
                         ''', (
+                            order_id,
                             stage_id,
-                            waypoint.get('waypoint_order'),
-                            waypoint.get('customer_id') if waypoint.get('customer_id') else None,
-                            waypoint.get('delivery_address_id') if waypoint.get('delivery_address_id') else None,
-                            waypoint.get('location'),
-                            waypoint.get('waypoint_type'),
-                            waypoint.get('planned_time') if waypoint.get('planned_time') else None,
-                            waypoint.get('cargo_description'),
-                            waypoint.get('notes')
+                            customs.get('customs_name'),
+                            customs.get('country'),
+                            customs.get('crossing_date') if customs.get('crossing_date') else None,
+                            customs.get('notes')
                         ))
-                    
-                    route_desc = f"{stage.get('from_location')} → {stage.get('to_location')}"
-                    cur.execute('''
-                        INSERT INTO activity_log (order_id, user_role, user_name, action_type, description)
-                        VALUES (%s, %s, %s, %s, %s)
-                    ''', (order_id, user_role, user_name, 'add_stage', f'добавил маршрут "{route_desc}"'))
-                    
-                    for customs in customs_data:
-                        if customs.get('customs_name'):
-                            cur.execute('''
-                                INSERT INTO order_customs_points (
-                                    order_id, stage_id, customs_name, country, crossing_date, notes
-                                ) VALUES (%s, %s, %s, %s, %s, %s)
-                            ''', (
-                                order_id,
-                                stage_id,
-                                customs.get('customs_name'),
-                                customs.get('country'),
-                                customs.get('crossing_date') if customs.get('crossing_date') else None,
-                                customs.get('notes')
-                            ))
-                
-                cur.execute('''
-                    INSERT INTO activity_log (order_id, user_role, user_name, action_type, description)
-                    VALUES (%s, %s, %s, %s, %s)
-                ''', (order_id, user_role, user_name, 'create_order', f'создал заказ {order_data.get("order_number")}'))
-                
-                conn.commit()
-                
-                # Отправка уведомления в Telegram
-                try:
-                    customer_display = ''
-                    if customer_items:
-                        customer_names = []
-                        for item in customer_items:
-                            cur.execute('SELECT nickname FROM customers WHERE id = %s', (item.get('customer_id'),))
-                            customer = cur.fetchone()
-                            if customer:
-                                note = f" ({item['note']})" if item.get('note') else ''
-                                customer_names.append(f"{customer[0]}{note}")
-                        customer_display = ', '.join(customer_names)
-                    
-                    carrier_name = ''
-                    if order_data.get('client_id'):
-                        cur.execute('SELECT name FROM clients WHERE id = %s', (order_data.get('client_id'),))
-                        carrier = cur.fetchone()
-                        if carrier:
-                            carrier_name = carrier[0]
-                    
-                    route = ''
-                    if stages_data:
-                        first_stage = stages_data[0]
-                        last_stage = stages_data[-1]
-                        route = f"{first_stage.get('from_location', 'N/A')} → {last_stage.get('to_location', 'N/A')}"
-                    
-                    import urllib.request
-                    import urllib.parse
-                    
-                    telegram_payload = {
-                        'event_type': 'order_created',
-                        'order_data': {
-                            'order_id': order_id,
-                            'order_number': order_data.get('order_number'),
-                            'order_date': order_data.get('order_date'),
-                            'customers': customer_display or 'Не указано',
-                            'carrier': carrier_name or 'Не указан',
-                            'route': route or 'Не указан'
-                        }
+            
+            execute_prepared(cur, 'activity_log_insert', (order_id, user_role, user_name, 'create_order', f'создал заказ {order_data.get("order_number")}'))
+            
+            refresh_order_summary(cur, [order_id])
+            refresh_asset_usage(cur, usage_spans(cur, order_ids=[order_id]))
+            
+            # Отправка уведомления в Telegram. Выборки для текста - под точкой сохранения:
+            # их ошибка не должна оборвать транзакцию с созданным заказом
+            cur.execute('SAVEPOINT telegram_payload')
+            try:
+                customer_display = ''
+                if customer_items:
+                    customer_names = []
+                    for item in customer_items:
+                        execute_prepared(cur, 'customer_nickname_by_id', (item.get('customer_id'),))
+                        customer = cur.fetchone()
+                        if customer:
+                            note = f" ({item['note']})" if item.get('note') else ''
+                            customer_names.append(f"{customer[0]}{note}")
+                    customer_display = ', '.join(customer_names)
+                
+                carrier_name = ''
+                if order_data.get('client_id'):
+                    execute_prepared(cur, 'client_name_by_id', (order_data.get('client_id'),))
+                    carrier = cur.fetchone()
+                    if carrier:
+                        carrier_name = carrier[0]
+                
+                route = ''
+                if stages_data:
+                    first_stage = stages_data[0]
+                    last_stage = stages_data[-1]
+                    route = f"{first_stage.get('from_location', 'N/A')} → {last_stage.get('to_location', 'N/A')}"
+                
+                telegram_payload = {
+                    'event_type': 'order_created',
+                    'order_data': {
+                        'order_id': order_id,
+                        'order_number': order_data.get('order_number'),
+                        'order_date': order_data.get('order_date'),
+                        'customers': customer_display or 'Не указано',
+                        'carrier': carrier_name or 'Не указан',
+                        'route': route or 'Не указан'
                     }
-                    
-                    telegram_url = 'https://functions.poehali.dev/a5ca5f70-a100-4290-9d7c-54189ae3319e'
-                    telegram_data = json.dumps(telegram_payload).encode('utf-8')
-                    telegram_req = urllib.request.Request(telegram_url, data=telegram_data, headers={'Content-Type': 'application/json'})
-                    urllib.request.urlopen(telegram_req, timeout=5)
-                except:
-                    pass
+                }
                 
+                uow.after_release(notify_telegram, telegram_payload)
+            except:
+                cur.execute('ROLLBACK TO SAVEPOINT telegram_payload')
+            
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': dumps({'success': True, 'order_id': order_id, 'conflicts': conflicts}),
+                'isBase64Encoded': False
+            }
+        
+        elif action == 'update_order':
+            order_id = body_data.get('order_id')
+            order_data = body_data.get('order', {})
+            stages_data = body_data.get('stages', [])
+            
+            user_name = body_data.get('user_name', 'Пользователь')
+            user_role = body_data.get('user_role', 'Пользователь')
+            
+            try:
+                expected_version = parse_expected_version(body_data.get('expected_version'))
+            except ValueError:
+                return invalid_version_response()
+            if expected_version is None:
+                return missing_version_response()
+            
+            # Получаем старые данные заказа для сравнения
+            cur.execute('''
+                SELECT order_number, order_date, cargo_type, cargo_weight, 
+                       invoice, track_number, notes, customer_items, client_id
+                FROM orders WHERE id = %s AND deleted_at IS NULL
+            ''', (order_id,))
+            old_order = cur.fetchone()
+            
+            if not old_order:
                 return {
-                    'statusCode': 200,
+                    'statusCode': 404,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': True, 'order_id': order_id}),
+                    'body': dumps({'success': False, 'message': 'Заказ не найден'}),
                     'isBase64Encoded': False
                 }
             
-            elif action == 'update_order':
-                order_id = body_data.get('order_id')
-                order_data = body_data.get('order', {})
-                stages_data = body_data.get('stages', [])
-                
-                user_name = body_data.get('user_name', 'Пользователь')
-                user_role = body_data.get('user_role', 'Пользователь')
-                
-                # Получаем старые данные заказа для сравнения
-                cur.execute('''
-                    SELECT order_number, order_date, cargo_type, cargo_weight, 
-                           invoice, track_number, notes, customer_items, client_id
-                    FROM orders WHERE id = %s
-                ''', (order_id,))
-                old_order = cur.fetchone()
-                
-                if not old_order:
-                    return {
-                        'statusCode': 404,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'success': False, 'message': 'Заказ не найден'}),
-                        'isBase64Encoded': False
-                    }
-                
-                old_order_number, old_order_date, old_cargo_type, old_cargo_weight, old_invoice, old_track_number, old_notes, old_customer_items_json, old_client_id = old_order
-                
-                # Парсим старые customer_items
-                if isinstance(old_customer_items_json, str):
-                    old_customer_items = json.loads(old_customer_items_json) if old_customer_items_json else []
-                elif isinstance(old_customer_items_json, list):
-                    old_customer_items = old_customer_items_json
-                else:
-                    old_customer_items = []
-                
-                # Получаем старые маршруты для сравнения (ДО удаления!)
-                cur.execute('''
-                    SELECT stage_number, from_location, to_location, vehicle_id, driver_id, notes
-                    FROM order_transport_stages 
-                    WHERE order_id = %s 
-                    ORDER BY stage_number
-                ''', (order_id,))
-                old_stages_data = {}
-                for row in cur.fetchall():
-                    old_stages_data[row[0]] = {
-                        'from_location': row[1],
-                        'to_location': row[2],
-                        'vehicle_id': row[3],
-                        'driver_id': row[4],
-                        'notes': row[5]
-                    }
-                
-                customer_items = order_data.get('customer_items', [])
-                
+            old_order_number, old_order_date, old_cargo_type, old_cargo_weight, old_invoice, old_track_number, old_notes, old_customer_items_json, old_client_id = old_order
+            
+            # Парсим старые customer_items
+            if isinstance(old_customer_items_json, str):
+                old_customer_items = json.loads(old_customer_items_json) if old_customer_items_json else []
+            elif isinstance(old_customer_items_json, list):
+                old_customer_items = old_customer_items_json
+            else:
+                old_customer_items = []
+            
+            # Получаем старые маршруты для сравнения (ДО удаления!)
+            cur.execute('''
+                SELECT stage_number, from_location, to_location, vehicle_id, driver_id, notes, id
+                FROM order_transport_stages 
+                WHERE order_id = %s 
+                ORDER BY stage_number
+            ''', (order_id,))
+            old_stages_data = {}
+            old_stages_by_id = {}
+            for row in cur.fetchall():
+                old_stages_data[row[0]] = old_stages_by_id[row[6]] = {
+                    'id': row[6],
+                    'from_location': row[1],
+                    'to_location': row[2],
+                    'vehicle_id': row[3],
+                    'driver_id': row[4],
+                    'notes': row[5]
+                }
+            old_usage = usage_spans(cur, order_ids=[order_id])
+            
+            customer_items = order_data.get('customer_items', [])
+            
+            conflicts = find_stage_conflicts(cur, stages_data, order_id)
+            if conflicts and not body_data.get('allow_overlap'):
+                return conflict_response(conflicts)
+            
+            # Условный UPDATE: этапы ниже меняются, только если заказ никто не изменил
+            try:
                 cur.execute('''
                     UPDATE orders 
                     SET order_number = %s, order_date = %s, cargo_type = %s, 
                         cargo_weight = %s, invoice = %s, track_number = %s, 
-                        notes = %s, customer_items = %s, client_id = %s
-                    WHERE id = %s
+                        notes = %s, customer_items = %s, client_id = %s,
+                        version = version + 1
+                    WHERE id = %s AND deleted_at IS NULL AND version = %s
+                    RETURNING version
                 ''', (
                     order_data.get('order_number'),
                     order_data.get('order_date'),
@@ -910,1422 +967,1450 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     order_data.get('notes'),
                     json.dumps(customer_items),
                     order_data.get('client_id') if order_data.get('client_id') else None,
-                    order_id
+                    order_id,
+                    expected_version
                 ))
+            except psycopg2.errors.UniqueViolation as e:
+                if not is_duplicate_order_number(e):
+                    raise
+                return duplicate_number_response(order_data.get('order_number'))
+            updated = cur.fetchone()
+            if not updated:
+                return version_conflict_response(cur, order_id)
+            new_version = updated[0]
+            
+            # Этапы обновляются на месте: совпавший по id (или по номеру) этап - UPDATE,
+            # версия этапа растёт, только если он изменился; новый - INSERT; пропавший
+            # из формы - DELETE. Точки маршрута и таможня этапа пересоздаются
+            kept_stage_ids = set()
+            for stage in stages_data:
+                stage_number = stage.get('stage_number')
+                old_stage = old_stages_by_id.get(stage.get('id')) or old_stages_data.get(stage_number)
+                if old_stage and old_stage['id'] in kept_stage_ids:
+                    old_stage = None
+                is_new_stage = old_stage is None
+                old_stage = old_stage or {}
+                carrier_fields = stage_carrier_fields(stage)
+                stage_values = {
+                    'order_id': order_id,
+                    'stage_number': stage_number,
+                    'from_location': stage.get('from_location'),
+                    'to_location': stage.get('to_location'),
+                    'planned_departure': stage.get('planned_departure'),
+                    'planned_arrival': stage.get('planned_arrival') if stage.get('planned_arrival') else None,
+                    'vehicle_id': stage.get('vehicle_id'),
+                    'driver_id': stage.get('driver_id'),
+                    'notes': stage.get('notes'),
+                    **carrier_fields
+                }
                 
-                cur.execute('DELETE FROM stage_waypoints WHERE stage_id IN (SELECT id FROM order_transport_stages WHERE order_id = %s)', (order_id,))
-                cur.execute('DELETE FROM order_customs_points WHERE stage_id IN (SELECT id FROM order_transport_stages WHERE order_id = %s)', (order_id,))
-                cur.execute('DELETE FROM order_transport_stages WHERE order_id = %s', (order_id,))
-                
-                for stage in stages_data:
-                    stage_number = stage.get('stage_number')
-                    is_new_stage = stage_number not in old_stages_data
-                    old_stage = old_stages_data.get(stage_number, {})
-                    
+                if is_new_stage:
                     cur.execute('''
                         INSERT INTO order_transport_stages 
-                        (order_id, stage_number, from_location, to_location, planned_departure, vehicle_id, driver_id, notes, status)
-                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+                        (order_id, stage_number, from_location, to_location, planned_departure, planned_arrival, vehicle_id, driver_id, notes, status,
+                         carrier, phone, border_crossing)
+                        VALUES (%(order_id)s, %(stage_number)s, %(from_location)s, %(to_location)s, %(planned_departure)s,
+                                %(planned_arrival)s, %(vehicle_id)s, %(driver_id)s, %(notes)s, 'pending',
+                                %(carrier)s, %(phone)s, %(border_crossing)s)
                         RETURNING id
-                    ''', (
-                        order_id,
-                        stage_number,
-                        stage.get('from_location'),
-                        stage.get('to_location'),
-                        stage.get('planned_departure'),
-                        stage.get('vehicle_id'),
-                        stage.get('driver_id'),
-                        stage.get('notes'),
-                        'pending'
-                    ))
+                    ''', stage_values)
                     stage_id = cur.fetchone()[0]
+                else:
+                    stage_id = old_stage['id']
+                    cur.execute('''
+                        UPDATE order_transport_stages
+                        SET stage_number = %(stage_number)s, from_location = %(from_location)s, to_location = %(to_location)s,
+                            planned_departure = %(planned_departure)s, planned_arrival = %(planned_arrival)s,
+                            vehicle_id = %(vehicle_id)s, driver_id = %(driver_id)s, notes = %(notes)s,
+                            carrier = %(carrier)s, phone = %(phone)s, border_crossing = %(border_crossing)s,
+                            version = version + 1
+                        WHERE id = %(stage_id)s
+                          AND (stage_number, from_location, to_location, planned_departure, planned_arrival,
+                               vehicle_id, driver_id, notes, carrier, phone, border_crossing)
+                              IS DISTINCT FROM
+                              (%(stage_number)s, %(from_location)s, %(to_location)s, %(planned_departure)s, %(planned_arrival)s,
+                               %(vehicle_id)s, %(driver_id)s, %(notes)s, %(carrier)s, %(phone)s, %(border_crossing)s)
+                    ''', {**stage_values, 'stage_id': stage_id})
+                    cur.execute('DELETE FROM stage_waypoints WHERE stage_id = %s', (stage_id,))
+                    cur.execute('DELETE FROM order_customs_points WHERE stage_id = %s', (stage_id,))
+                kept_stage_ids.add(stage_id)
+                
+                waypoints_data = stage.get('waypoints', [])
+                waypoints_added = []
+                for waypoint in waypoints_data:
+                    execute_prepared(cur, 'stage_waypoint_insert', (
+                        stage_id,
+                        waypoint.get('waypoint_order'),
+                        waypoint.get('customer_id') if waypoint.get('customer_id') else None,
+                        waypoint.get('delivery_address_id') if waypoint.get('delivery_address_id') else None,
+                        waypoint.get('location'),
+                        waypoint.get('waypoint_type'),
+                        waypoint.get('planned_time') if waypoint.get('planned_time') else None,
+                        waypoint.get('cargo_description'),
+                        waypoint.get('notes')
+                    ))
+                    waypoints_added.append(waypoint.get('location'))
+                
+                customs_added = []
+                for customs in stage.get('customs_points', []):
+                    cur.execute('''
+                        INSERT INTO order_customs_points (stage_id, customs_name, status)
+                        VALUES (%s, %s, %s)
+                    ''', (stage_id, customs.get('customs_name'), 'pending'))
+                    customs_added.append(customs.get('customs_name'))
+                
+                # Детальное логирование изменений в маршруте
+                if is_new_stage:
+                    route_desc = f"{stage.get('from_location')} → {stage.get('to_location')}"
+                    execute_prepared(cur, 'activity_log_insert', (order_id, user_role, user_name, 'add_stage', f'добавил маршрут {stage_number} "{route_desc}"'))
+                else:
+                    # Проверяем изменения в существующем маршруте
+                    stage_changes = []
                     
-                    waypoints_data = stage.get('waypoints', [])
-                    waypoints_added = []
-                    for waypoint in waypoints_data:
-                        cur.execute('''
-                            INSERT INTO stage_waypoints (
-                                stage_id, waypoint_order, customer_id, delivery_address_id, location, waypoint_type,
-                                planned_time, cargo_description, notes
-                            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-                        ''', (
-                            stage_id,
-                            waypoint.get('waypoint_order'),
-                            waypoint.get('customer_id') if waypoint.get('customer_id') else None,
-                            waypoint.get('delivery_address_id') if waypoint.get('delivery_address_id') else None,
-                            waypoint.get('location'),
-                            waypoint.get('waypoint_type'),
-                            waypoint.get('planned_time') if waypoint.get('planned_time') else None,
-                            waypoint.get('cargo_description'),
-                            waypoint.get('notes')
-                        ))
-                        waypoints_added.append(waypoint.get('location'))
+                    # Изменение места загрузки
+                    if stage.get('from_location') != old_stage.get('from_location'):
+                        old_from = old_stage.get('from_location') or 'не указано'
+                        new_from = stage.get('from_location') or 'не указано'
+                        stage_changes.append(f'изменил место загрузки в маршруте {stage_number} с "{old_from}" на "{new_from}"')
                     
-                    customs_added = []
-                    for customs in stage.get('customs_points', []):
-                        cur.execute('''
-                            INSERT INTO order_customs_points (stage_id, customs_name, status)
-                            VALUES (%s, %s, %s)
-                        ''', (stage_id, customs.get('customs_name'), 'pending'))
-                        customs_added.append(customs.get('customs_name'))
+                    # Изменение места выгрузки
+                    if stage.get('to_location') != old_stage.get('to_location'):
+                        old_to = old_stage.get('to_location') or 'не указано'
+                        new_to = stage.get('to_location') or 'не указано'
+                        stage_changes.append(f'изменил место выгрузки в маршруте {stage_number} с "{old_to}" на "{new_to}"')
                     
-                    # Детальное логирование изменений в маршруте
-                    if is_new_stage:
-                        route_desc = f"{stage.get('from_location')} → {stage.get('to_location')}"
-                        cur.execute('''
-                            INSERT INTO activity_log (order_id, user_role, user_name, action_type, description)
-                            VALUES (%s, %s, %s, %s, %s)
-                        ''', (order_id, user_role, user_name, 'add_stage', f'добавил маршрут {stage_number} "{route_desc}"'))
-                    else:
-                        # Проверяем изменения в существующем маршруте
-                        stage_changes = []
+                    # Изменение автомобиля
+                    if stage.get('vehicle_id') != old_stage.get('vehicle_id'):
+                        old_vehicle_name = 'не указан'
+                        new_vehicle_name = 'не указан'
                         
-                        # Изменение места загрузки
-                        if stage.get('from_location') != old_stage.get('from_location'):
-                            old_from = old_stage.get('from_location') or 'не указано'
-                            new_from = stage.get('from_location') or 'не указано'
-                            stage_changes.append(f'изменил место загрузки в маршруте {stage_number} с "{old_from}" на "{new_from}"')
+                        if old_stage.get('vehicle_id'):
+                            execute_prepared(cur, 'vehicle_plate_by_id', (old_stage.get('vehicle_id'),))
+                            v_row = cur.fetchone()
+                            if v_row:
+                                old_vehicle_name = v_row[0]
                         
-                        # Изменение места выгрузки
-                        if stage.get('to_location') != old_stage.get('to_location'):
-                            old_to = old_stage.get('to_location') or 'не указано'
-                            new_to = stage.get('to_location') or 'не указано'
-                            stage_changes.append(f'изменил место выгрузки в маршруте {stage_number} с "{old_to}" на "{new_to}"')
+                        if stage.get('vehicle_id'):
+                            execute_prepared(cur, 'vehicle_plate_by_id', (stage.get('vehicle_id'),))
+                            v_row = cur.fetchone()
+                            if v_row:
+                                new_vehicle_name = v_row[0]
                         
-                        # Изменение автомобиля
-                        if stage.get('vehicle_id') != old_stage.get('vehicle_id'):
-                            old_vehicle_name = 'не указан'
-                            new_vehicle_name = 'не указан'
-                            
-                            if old_stage.get('vehicle_id'):
-                                cur.execute('SELECT license_plate FROM vehicles WHERE id = %s', (old_stage.get('vehicle_id'),))
-                                v_row = cur.fetchone()
-                                if v_row:
-                                    old_vehicle_name = v_row[0]
-                            
-                            if stage.get('vehicle_id'):
-                                cur.execute('SELECT license_plate FROM vehicles WHERE id = %s', (stage.get('vehicle_id'),))
-                                v_row = cur.fetchone()
-                                if v_row:
-                                    new_vehicle_name = v_row[0]
-                            
-                            stage_changes.append(f'изменил автомобиль в маршруте {stage_number} с "{old_vehicle_name}" на "{new_vehicle_name}"')
+                        stage_changes.append(f'изменил автомобиль в маршруте {stage_number} с "{old_vehicle_name}" на "{new_vehicle_name}"')
+                    
+                    # Изменение водителя
+                    if stage.get('driver_id') != old_stage.get('driver_id'):
+                        old_driver_name = 'не указан'
+                        new_driver_name = 'не указан'
                         
-                        # Изменение водителя
-                        if stage.get('driver_id') != old_stage.get('driver_id'):
-                            old_driver_name = 'не указан'
-                            new_driver_name = 'не указан'
-                            
-                            if old_stage.get('driver_id'):
-                                cur.execute('SELECT last_name, first_name FROM drivers WHERE id = %s', (old_stage.get('driver_id'),))
-                                d_row = cur.fetchone()
-                                if d_row:
-                                    old_driver_name = f"{d_row[0]} {d_row[1]}"
-                            
-                            if stage.get('driver_id'):
-                                cur.execute('SELECT last_name, first_name FROM drivers WHERE id = %s', (stage.get('driver_id'),))
-                                d_row = cur.fetchone()
-                                if d_row:
-                                    new_driver_name = f"{d_row[0]} {d_row[1]}"
-                            
-                            stage_changes.append(f'изменил водителя в маршруте {stage_number} с "{old_driver_name}" на "{new_driver_name}"')
+                        if old_stage.get('driver_id'):
+                            execute_prepared(cur, 'driver_name_by_id', (old_stage.get('driver_id'),))
+                            d_row = cur.fetchone()
+                            if d_row:
+                                old_driver_name = f"{d_row[0]} {d_row[1]}"
                         
-                        # Изменение примечаний к маршруту
-                        if stage.get('notes') != old_stage.get('notes'):
-                            if not old_stage.get('notes') and stage.get('notes'):
-                                stage_changes.append(f'добавил примечание к маршруту {stage_number}: "{stage.get("notes")}"')
-                            elif old_stage.get('notes') and not stage.get('notes'):
-                                stage_changes.append(f'удалил примечание из маршрута {stage_number}')
-                            elif old_stage.get('notes') and stage.get('notes'):
-                                stage_changes.append(f'изменил примечание в маршруте {stage_number}')
+                        if stage.get('driver_id'):
+                            execute_prepared(cur, 'driver_name_by_id', (stage.get('driver_id'),))
+                            d_row = cur.fetchone()
+                            if d_row:
+                                new_driver_name = f"{d_row[0]} {d_row[1]}"
                         
-                        # Записываем все изменения маршрута
-                        for change in stage_changes:
-                            cur.execute('''
-                                INSERT INTO activity_log (order_id, user_role, user_name, action_type, description)
-                                VALUES (%s, %s, %s, %s, %s)
-                            ''', (order_id, user_role, user_name, 'update_stage', change))
-                    
-                    if waypoints_added:
-                        waypoints_str = ', '.join(waypoints_added)
-                        cur.execute('''
-                            INSERT INTO activity_log (order_id, user_role, user_name, action_type, description)
-                            VALUES (%s, %s, %s, %s, %s)
-                        ''', (order_id, user_role, user_name, 'add_waypoints', f'добавил промежуточные точки в маршрут {stage_number}: {waypoints_str}'))
-                    
-                    if customs_added:
-                        customs_str = ', '.join(customs_added)
-                        cur.execute('''
-                            INSERT INTO activity_log (order_id, user_role, user_name, action_type, description)
-                            VALUES (%s, %s, %s, %s, %s)
-                        ''', (order_id, user_role, user_name, 'add_customs', f'добавил таможню в маршрут {stage_number}: {customs_str}'))
-                
-                # Логирование изменений в информации о заказе
-                changes = []
-                
-                # Проверка изменения номера заказа
-                if order_data.get('order_number') != old_order_number:
-                    changes.append(f'изменил номер заказа с "{old_order_number}" на "{order_data.get("order_number")}"')
-                
-                # Проверка изменения даты заказа (сравниваем только дату без времени)
-                new_order_date = str(order_data.get('order_date', '')).split('T')[0] if order_data.get('order_date') else ''
-                old_order_date_str = str(old_order_date).split('T')[0] if old_order_date else ''
-                if new_order_date and old_order_date_str and new_order_date != old_order_date_str:
-                    changes.append(f'изменил дату заказа с "{old_order_date_str}" на "{new_order_date}"')
-                
-                # Проверка изменения типа груза
-                if order_data.get('cargo_type') != old_cargo_type:
-                    old_val = old_cargo_type or 'не указано'
-                    new_val = order_data.get('cargo_type') or 'не указано'
-                    changes.append(f'изменил тип груза с "{old_val}" на "{new_val}"')
-                
-                # Проверка изменения веса груза
-                if order_data.get('cargo_weight') != old_cargo_weight:
-                    old_val = old_cargo_weight or 'не указано'
-                    new_val = order_data.get('cargo_weight') or 'не указано'
-                    changes.append(f'изменил вес груза с "{old_val}" на "{new_val}"')
-                
-                # Проверка изменения инвойса
-                if order_data.get('invoice') != old_invoice:
-                    old_val = old_invoice or 'не указано'
-                    new_val = order_data.get('invoice') or 'не указано'
-                    changes.append(f'изменил инвойс с "{old_val}" на "{new_val}"')
-                
-                # Проверка изменения трек-номера
-                if order_data.get('track_number') != old_track_number:
-                    old_val = old_track_number or 'не указано'
-                    new_val = order_data.get('track_number') or 'не указано'
-                    changes.append(f'изменил трек-номер с "{old_val}" на "{new_val}"')
-                
-                # Проверка изменения примечаний
-                new_notes = order_data.get('notes')
-                if new_notes != old_notes:
-                    if not old_notes and new_notes:
-                        changes.append(f'добавил примечание: "{new_notes}"')
-                    elif old_notes and not new_notes:
-                        changes.append('удалил примечание')
-                    elif old_notes and new_notes:
-                        changes.append(f'изменил примечание с "{old_notes}" на "{new_notes}"')
-                
-                # Проверка изменения перевозчика
-                new_client_id = order_data.get('client_id')
-                if new_client_id != old_client_id:
-                    old_carrier = 'не указан'
-                    new_carrier = 'не указан'
-                    
-                    if old_client_id:
-                        cur.execute('SELECT name FROM clients WHERE id = %s', (old_client_id,))
-                        carrier_row = cur.fetchone()
-                        if carrier_row:
-                            old_carrier = carrier_row[0]
-                    
-                    if new_client_id:
-                        cur.execute('SELECT name FROM clients WHERE id = %s', (new_client_id,))
-                        carrier_row = cur.fetchone()
-                        if carrier_row:
-                            new_carrier = carrier_row[0]
-                    
-                    changes.append(f'изменил перевозчика с "{old_carrier}" на "{new_carrier}"')
-                
-                # Проверка изменения заказчиков
-                old_customer_ids = set(str(item.get('customer_id')) for item in old_customer_items if item.get('customer_id'))
-                new_customer_ids = set(str(item.get('customer_id')) for item in customer_items if item.get('customer_id'))
-                
-                if old_customer_ids != new_customer_ids:
-                    added_customers = new_customer_ids - old_customer_ids
-                    removed_customers = old_customer_ids - new_customer_ids
+                        stage_changes.append(f'изменил водителя в маршруте {stage_number} с "{old_driver_name}" на "{new_driver_name}"')
                     
-                    if added_customers:
-                        for customer_id in added_customers:
-                            cur.execute('SELECT nickname FROM customers WHERE id = %s', (customer_id,))
-                            customer_row = cur.fetchone()
-                            if customer_row:
-                                changes.append(f'добавил заказчика "{customer_row[0]}"')
+                    # Изменение примечаний к маршруту
+                    if stage.get('notes') != old_stage.get('notes'):
+                        if not old_stage.get('notes') and stage.get('notes'):
+                            stage_changes.append(f'добавил примечание к маршруту {stage_number}: "{stage.get("notes")}"')
+                        elif old_stage.get('notes') and not stage.get('notes'):
+                            stage_changes.append(f'удалил примечание из маршрута {stage_number}')
+                        elif old_stage.get('notes') and stage.get('notes'):
+                            stage_changes.append(f'изменил примечание в маршруте {stage_number}')
                     
-                    if removed_customers:
-                        for customer_id in removed_customers:
-                            cur.execute('SELECT nickname FROM customers WHERE id = %s', (customer_id,))
-                            customer_row = cur.fetchone()
-                            if customer_row:
-                                changes.append(f'удалил заказчика "{customer_row[0]}"')
-                
-                # Записываем все изменения в лог
-                for change in changes:
-                    cur.execute('''
-                        INSERT INTO activity_log (order_id, user_role, user_name, action_type, description)
-                        VALUES (%s, %s, %s, %s, %s)
-                    ''', (order_id, user_role, user_name, 'update_order_info', change))
+                    # Записываем все изменения маршрута
+                    for change in stage_changes:
+                        execute_prepared(cur, 'activity_log_insert', (order_id, user_role, user_name, 'update_stage', change))
                 
-                conn.commit()
+                if waypoints_added:
+                    waypoints_str = ', '.join(waypoints_added)
+                    execute_prepared(cur, 'activity_log_insert', (order_id, user_role, user_name, 'add_waypoints', f'добавил промежуточные точки в маршрут {stage_number}: {waypoints_str}'))
                 
+                if customs_added:
+                    customs_str = ', '.join(customs_added)
+                    execute_prepared(cur, 'activity_log_insert', (order_id, user_role, user_name, 'add_customs', f'добавил таможню в маршрут {stage_number}: {customs_str}'))
+            
+            removed_stage_ids = [stage_id for stage_id in old_stages_by_id if stage_id not in kept_stage_ids]
+            if removed_stage_ids:
+                cur.execute('DELETE FROM stage_waypoints WHERE stage_id = ANY(%s)', (removed_stage_ids,))
+                cur.execute('DELETE FROM order_customs_points WHERE stage_id = ANY(%s)', (removed_stage_ids,))
+                cur.execute('DELETE FROM order_transport_stages WHERE id = ANY(%s)', (removed_stage_ids,))
+            
+            # Логирование изменений в информации о заказе
+            changes = []
+            
+            # Проверка изменения номера заказа
+            if order_data.get('order_number') != old_order_number:
+                changes.append(f'изменил номер заказа с "{old_order_number}" на "{order_data.get("order_number")}"')
+            
+            # Проверка изменения даты заказа (сравниваем только дату без времени)
+            new_order_date = str(order_data.get('order_date', '')).split('T')[0] if order_data.get('order_date') else ''
+            old_order_date_str = str(old_order_date).split('T')[0] if old_order_date else ''
+            if new_order_date and old_order_date_str and new_order_date != old_order_date_str:
+                changes.append(f'изменил дату заказа с "{old_order_date_str}" на "{new_order_date}"')
+            
+            # Проверка изменения типа груза
+            if order_data.get('cargo_type') != old_cargo_type:
+                old_val = old_cargo_type or 'не указано'
+                new_val = order_data.get('cargo_type') or 'не указано'
+                changes.append(f'изменил тип груза с "{old_val}" на "{new_val}"')
+            
+            # Проверка изменения веса груза
+            if order_data.get('cargo_weight') != old_cargo_weight:
+                old_val = old_cargo_weight or 'не указано'
+                new_val = order_data.get('cargo_weight') or 'не указано'
+                changes.append(f'изменил вес груза с "{old_val}" на "{new_val}"')
+            
+            # Проверка изменения инвойса
+            if order_data.get('invoice') != old_invoice:
+                old_val = old_invoice or 'не указано'
+                new_val = order_data.get('invoice') or 'не указано'
+                changes.append(f'изменил инвойс с "{old_val}" на "{new_val}"')
+            
+            # Проверка изменения трек-номера
+            if order_data.get('track_number') != old_track_number:
+                old_val = old_track_number or 'не указано'
+                new_val = order_data.get('track_number') or 'не указано'
+                changes.append(f'изменил трек-номер с "{old_val}" на "{new_val}"')
+            
+            # Проверка изменения примечаний
+            new_notes = order_data.get('notes')
+            if new_notes != old_notes:
+                if not old_notes and new_notes:
+                    changes.append(f'добавил примечание: "{new_notes}"')
+                elif old_notes and not new_notes:
+                    changes.append('удалил примечание')
+                elif old_notes and new_notes:
+                    changes.append(f'изменил примечание с "{old_notes}" на "{new_notes}"')
+            
+            # Проверка изменения перевозчика
+            new_client_id = order_data.get('client_id')
+            if new_client_id != old_client_id:
+                old_carrier = 'не указан'
+                new_carrier = 'не указан'
+                
+                if old_client_id:
+                    execute_prepared(cur, 'client_name_by_id', (old_client_id,))
+                    carrier_row = cur.fetchone()
+                    if carrier_row:
+                        old_carrier = carrier_row[0]
+                
+                if new_client_id:
+                    execute_prepared(cur, 'client_name_by_id', (new_client_id,))
+                    carrier_row = cur.fetchone()
+                    if carrier_row:
+                        new_carrier = carrier_row[0]
+                
+                changes.append(f'изменил перевозчика с "{old_carrier}" на "{new_carrier}"')
+            
+            # Проверка изменения заказчиков
+            old_customer_ids = set(str(item.get('customer_id')) for item in old_customer_items if item.get('customer_id'))
+            new_customer_ids = set(str(item.get('customer_id')) for item in customer_items if item.get('customer_id'))
+            
+            if old_customer_ids != new_customer_ids:
+                added_customers = new_customer_ids - old_customer_ids
+                removed_customers = old_customer_ids - new_customer_ids
+                
+                if added_customers:
+                    for customer_id in added_customers:
+                        execute_prepared(cur, 'customer_nickname_by_id', (customer_id,))
+                        customer_row = cur.fetchone()
+                        if customer_row:
+                            changes.append(f'добавил заказчика "{customer_row[0]}"')
+                
+                if removed_customers:
+                    for customer_id in removed_customers:
+                        execute_prepared(cur, 'customer_nickname_by_id', (customer_id,))
+                        customer_row = cur.fetchone()
+                        if customer_row:
+                            changes.append(f'удалил заказчика "{customer_row[0]}"')
+            
+            # Записываем все изменения в лог
+            for change in changes:
+                execute_prepared(cur, 'activity_log_insert', (order_id, user_role, user_name, 'update_order_info', change))
+            
+            refresh_order_summary(cur, [order_id])
+            refresh_asset_usage(cur, old_usage + usage_spans(cur, order_ids=[order_id]))
+            
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': dumps({'success': True, 'message': 'Заказ обновлен', 'conflicts': conflicts, 'version': new_version}),
+                'isBase64Encoded': False
+            }
+        
+        elif action == 'delete_order':
+            order_id = body_data.get('order_id')
+            user_role = body_data.get('user_role', 'Пользователь')
+            
+            # Мягкое удаление: связанные строки удалит фоновая очистка (soft_delete.py)
+            order_number = soft_delete_order(cur, order_id)
+            
+            if order_number:
                 return {
                     'statusCode': 200,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': True, 'message': 'Заказ обновлен'}),
+                    'body': dumps({'success': True, 'message': f'Заказ {order_number} удален'}),
                     'isBase64Encoded': False
                 }
             
-            elif action == 'delete_order':
-                order_id = body_data.get('order_id')
-                user_role = body_data.get('user_role', 'Пользователь')
-                
-                cur.execute('SELECT order_number FROM orders WHERE id = %s', (order_id,))
-                order = cur.fetchone()
-                
-                if order:
-                    order_number = order[0]
-                    
-                    cur.execute('DELETE FROM order_documents WHERE order_id = %s', (order_id,))
-                    cur.execute('DELETE FROM phytosanitary_docs WHERE order_id = %s', (order_id,))
-                    cur.execute('DELETE FROM order_customs_points WHERE order_id = %s', (order_id,))
-                    cur.execute('DELETE FROM order_transport_stages WHERE order_id = %s', (order_id,))
-                    cur.execute('DELETE FROM order_stages WHERE order_id = %s', (order_id,))
-                    cur.execute('DELETE FROM activity_log WHERE order_id = %s', (order_id,))
-                    cur.execute('DELETE FROM orders WHERE id = %s', (order_id,))
-                    
-                    conn.commit()
-                    
-                    return {
-                        'statusCode': 200,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'success': True, 'message': f'Заказ {order_number} удален'}),
-                        'isBase64Encoded': False
-                    }
-                
+            return {
+                'statusCode': 404,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': dumps({'success': False, 'message': 'Заказ не найден'}),
+                'isBase64Encoded': False
+            }
+        
+        elif action == 'update_fito_dates':
+            order_id = body_data.get('order_id')
+            fito_data = body_data.get('data', {})
+            
+            if not order_id:
                 return {
-                    'statusCode': 404,
+                    'statusCode': 400,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': False, 'message': 'Заказ не найден'}),
+                    'body': dumps({'success': False, 'message': 'order_id is required'}),
                     'isBase64Encoded': False
                 }
             
-            elif action == 'update_fito_dates':
-                order_id = body_data.get('order_id')
-                fito_data = body_data.get('data', {})
-                
-                if not order_id:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'success': False, 'message': 'order_id is required'}),
-                        'isBase64Encoded': False
-                    }
-                
-                fito_order_date = fito_data.get('fito_order_date') or None
-                fito_ready_date = fito_data.get('fito_ready_date') or None
-                fito_received_date = fito_data.get('fito_received_date') or None
-                
-                cur.execute('''
-                    UPDATE orders 
-                    SET fito_order_date = %s, fito_ready_date = %s, fito_received_date = %s
-                    WHERE id = %s
-                ''', (fito_order_date, fito_ready_date, fito_received_date, order_id))
-                
-                conn.commit()
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': True, 'message': 'Даты Фито обновлены'}),
-                    'isBase64Encoded': False
-                }
+            fito_order_date = fito_data.get('fito_order_date') or None
+            fito_ready_date = fito_data.get('fito_ready_date') or None
+            fito_received_date = fito_data.get('fito_received_date') or None
             
-            elif action == 'add_order_stage':
-                order_id = body_data.get('order_id')
-                stage = body_data.get('stage', {})
-                
-                if not order_id or not stage:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'success': False, 'message': 'order_id and stage are required'}),
-                        'isBase64Encoded': False
-                    }
-                
-                cur.execute('''
-                    INSERT INTO order_transport_stages (
-                        order_id, stage_number, vehicle_id, driver_id,
-                        from_location, to_location, notes, status
-                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-                    RETURNING id
-                ''', (
-                    order_id,
-                    stage.get('stage_number'),
-                    stage.get('vehicle_id'),
-                    stage.get('driver_id'),
-                    stage.get('from_location'),
-                    stage.get('to_location'),
-                    stage.get('notes', ''),
-                    'planned'
-                ))
-                
-                stage_id = cur.fetchone()[0]
-                conn.commit()
-                
+            cur.execute('''
+                UPDATE orders 
+                SET fito_order_date = %s, fito_ready_date = %s, fito_received_date = %s
+                WHERE id = %s
+            ''', (fito_order_date, fito_ready_date, fito_received_date, order_id))
+            
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': dumps({'success': True, 'message': 'Даты Фито обновлены'}),
+                'isBase64Encoded': False
+            }
+        
+        elif action == 'add_order_stage':
+            order_id = body_data.get('order_id')
+            stage = body_data.get('stage', {})
+            
+            if not order_id or not stage:
                 return {
-                    'statusCode': 200,
+                    'statusCode': 400,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': True, 'stage_id': stage_id}),
+                    'body': dumps({'success': False, 'message': 'order_id and stage are required'}),
                     'isBase64Encoded': False
                 }
             
-            elif action == 'delete_order_stage':
-                stage_id = body_data.get('stage_id')
-                
-                if not stage_id:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'success': False, 'message': 'stage_id is required'}),
-                        'isBase64Encoded': False
-                    }
-                
-                cur.execute('DELETE FROM order_customs_points WHERE stage_id = %s', (stage_id,))
-                cur.execute('DELETE FROM order_transport_stages WHERE id = %s', (stage_id,))
-                conn.commit()
-                
+            try:
+                expected_version = parse_expected_version(body_data.get('expected_version'))
+            except ValueError:
+                return invalid_version_response()
+            
+            conflicts = find_stage_conflicts(cur, [stage], order_id)
+            if conflicts and not body_data.get('allow_overlap'):
+                return conflict_response(conflicts)
+            
+            new_version = bump_order_version(cur, order_id, expected_version)
+            if new_version is None:
+                return version_conflict_response(cur, order_id)
+            
+            carrier_fields = stage_carrier_fields(stage)
+            cur.execute('''
+                INSERT INTO order_transport_stages (
+                    order_id, stage_number, vehicle_id, driver_id,
+                    from_location, to_location, planned_departure, planned_arrival,
+                    notes, status, carrier, phone, border_crossing
+                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                RETURNING id
+            ''', (
+                order_id,
+                stage.get('stage_number'),
+                stage.get('vehicle_id'),
+                stage.get('driver_id'),
+                stage.get('from_location'),
+                stage.get('to_location'),
+                stage.get('planned_departure') if stage.get('planned_departure') else None,
+                stage.get('planned_arrival') if stage.get('planned_arrival') else None,
+                stage.get('notes', ''),
+                'planned',
+                carrier_fields['carrier'],
+                carrier_fields['phone'],
+                carrier_fields['border_crossing']
+            ))
+            
+            stage_id = cur.fetchone()[0]
+            refresh_order_summary(cur, [order_id])
+            refresh_asset_usage(cur, usage_spans(cur, stage_ids=[stage_id]))
+            
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': dumps({'success': True, 'stage_id': stage_id, 'conflicts': conflicts, 'version': new_version}),
+                'isBase64Encoded': False
+            }
+        
+        elif action == 'delete_order_stage':
+            stage_id = body_data.get('stage_id')
+            
+            if not stage_id:
                 return {
-                    'statusCode': 200,
+                    'statusCode': 400,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': True, 'message': 'Stage deleted'}),
+                    'body': dumps({'success': False, 'message': 'stage_id is required'}),
                     'isBase64Encoded': False
                 }
             
-            elif action == 'update_stage':
-                stage_id = body_data.get('stage_id')
-                is_completed = body_data.get('is_completed')
-                completed_by = body_data.get('completed_by', 'Пользователь')
-                user_name = body_data.get('user_name', completed_by)
-                
+            try:
+                expected_version = parse_expected_version(body_data.get('expected_version'))
+            except ValueError:
+                return invalid_version_response()
+            
+            deleted_usage = usage_spans(cur, stage_ids=[stage_id])
+            cur.execute('DELETE FROM order_customs_points WHERE stage_id = %s', (stage_id,))
+            cur.execute('DELETE FROM order_transport_stages WHERE id = %s RETURNING order_id', (stage_id,))
+            deleted_stage = cur.fetchone()
+            if deleted_stage:
+                # Версия заказа проверяется после DELETE: при конфликте откат вернёт этап
+                if bump_order_version(cur, deleted_stage[0], expected_version) is None:
+                    return version_conflict_response(cur, deleted_stage[0])
+                refresh_order_summary(cur, [deleted_stage[0]])
+                refresh_asset_usage(cur, deleted_usage)
+            
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': dumps({'success': True, 'message': 'Stage deleted'}),
+                'isBase64Encoded': False
+            }
+        
+        elif action == 'update_stage':
+            stage_id = body_data.get('stage_id')
+            is_completed = body_data.get('is_completed')
+            completed_by = body_data.get('completed_by', 'Пользователь')
+            user_name = body_data.get('user_name', completed_by)
+            
+            cur.execute('''
+                SELECT os.stage_name, os.order_id, o.order_number
+                FROM order_stages os
+                JOIN orders o ON os.order_id = o.id
+                WHERE os.id = %s
+            ''', (stage_id,))
+            stage_info = cur.fetchone()
+            
+            if is_completed:
                 cur.execute('''
-                    SELECT os.stage_name, os.order_id, o.order_number
-                    FROM order_stages os
-                    JOIN orders o ON os.order_id = o.id
-                    WHERE os.id = %s
-                ''', (stage_id,))
-                stage_info = cur.fetchone()
+                    UPDATE order_stages
+                    SET is_completed = true, completed_by = %s, completed_at = CURRENT_TIMESTAMP
+                    WHERE id = %s
+                ''', (completed_by, stage_id))
                 
-                if is_completed:
-                    cur.execute('''
-                        UPDATE order_stages
-                        SET is_completed = true, completed_by = %s, completed_at = CURRENT_TIMESTAMP
-                        WHERE id = %s
-                    ''', (completed_by, stage_id))
+                if stage_info:
+                    stage_name, order_id, order_number = stage_info
+                    execute_prepared(cur, 'activity_log_insert', (order_id, completed_by, user_name, 'stage_completed', f'завершил этап "{stage_name}" в заказе {order_number}'))
                     
-                    if stage_info:
-                        stage_name, order_id, order_number = stage_info
-                        cur.execute('''
-                            INSERT INTO activity_log (order_id, user_role, user_name, action_type, description)
-                            VALUES (%s, %s, %s, %s, %s)
-                        ''', (order_id, completed_by, user_name, 'stage_completed', f'завершил этап "{stage_name}" в заказе {order_number}'))
-                        
-                        # Отправка уведомления в Telegram о выполнении этапа
-                        try:
-                            import urllib.request
-                            
-                            telegram_payload = {
-                                'event_type': 'stage_completed',
-                                'order_data': {
-                                    'order_id': order_id,
-                                    'order_number': order_number,
-                                    'stage_name': stage_name,
-                                    'completed_by': completed_by
-                                }
-                            }
-                            
-                            telegram_url = 'https://functions.poehali.dev/a5ca5f70-a100-4290-9d7c-54189ae3319e'
-                            telegram_data = json.dumps(telegram_payload).encode('utf-8')
-                            telegram_req = urllib.request.Request(telegram_url, data=telegram_data, headers={'Content-Type': 'application/json'})
-                            urllib.request.urlopen(telegram_req, timeout=5)
-                        except:
-                            pass
-                else:
-                    cur.execute('''
-                        UPDATE order_stages
-                        SET is_completed = false, completed_by = NULL, completed_at = NULL
-                        WHERE id = %s
-                    ''', (stage_id,))
-                
-                conn.commit()
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': True}),
-                    'isBase64Encoded': False
-                }
-            
-            elif action == 'create_driver':
-                data = body_data.get('data', {})
-                
-                # Формируем full_name из компонентов для совместимости
-                full_name_parts = [
-                    data.get('last_name', ''),
-                    data.get('first_name', ''),
-                    data.get('middle_name', '')
-                ]
-                full_name = ' '.join([p for p in full_name_parts if p]).strip() or 'Не указано'
-                
+                    # Уведомление в Telegram о выполнении этапа - после коммита и освобождения соединения
+                    uow.after_release(notify_telegram, {
+                        'event_type': 'stage_completed',
+                        'order_data': {
+                            'order_id': order_id,
+                            'order_number': order_number,
+                            'stage_name': stage_name,
+                            'completed_by': completed_by
+                        }
+                    })
+            else:
                 cur.execute('''
-                    INSERT INTO drivers (
-                        full_name, last_name, first_name, middle_name, phone, additional_phone,
-                        passport_series, passport_number, passport_issued_by, passport_issue_date,
-                        license_series, license_number, license_issued_by, license_issue_date, status
-                    )
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                    RETURNING id
-                ''', (
-                    full_name,
-                    data.get('last_name'), data.get('first_name'), data.get('middle_name'),
-                    data.get('phone'), data.get('additional_phone'),
-                    data.get('passport_series'), data.get('passport_number'), 
-                    data.get('passport_issued_by'), data.get('passport_issue_date'),
-                    data.get('license_series'), data.get('license_number'),
-                    data.get('license_issued_by'), data.get('license_issue_date'), 'available'
-                ))
-                
-                driver_id = cur.fetchone()[0]
-                conn.commit()
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': True, 'id': driver_id}),
-                    'isBase64Encoded': False
-                }
+                    UPDATE order_stages
+                    SET is_completed = false, completed_by = NULL, completed_at = NULL
+                    WHERE id = %s
+                ''', (stage_id,))
             
-            elif action == 'create_vehicle':
-                data = body_data.get('data', {})
-                
-                cur.execute('''
-                    INSERT INTO vehicles (
-                        license_plate, model, capacity, status,
-                        vehicle_brand, trailer_plate, body_type, company_name, driver_id
-                    )
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-                    RETURNING id
-                ''', (
-                    data.get('license_plate'), 
-                    data.get('vehicle_brand'), 
-                    data.get('body_type', ''),
-                    'available',
-                    data.get('vehicle_brand'),
-                    data.get('trailer_plate'),
-                    data.get('body_type'),
-                    data.get('company_name'),
-                    data.get('driver_id')
-                ))
-                
-                vehicle_id = cur.fetchone()[0]
-                conn.commit()
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': True, 'id': vehicle_id}),
-                    'isBase64Encoded': False
-                }
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': dumps({'success': True}),
+                'isBase64Encoded': False
+            }
+        
+        elif action == 'create_driver':
+            data = body_data.get('data', {})
             
-            elif action == 'create_client':
-                data = body_data.get('data', {})
-                cur.execute('''
-                    INSERT INTO clients (name, contact_person, phone, email, address)
-                    VALUES (%s, %s, %s, %s, %s)
-                    RETURNING id
-                ''', (data.get('name'), data.get('contact_person'), data.get('phone'), 
-                      data.get('email'), data.get('address')))
-                
-                client_id = cur.fetchone()[0]
-                conn.commit()
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': True, 'id': client_id}),
-                    'isBase64Encoded': False
-                }
+            # Формируем full_name из компонентов для совместимости
+            full_name_parts = [
+                data.get('last_name', ''),
+                data.get('first_name', ''),
+                data.get('middle_name', '')
+            ]
+            full_name = ' '.join([p for p in full_name_parts if p]).strip() or 'Не указано'
             
-            elif action == 'create_customer':
-                data = body_data.get('data', {})
-                cur.execute('''
-                    INSERT INTO customers (company_name, inn, kpp, legal_address, director_name, 
-                                         delivery_address, nickname, contact_person, phone, email)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                    RETURNING id
-                ''', (data.get('company_name'), data.get('inn'), data.get('kpp'), 
-                      data.get('legal_address'), data.get('director_name'), data.get('delivery_address'),
-                      data.get('nickname'), data.get('contact_person'), data.get('phone'), data.get('email')))
-                
-                customer_id = cur.fetchone()[0]
-                conn.commit()
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': True, 'id': customer_id}),
-                    'isBase64Encoded': False
-                }
+            cur.execute('''
+                INSERT INTO drivers (
+                    full_name, last_name, first_name, middle_name, phone, additional_phone,
+                    passport_series, passport_number, passport_issued_by, passport_issue_date,
+                    license_series, license_number, license_issued_by, license_issue_date, status
+                )
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                RETURNING id
+            ''', (
+                full_name,
+                data.get('last_name'), data.get('first_name'), data.get('middle_name'),
+                data.get('phone'), data.get('additional_phone'),
+                data.get('passport_series'), data.get('passport_number'), 
+                data.get('passport_issued_by'), data.get('passport_issue_date'),
+                data.get('license_series'), data.get('license_number'),
+                data.get('license_issued_by'), data.get('license_issue_date'), 'available'
+            ))
             
-            elif action == 'delete_customer':
-                customer_id = body_data.get('customer_id')
-                
-                cur.execute('SELECT COUNT(*) FROM orders WHERE customer_items::text LIKE %s', 
-                           (f'%"customer_id": "{customer_id}"%',))
-                order_count = cur.fetchone()[0]
-                
-                if order_count > 0:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({
-                            'success': False, 
-                            'error': f'Заказчик используется в {order_count} заказе(ах). Удаление невозможно.'
-                        }),
-                        'isBase64Encoded': False
-                    }
-                
-                cur.execute('DELETE FROM customer_delivery_addresses WHERE customer_id = %s', (customer_id,))
-                cur.execute('DELETE FROM customers WHERE id = %s', (customer_id,))
-                conn.commit()
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': True}),
-                    'isBase64Encoded': False
-                }
+            driver_id = cur.fetchone()[0]
             
-            elif action == 'create_customer_address':
-                customer_id = body_data.get('customer_id')
-                data = body_data.get('data', {})
-                
-                if data.get('is_primary'):
-                    cur.execute('''
-                        UPDATE customer_delivery_addresses 
-                        SET is_primary = false 
-                        WHERE customer_id = %s
-                    ''', (customer_id,))
-                
-                cur.execute('''
-                    INSERT INTO customer_delivery_addresses 
-                    (customer_id, address_name, address, contact_person, phone, is_primary)
-                    VALUES (%s, %s, %s, %s, %s, %s)
-                    RETURNING id
-                ''', (customer_id, data.get('address_name'), data.get('address'), 
-                      data.get('contact_person'), data.get('phone'), data.get('is_primary', False)))
-                
-                address_id = cur.fetchone()[0]
-                conn.commit()
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': True, 'id': address_id}),
-                    'isBase64Encoded': False
-                }
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': dumps({'success': True, 'id': driver_id}),
+                'isBase64Encoded': False
+            }
+        
+        elif action == 'create_vehicle':
+            data = body_data.get('data', {})
             
-            elif action == 'login':
-                username = body_data.get('username')
-                password = body_data.get('password')
-                
-                cur.execute('''
-                    SELECT id, role, full_name FROM users 
-                    WHERE login = %s AND password = %s AND is_active = true
-                ''', (username, password))
-                
-                user = cur.fetchone()
-                
-                if not user:
-                    return {
-                        'statusCode': 401,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Неверный логин или пароль'}),
-                        'isBase64Encoded': False
-                    }
-                
+            cur.execute('''
+                INSERT INTO vehicles (
+                    license_plate, model, capacity, status,
+                    vehicle_brand, trailer_plate, body_type, company_name, driver_id
+                )
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+                RETURNING id
+            ''', (
+                data.get('license_plate'), 
+                data.get('vehicle_brand'), 
+                data.get('body_type', ''),
+                'available',
+                data.get('vehicle_brand'),
+                data.get('trailer_plate'),
+                data.get('body_type'),
+                data.get('company_name'),
+                data.get('driver_id')
+            ))
+            
+            vehicle_id = cur.fetchone()[0]
+            
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': dumps({'success': True, 'id': vehicle_id}),
+                'isBase64Encoded': False
+            }
+        
+        elif action == 'create_client':
+            data = body_data.get('data', {})
+            cur.execute('''
+                INSERT INTO clients (name, contact_person, phone, email, address)
+                VALUES (%s, %s, %s, %s, %s)
+                RETURNING id
+            ''', (data.get('name'), data.get('contact_person'), data.get('phone'), 
+                  data.get('email'), data.get('address')))
+            
+            client_id = cur.fetchone()[0]
+            
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': dumps({'success': True, 'id': client_id}),
+                'isBase64Encoded': False
+            }
+        
+        elif action == 'create_customer':
+            data = body_data.get('data', {})
+            cur.execute('''
+                INSERT INTO customers (company_name, inn, kpp, legal_address, director_name, 
+                                     delivery_address, nickname, contact_person, phone, email)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                RETURNING id
+            ''', (data.get('company_name'), data.get('inn'), data.get('kpp'), 
+                  data.get('legal_address'), data.get('director_name'), data.get('delivery_address'),
+                  data.get('nickname'), data.get('contact_person'), data.get('phone'), data.get('email')))
+            
+            customer_id = cur.fetchone()[0]
+            
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': dumps({'success': True, 'id': customer_id}),
+                'isBase64Encoded': False
+            }
+        
+        elif action == 'delete_customer':
+            customer_id = body_data.get('customer_id')
+            
+            cur.execute('SELECT COUNT(*) FROM orders WHERE customer_items::text LIKE %s AND deleted_at IS NULL', 
+                       (f'%"customer_id": "{customer_id}"%',))
+            order_count = cur.fetchone()[0]
+            
+            if order_count > 0:
                 return {
-                    'statusCode': 200,
+                    'statusCode': 400,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': True, 'user_id': user[0], 'role': user[1], 'full_name': user[2]}),
+                    'body': dumps({
+                        'success': False, 
+                        'error': f'Заказчик используется в {order_count} заказе(ах). Удаление невозможно.'
+                    }),
                     'isBase64Encoded': False
                 }
             
-            elif action == 'create_user':
-                data = body_data.get('data', {})
-                login = data.get('login')
+            cur.execute('DELETE FROM customer_delivery_addresses WHERE customer_id = %s', (customer_id,))
+            cur.execute('DELETE FROM customers WHERE id = %s', (customer_id,))
+            
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': dumps({'success': True}),
+                'isBase64Encoded': False
+            }
+        
+        elif action == 'create_customer_address':
+            customer_id = body_data.get('customer_id')
+            data = body_data.get('data', {})
+            
+            if data.get('is_primary'):
                 cur.execute('''
-                    INSERT INTO users (username, full_name, email, phone, role, login, password, is_active)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-                    RETURNING id
-                ''', (login, data.get('full_name'), data.get('email'),
-                      data.get('phone'), data.get('role'), login, data.get('password'), True))
-                
-                user_id = cur.fetchone()[0]
-                conn.commit()
-                
+                    UPDATE customer_delivery_addresses 
+                    SET is_primary = false 
+                    WHERE customer_id = %s
+                ''', (customer_id,))
+            
+            cur.execute('''
+                INSERT INTO customer_delivery_addresses 
+                (customer_id, address_name, address, contact_person, phone, is_primary)
+                VALUES (%s, %s, %s, %s, %s, %s)
+                RETURNING id
+            ''', (customer_id, data.get('address_name'), data.get('address'), 
+                  data.get('contact_person'), data.get('phone'), data.get('is_primary', False)))
+            
+            address_id = cur.fetchone()[0]
+            
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': dumps({'success': True, 'id': address_id}),
+                'isBase64Encoded': False
+            }
+        
+        elif action == 'login':
+            username = body_data.get('username')
+            password = body_data.get('password')
+            
+            cur.execute('''
+                SELECT id, role, full_name FROM users 
+                WHERE login = %s AND password = %s AND is_active = true
+            ''', (username, password))
+            
+            user = cur.fetchone()
+            
+            if not user:
                 return {
-                    'statusCode': 200,
+                    'statusCode': 401,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': True, 'id': user_id}),
+                    'body': dumps({'error': 'Неверный логин или пароль'}),
                     'isBase64Encoded': False
                 }
             
-            elif action == 'update_role_permissions':
-                data = body_data.get('data', {})
-                role_name = body_data.get('role_name')
-                
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': dumps({'success': True, 'user_id': user[0], 'role': user[1], 'full_name': user[2]}),
+                'isBase64Encoded': False
+            }
+        
+        elif action == 'create_user':
+            data = body_data.get('data', {})
+            login = data.get('login')
+            cur.execute('''
+                INSERT INTO users (username, full_name, email, phone, role, login, password, is_active)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                RETURNING id
+            ''', (login, data.get('full_name'), data.get('email'),
+                  data.get('phone'), data.get('role'), login, data.get('password'), True))
+            
+            user_id = cur.fetchone()[0]
+            
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': dumps({'success': True, 'id': user_id}),
+                'isBase64Encoded': False
+            }
+        
+        elif action == 'update_role_permissions':
+            data = body_data.get('data', {})
+            role_name = body_data.get('role_name')
+            
+            cur.execute('''
+                UPDATE roles
+                SET permissions = %s, updated_at = CURRENT_TIMESTAMP
+                WHERE role_name = %s
+            ''', (json.dumps(data.get('permissions')), role_name))
+            
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': dumps({'success': True}),
+                'isBase64Encoded': False
+            }
+        
+        elif action == 'save_telegram_settings':
+            data = body_data.get('data', {})
+            
+            cur.execute('SELECT COUNT(*) FROM telegram_bot_settings')
+            count = cur.fetchone()[0]
+            
+            if count > 0:
                 cur.execute('''
-                    UPDATE roles
-                    SET permissions = %s, updated_at = CURRENT_TIMESTAMP
-                    WHERE role_name = %s
-                ''', (json.dumps(data.get('permissions')), role_name))
-                
-                conn.commit()
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': True}),
-                    'isBase64Encoded': False
-                }
+                    UPDATE telegram_bot_settings
+                    SET bot_token = %s, chat_id = %s, is_active = %s, updated_at = CURRENT_TIMESTAMP
+                    WHERE id = (SELECT id FROM telegram_bot_settings ORDER BY id DESC LIMIT 1)
+                ''', (data.get('bot_token'), data.get('chat_id'), data.get('is_active')))
+            else:
+                cur.execute('''
+                    INSERT INTO telegram_bot_settings (bot_token, chat_id, is_active)
+                    VALUES (%s, %s, %s)
+                ''', (data.get('bot_token'), data.get('chat_id'), data.get('is_active')))
             
-            elif action == 'save_telegram_settings':
-                data = body_data.get('data', {})
-                
-                cur.execute('SELECT COUNT(*) FROM telegram_bot_settings')
-                count = cur.fetchone()[0]
-                
-                if count > 0:
-                    cur.execute('''
-                        UPDATE telegram_bot_settings
-                        SET bot_token = %s, chat_id = %s, is_active = %s, updated_at = CURRENT_TIMESTAMP
-                        WHERE id = (SELECT id FROM telegram_bot_settings ORDER BY id DESC LIMIT 1)
-                    ''', (data.get('bot_token'), data.get('chat_id'), data.get('is_active')))
-                else:
-                    cur.execute('''
-                        INSERT INTO telegram_bot_settings (bot_token, chat_id, is_active)
-                        VALUES (%s, %s, %s)
-                    ''', (data.get('bot_token'), data.get('chat_id'), data.get('is_active')))
-                
-                conn.commit()
-                
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': dumps({'success': True}),
+                'isBase64Encoded': False
+            }
+        
+        elif action == 'test_telegram_bot':
+            import urllib.request as req_module
+            import urllib.parse as parse_module
+            import urllib.error as error_module
+            
+            data = body_data.get('data', {})
+            bot_token = data.get('bot_token', '').strip()
+            chat_id = str(data.get('chat_id', '')).strip()
+            
+            if not bot_token or not chat_id:
                 return {
-                    'statusCode': 200,
+                    'statusCode': 400,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': True}),
+                    'body': dumps({'success': False, 'error': 'Токен бота и Chat ID обязательны'}),
                     'isBase64Encoded': False
                 }
             
-            elif action == 'test_telegram_bot':
-                import urllib.request as req_module
-                import urllib.parse as parse_module
-                import urllib.error as error_module
-                
-                data = body_data.get('data', {})
-                bot_token = data.get('bot_token', '').strip()
-                chat_id = str(data.get('chat_id', '')).strip()
-                
-                if not bot_token or not chat_id:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'success': False, 'error': 'Токен бота и Chat ID обязательны'}),
-                        'isBase64Encoded': False
-                    }
-                
-                message = "✅ Подключение работает!\n\nВаш бот TransHub успешно настроен."
-                url = f'https://api.telegram.org/bot{bot_token}/sendMessage'
-                payload = {
-                    'chat_id': chat_id,
-                    'text': message
-                }
-                
-                try:
-                    data_encoded = parse_module.urlencode(payload).encode('utf-8')
-                    req = req_module.Request(url, data=data_encoded)
-                    with req_module.urlopen(req, timeout=10) as response:
-                        result = json.loads(response.read().decode('utf-8'))
-                        
-                        if result.get('ok'):
-                            return {
-                                'statusCode': 200,
-                                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                                'body': json.dumps({'success': True, 'message': 'Сообщение отправлено в ваш чат!'}),
-                                'isBase64Encoded': False
-                            }
-                        else:
-                            error_msg = result.get('description', 'Неизвестная ошибка')
-                            if 'chat not found' in error_msg.lower():
-                                error_msg = 'Вы не написали боту. Откройте бота в Telegram и отправьте ему /start'
-                            elif 'bot was blocked' in error_msg.lower():
-                                error_msg = 'Вы заблокировали бота. Разблокируйте его в Telegram'
-                            elif 'unauthorized' in error_msg.lower():
-                                error_msg = 'Неверный токен бота'
-                            
-                            return {
-                                'statusCode': 400,
-                                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                                'body': json.dumps({'success': False, 'error': error_msg}),
-                                'isBase64Encoded': False
-                            }
-                except error_module.HTTPError as e:
-                    error_body = e.read().decode('utf-8')
-                    try:
-                        error_json = json.loads(error_body)
-                        error_msg = error_json.get('description', str(e))
-                        if 'chat not found' in error_msg.lower():
-                            error_msg = 'Вы не написали боту. Откройте бота в Telegram и отправьте ему /start'
-                    except:
-                        error_msg = f'HTTP {e.code}: {e.reason}'
-                    
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'success': False, 'error': error_msg}),
-                        'isBase64Encoded': False
-                    }
-                except Exception as e:
-                    return {
-                        'statusCode': 500,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'success': False, 'error': f'Ошибка отправки: {str(e)}'}),
-                        'isBase64Encoded': False
-                    }
+            # База для проверки бота не нужна - отпускаем соединение до запроса к Telegram
+            uow.release(commit=True)
             
-            elif action == 'regenerate_invite_code':
-                import hashlib
-                import time
-                
-                user_id = body_data.get('user_id')
-                
-                if not user_id:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'success': False, 'error': 'user_id обязателен'}),
-                        'isBase64Encoded': False
-                    }
-                
-                new_code = 'INV_' + hashlib.md5(f'{user_id}{time.time()}'.encode()).hexdigest()[:8].upper()
-                
-                cur.execute('''
-                    UPDATE users 
-                    SET invite_code = %s, telegram_chat_id = NULL, telegram_connected_at = NULL
-                    WHERE id = %s
-                    RETURNING invite_code
-                ''', (new_code, user_id))
-                
-                result = cur.fetchone()
-                conn.commit()
-                
-                if result:
-                    return {
-                        'statusCode': 200,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'success': True, 'invite_code': result[0]}),
-                        'isBase64Encoded': False
-                    }
-                else:
-                    return {
-                        'statusCode': 404,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'success': False, 'error': 'Пользователь не найден'}),
-                        'isBase64Encoded': False
-                    }
+            message = "✅ Подключение работает!\n\nВаш бот TransHub успешно настроен."
+            url = f'https://api.telegram.org/bot{bot_token}/sendMessage'
+            payload = {
+                'chat_id': chat_id,
+                'text': message
+            }
             
-            elif action == 'add_order_stage':
-                order_id = body_data.get('order_id')
-                stage_data = body_data.get('stage', {})
-                
-                cur.execute('''
-                    INSERT INTO order_transport_stages (
-                        order_id, stage_number, vehicle_id, driver_id,
-                        from_location, to_location, notes, status
-                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-                    RETURNING id
-                ''', (
-                    order_id,
-                    stage_data.get('stage_number'),
-                    stage_data.get('vehicle_id'),
-                    stage_data.get('driver_id'),
-                    stage_data.get('from_location'),
-                    stage_data.get('to_location'),
-                    stage_data.get('notes', ''),
-                    'pending'
-                ))
-                
-                stage_id = cur.fetchone()[0]
-                conn.commit()
+            try:
+                data_encoded = parse_module.urlencode(payload).encode('utf-8')
+                req = req_module.Request(url, data=data_encoded)
+                with req_module.urlopen(req, timeout=10) as response:
+                    result = json.loads(response.read().decode('utf-8'))
+                    
+                    if result.get('ok'):
+                        return {
+                            'statusCode': 200,
+                            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                            'body': dumps({'success': True, 'message': 'Сообщение отправлено в ваш чат!'}),
+                            'isBase64Encoded': False
+                        }
+                    else:
+                        error_msg = result.get('description', 'Неизвестная ошибка')
+                        if 'chat not found' in error_msg.lower():
+                            error_msg = 'Вы не написали боту. Откройте бота в Telegram и отправьте ему /start'
+                        elif 'bot was blocked' in error_msg.lower():
+                            error_msg = 'Вы заблокировали бота. Разблокируйте его в Telegram'
+                        elif 'unauthorized' in error_msg.lower():
+                            error_msg = 'Неверный токен бота'
+                        
+                        return {
+                            'statusCode': 400,
+                            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                            'body': dumps({'success': False, 'error': error_msg}),
+                            'isBase64Encoded': False
+                        }
+            except error_module.HTTPError as e:
+                error_body = e.read().decode('utf-8')
+                try:
+                    error_json = json.loads(error_body)
+                    error_msg = error_json.get('description', str(e))
+                    if 'chat not found' in error_msg.lower():
+                        error_msg = 'Вы не написали боту. Откройте бота в Telegram и отправьте ему /start'
+                except:
+                    error_msg = f'HTTP {e.code}: {e.reason}'
                 
                 return {
-                    'statusCode': 200,
+                    'statusCode': 400,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': True, 'stage_id': stage_id}),
+                    'body': dumps({'success': False, 'error': error_msg}),
                     'isBase64Encoded': False
                 }
-            
-            elif action == 'update_session':
-                user_id = body_data.get('user_id')
-                section_name = body_data.get('section_name')
-                full_name = body_data.get('full_name', '')
-                role = body_data.get('role', '')
-                is_editing = body_data.get('is_editing', False)
-                editing_item_id = body_data.get('editing_item_id')
-                
-                if not user_id or not section_name:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'success': False, 'error': 'user_id and section_name required'}),
-                        'isBase64Encoded': False
-                    }
-                
-                cur.execute('''
-                    SELECT id FROM user_sessions 
-                    WHERE user_id = %s AND section_name = %s
-                ''', (user_id, section_name))
-                
-                existing = cur.fetchone()
-                
-                if existing:
-                    cur.execute('''
-                        UPDATE user_sessions 
-                        SET full_name = %s, role = %s, is_editing = %s, 
-                            editing_item_id = %s, last_activity = CURRENT_TIMESTAMP
-                        WHERE user_id = %s AND section_name = %s
-                    ''', (full_name, role, is_editing, editing_item_id, user_id, section_name))
-                else:
-                    cur.execute('''
-                        INSERT INTO user_sessions 
-                        (user_id, section_name, full_name, role, is_editing, editing_item_id)
-                        VALUES (%s, %s, %s, %s, %s, %s)
-                    ''', (user_id, section_name, full_name, role, is_editing, editing_item_id))
-                
-                conn.commit()
-                
+            except Exception as e:
                 return {
-                    'statusCode': 200,
+                    'statusCode': 500,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': True}),
+                    'body': dumps({'success': False, 'error': f'Ошибка отправки: {str(e)}'}),
                     'isBase64Encoded': False
                 }
+        
+        elif action == 'regenerate_invite_code':
+            import hashlib
+            import time
             
-            elif action == 'remove_session':
-                user_id = body_data.get('user_id')
-                section_name = body_data.get('section_name')
-                
-                if user_id and section_name:
-                    cur.execute('''
-                        UPDATE user_sessions 
-                        SET last_activity = NOW() - INTERVAL '10 minutes'
-                        WHERE user_id = %s AND section_name = %s
-                    ''', (user_id, section_name))
-                    conn.commit()
-                
+            user_id = body_data.get('user_id')
+            
+            if not user_id:
                 return {
-                    'statusCode': 200,
+                    'statusCode': 400,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': True}),
+                    'body': dumps({'success': False, 'error': 'user_id обязателен'}),
                     'isBase64Encoded': False
                 }
             
-            elif action == 'complete_stage':
-                stage_id = body_data.get('stage_id')
-                
-                if not stage_id:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'success': False, 'error': 'stage_id required'}),
-                        'isBase64Encoded': False
-                    }
-                
-                cur.execute('''
-                    UPDATE order_transport_stages 
-                    SET status = %s
-                    WHERE id = %s
-                ''', ('completed', stage_id))
-                
-                conn.commit()
-                
+            new_code = 'INV_' + hashlib.md5(f'{user_id}{time.time()}'.encode()).hexdigest()[:8].upper()
+            
+            cur.execute('''
+                UPDATE users 
+                SET invite_code = %s, telegram_chat_id = NULL, telegram_connected_at = NULL
+                WHERE id = %s
+                RETURNING invite_code
+            ''', (new_code, user_id))
+            
+            result = cur.fetchone()
+            
+            if result:
                 return {
                     'statusCode': 200,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': True}),
+                    'body': dumps({'success': True, 'invite_code': result[0]}),
                     'isBase64Encoded': False
                 }
-            
-            elif action == 'add_customs_point':
-                order_id = body_data.get('order_id')
-                customs_data = body_data.get('customs', {})
-                
-                cur.execute('''
-                    INSERT INTO order_customs_points (
-                        order_id, customs_name, country, crossing_date, notes
-                    ) VALUES (%s, %s, %s, %s, %s)
-                    RETURNING id
-                ''', (
-                    order_id,
-                    customs_data.get('customs_name'),
-                    customs_data.get('country', ''),
-                    customs_data.get('crossing_date'),
-                    customs_data.get('notes', '')
-                ))
-                
-                customs_id = cur.fetchone()[0]
-                conn.commit()
-                
+            else:
                 return {
-                    'statusCode': 200,
+                    'statusCode': 404,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': True, 'customs_id': customs_id}),
+                    'body': dumps({'success': False, 'error': 'Пользователь не найден'}),
                     'isBase64Encoded': False
                 }
+        
+        elif action == 'add_order_stage':
+            order_id = body_data.get('order_id')
+            stage_data = body_data.get('stage', {})
             
-            elif action == 'create_contract_application':
-                data = body_data.get('data', {})
-                
-                cur.execute('''
-                    INSERT INTO t_p96093837_transport_portal_fir.contract_applications (
-                        contract_number, contract_date, customer_id, carrier_id,
-                        vehicle_type, refrigerator, cargo_weight, cargo_volume,
-                        transport_mode, additional_conditions,
-                        loading_address, loading_date, loading_contact,
-                        unloading_address, unloading_date, unloading_contact,
-                        payment_amount, payment_without_vat, payment_terms, payment_documents,
-                        driver_name, driver_license, driver_passport, driver_passport_issued,
-                        vehicle_number, trailer_number, transport_conditions
-                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                    RETURNING id
-                ''', (
-                    data.get('contract_number'), data.get('contract_date'),
-                    data.get('customer_id') if data.get('customer_id') else None,
-                    data.get('carrier_id') if data.get('carrier_id') else None,
-                    data.get('vehicle_type'), data.get('refrigerator', False),
-                    data.get('cargo_weight') if data.get('cargo_weight') else None,
-                    data.get('cargo_volume') if data.get('cargo_volume') else None,
-                    data.get('transport_mode'), data.get('additional_conditions'),
-                    data.get('loading_address'), data.get('loading_date') if data.get('loading_date') else None,
-                    data.get('loading_contact'),
-                    data.get('unloading_address'), data.get('unloading_date') if data.get('unloading_date') else None,
-                    data.get('unloading_contact'),
-                    data.get('payment_amount') if data.get('payment_amount') else None,
-                    data.get('payment_without_vat', False),
-                    data.get('payment_terms'), data.get('payment_documents'),
-                    data.get('driver_name'), data.get('driver_license'),
-                    data.get('driver_passport'), data.get('driver_passport_issued'),
-                    data.get('vehicle_number'), data.get('trailer_number'),
-                    data.get('transport_conditions')
-                ))
-                
-                contract_id = cur.fetchone()[0]
-                conn.commit()
-                
+            carrier_fields = stage_carrier_fields(stage_data)
+            cur.execute('''
+                INSERT INTO order_transport_stages (
+                    order_id, stage_number, vehicle_id, driver_id,
+                    from_location, to_location, notes, status,
+                    carrier, phone, border_crossing
+                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                RETURNING id
+            ''', (
+                order_id,
+                stage_data.get('stage_number'),
+                stage_data.get('vehicle_id'),
+                stage_data.get('driver_id'),
+                stage_data.get('from_location'),
+                stage_data.get('to_location'),
+                stage_data.get('notes', ''),
+                'pending',
+                carrier_fields['carrier'],
+                carrier_fields['phone'],
+                carrier_fields['border_crossing']
+            ))
+            
+            stage_id = cur.fetchone()[0]
+            refresh_order_summary(cur, [order_id])
+            
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': dumps({'success': True, 'stage_id': stage_id}),
+                'isBase64Encoded': False
+            }
+        
+        elif action == 'update_session':
+            user_id = body_data.get('user_id')
+            section_name = body_data.get('section_name')
+            full_name = body_data.get('full_name', '')
+            role = body_data.get('role', '')
+            is_editing = body_data.get('is_editing', False)
+            editing_item_id = body_data.get('editing_item_id')
+            
+            if not user_id or not section_name:
                 return {
-                    'statusCode': 200,
+                    'statusCode': 400,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': True, 'contract_id': contract_id}),
+                    'body': dumps({'success': False, 'error': 'user_id and section_name required'}),
                     'isBase64Encoded': False
                 }
             
-            elif action == 'update_contract_application':
-                contract_id = body_data.get('contract_id')
-                data = body_data.get('data', {})
-                
+            # Одна строка на пользователя и раздел (uq_user_sessions_user_section)
+            cur.execute('''
+                INSERT INTO user_sessions 
+                (user_id, section_name, full_name, role, is_editing, editing_item_id)
+                VALUES (%s, %s, %s, %s, %s, %s)
+                ON CONFLICT (user_id, section_name) DO UPDATE
+                SET full_name = EXCLUDED.full_name, role = EXCLUDED.role, is_editing = EXCLUDED.is_editing,
+                    editing_item_id = EXCLUDED.editing_item_id, last_activity = CURRENT_TIMESTAMP
+            ''', (user_id, section_name, full_name, role, is_editing, editing_item_id))
+            
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': dumps({'success': True}),
+                'isBase64Encoded': False
+            }
+        
+        elif action == 'remove_session':
+            user_id = body_data.get('user_id')
+            section_name = body_data.get('section_name')
+            
+            if user_id and section_name:
                 cur.execute('''
-                    UPDATE t_p96093837_transport_portal_fir.contract_applications SET
-                        contract_number = %s, contract_date = %s, customer_id = %s, carrier_id = %s,
-                        vehicle_type = %s, refrigerator = %s, cargo_weight = %s, cargo_volume = %s,
-                        transport_mode = %s, additional_conditions = %s,
-                        loading_address = %s, loading_date = %s, loading_contact = %s,
-                        unloading_address = %s, unloading_date = %s, unloading_contact = %s,
-                        payment_amount = %s, payment_without_vat = %s, payment_terms = %s, payment_documents = %s,
-                        driver_name = %s, driver_license = %s, driver_passport = %s, driver_passport_issued = %s,
-                        vehicle_number = %s, trailer_number = %s, transport_conditions = %s,
-                        updated_at = CURRENT_TIMESTAMP
-                    WHERE id = %s
-                ''', (
-                    data.get('contract_number'), data.get('contract_date'),
-                    data.get('customer_id') if data.get('customer_id') else None,
-                    data.get('carrier_id') if data.get('carrier_id') else None,
-                    data.get('vehicle_type'), data.get('refrigerator', False),
-                    data.get('cargo_weight') if data.get('cargo_weight') else None,
-                    data.get('cargo_volume') if data.get('cargo_volume') else None,
-                    data.get('transport_mode'), data.get('additional_conditions'),
-                    data.get('loading_address'), data.get('loading_date') if data.get('loading_date') else None,
-                    data.get('loading_contact'),
-                    data.get('unloading_address'), data.get('unloading_date') if data.get('unloading_date') else None,
-                    data.get('unloading_contact'),
-                    data.get('payment_amount') if data.get('payment_amount') else None,
-                    data.get('payment_without_vat', False),
-                    data.get('payment_terms'), data.get('payment_documents'),
-                    data.get('driver_name'), data.get('driver_license'),
-                    data.get('driver_passport'), data.get('driver_passport_issued'),
-                    data.get('vehicle_number'), data.get('trailer_number'),
-                    data.get('transport_conditions'),
-                    contract_id
-                ))
-                
-                conn.commit()
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': True}),
-                    'isBase64Encoded': False
-                }
+                    UPDATE user_sessions 
+                    SET last_activity = NOW() - INTERVAL '10 minutes'
+                    WHERE user_id = %s AND section_name = %s
+                ''', (user_id, section_name))
             
-            elif action == 'delete_contract_application':
-                contract_id = body_data.get('contract_id')
-                
-                cur.execute('DELETE FROM t_p96093837_transport_portal_fir.contract_applications WHERE id = %s', (contract_id,))
-                conn.commit()
-                
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': dumps({'success': True}),
+                'isBase64Encoded': False
+            }
+        
+        elif action == 'complete_stage':
+            stage_id = body_data.get('stage_id')
+            
+            if not stage_id:
                 return {
-                    'statusCode': 200,
+                    'statusCode': 400,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': True}),
+                    'body': dumps({'success': False, 'error': 'stage_id required'}),
                     'isBase64Encoded': False
                 }
+            
+            # expected_version здесь - версия этапа
+            try:
+                expected_version = parse_expected_version(body_data.get('expected_version'))
+            except ValueError:
+                return invalid_version_response()
+            
+            cur.execute('''
+                UPDATE order_transport_stages 
+                SET status = %s, version = version + 1
+                WHERE id = %s AND (%s::int IS NULL OR version = %s::int)
+                RETURNING vehicle_id, driver_id, order_id, version
+            ''', ('completed', stage_id, expected_version, expected_version))
+            completed_stage = cur.fetchone()
+            if completed_stage:
+                refresh_asset_usage(cur, usage_spans(cur, stage_ids=[stage_id]))
+                bump_order_version(cur, completed_stage[2])
+            elif expected_version is not None:
+                cur.execute('SELECT order_id FROM order_transport_stages WHERE id = %s', (stage_id,))
+                stage_order = cur.fetchone()
+                if stage_order:
+                    return version_conflict_response(cur, stage_order[0])
+            
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': dumps({'success': True, 'version': completed_stage[3] if completed_stage else None}),
+                'isBase64Encoded': False
+            }
+        
+        elif action == 'add_customs_point':
+            order_id = body_data.get('order_id')
+            customs_data = body_data.get('customs', {})
+            
+            cur.execute('''
+                INSERT INTO order_customs_points (
+                    order_id, customs_name, country, crossing_date, notes
+                ) VALUES (%s, %s, %s, %s, %s)
+                RETURNING id
+            ''', (
+                order_id,
+                customs_data.get('customs_name'),
+                customs_data.get('country', ''),
+                customs_data.get('crossing_date'),
+                customs_data.get('notes', '')
+            ))
+            
+            customs_id = cur.fetchone()[0]
+            
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': dumps({'success': True, 'customs_id': customs_id}),
+                'isBase64Encoded': False
+            }
         
-        elif method == 'PUT':
-            body_data = json.loads(event.get('body', '{}'))
-            resource = body_data.get('resource')
+        elif action == 'create_contract_application':
             data = body_data.get('data', {})
-            item_id = body_data.get('id')
             
-            if resource == 'order':
-                cur.execute('SELECT order_number, driver_id, vehicle_id FROM orders WHERE id = %s', (item_id,))
-                old_data = cur.fetchone()
-                old_order_number, old_driver_id, old_vehicle_id = old_data if old_data else (None, None, None)
-                
+            cur.execute('''
+                INSERT INTO contract_applications (
+                    contract_number, contract_date, customer_id, carrier_id,
+                    vehicle_type, refrigerator, cargo_weight, cargo_volume,
+                    transport_mode, additional_conditions,
+                    loading_address, loading_date, loading_contact,
+                    unloading_address, unloading_date, unloading_contact,
+                    payment_amount, payment_without_vat, payment_terms, payment_documents,
+                    driver_name, driver_license, driver_passport, driver_passport_issued,
+                    vehicle_number, trailer_number, transport_conditions
+                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                RETURNING id
+            ''', (
+                data.get('contract_number'), data.get('contract_date'),
+                data.get('customer_id') if data.get('customer_id') else None,
+                data.get('carrier_id') if data.get('carrier_id') else None,
+                data.get('vehicle_type'), data.get('refrigerator', False),
+                data.get('cargo_weight') if data.get('cargo_weight') else None,
+                data.get('cargo_volume') if data.get('cargo_volume') else None,
+                data.get('transport_mode'), data.get('additional_conditions'),
+                data.get('loading_address'), data.get('loading_date') if data.get('loading_date') else None,
+                data.get('loading_contact'),
+                data.get('unloading_address'), data.get('unloading_date') if data.get('unloading_date') else None,
+                data.get('unloading_contact'),
+                data.get('payment_amount') if data.get('payment_amount') else None,
+                data.get('payment_without_vat', False),
+                data.get('payment_terms'), data.get('payment_documents'),
+                data.get('driver_name'), data.get('driver_license'),
+                data.get('driver_passport'), data.get('driver_passport_issued'),
+                data.get('vehicle_number'), data.get('trailer_number'),
+                data.get('transport_conditions')
+            ))
+            
+            contract_id = cur.fetchone()[0]
+            
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': dumps({'success': True, 'contract_id': contract_id}),
+                'isBase64Encoded': False
+            }
+        
+        elif action == 'update_contract_application':
+            contract_id = body_data.get('contract_id')
+            data = body_data.get('data', {})
+            
+            cur.execute('''
+                UPDATE contract_applications SET
+                    contract_number = %s, contract_date = %s, customer_id = %s, carrier_id = %s,
+                    vehicle_type = %s, refrigerator = %s, cargo_weight = %s, cargo_volume = %s,
+                    transport_mode = %s, additional_conditions = %s,
+                    loading_address = %s, loading_date = %s, loading_contact = %s,
+                    unloading_address = %s, unloading_date = %s, unloading_contact = %s,
+                    payment_amount = %s, payment_without_vat = %s, payment_terms = %s, payment_documents = %s,
+                    driver_name = %s, driver_license = %s, driver_passport = %s, driver_passport_issued = %s,
+                    vehicle_number = %s, trailer_number = %s, transport_conditions = %s,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE id = %s
+            ''', (
+                data.get('contract_number'), data.get('contract_date'),
+                data.get('customer_id') if data.get('customer_id') else None,
+                data.get('carrier_id') if data.get('carrier_id') else None,
+                data.get('vehicle_type'), data.get('refrigerator', False),
+                data.get('cargo_weight') if data.get('cargo_weight') else None,
+                data.get('cargo_volume') if data.get('cargo_volume') else None,
+                data.get('transport_mode'), data.get('additional_conditions'),
+                data.get('loading_address'), data.get('loading_date') if data.get('loading_date') else None,
+                data.get('loading_contact'),
+                data.get('unloading_address'), data.get('unloading_date') if data.get('unloading_date') else None,
+                data.get('unloading_contact'),
+                data.get('payment_amount') if data.get('payment_amount') else None,
+                data.get('payment_without_vat', False),
+                data.get('payment_terms'), data.get('payment_documents'),
+                data.get('driver_name'), data.get('driver_license'),
+                data.get('driver_passport'), data.get('driver_passport_issued'),
+                data.get('vehicle_number'), data.get('trailer_number'),
+                data.get('transport_conditions'),
+                contract_id
+            ))
+            
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': dumps({'success': True}),
+                'isBase64Encoded': False
+            }
+        
+        elif action == 'delete_contract_application':
+            contract_id = body_data.get('contract_id')
+            
+            cur.execute('DELETE FROM contract_applications WHERE id = %s', (contract_id,))
+            
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': dumps({'success': True}),
+                'isBase64Encoded': False
+            }
+    
+    elif method == 'PUT':
+        body_data = json.loads(event.get('body', '{}'))
+        resource = body_data.get('resource')
+        data = body_data.get('data', {})
+        item_id = body_data.get('id')
+        
+        if resource == 'order':
+            try:
+                expected_version = parse_expected_version(body_data.get('expected_version'))
+            except ValueError:
+                return invalid_version_response()
+            if expected_version is None:
+                return missing_version_response()
+            
+            cur.execute('SELECT order_number, driver_id, vehicle_id FROM orders WHERE id = %s AND deleted_at IS NULL', (item_id,))
+            old_data = cur.fetchone()
+            old_order_number, old_driver_id, old_vehicle_id = old_data if old_data else (None, None, None)
+            
+            try:
                 cur.execute('''
                     UPDATE orders SET
                         order_number = %s, client_id = %s, carrier = %s, vehicle_id = %s,
                         driver_id = %s, route_from = %s, route_to = %s, status = %s,
                         invoice_number = %s, phone = %s, border_crossing = %s,
-                        delivery_address = %s, overload = %s
-                    WHERE id = %s
+                        delivery_address = %s, overload = %s, version = version + 1
+                    WHERE id = %s AND deleted_at IS NULL AND version = %s
+                    RETURNING version
                 ''', (
                     data.get('order_number'), data.get('client_id'), data.get('carrier'),
                     data.get('vehicle_id'), data.get('driver_id'), data.get('route_from'),
                     data.get('route_to'), data.get('status'), data.get('invoice_number'),
                     data.get('phone'), data.get('border_crossing'), data.get('delivery_address'),
-                    data.get('overload'), item_id
+                    data.get('overload'), item_id, expected_version
                 ))
-                
-                user_role = body_data.get('user_role', 'Пользователь')
-                user_name = body_data.get('user_name', user_role)
-                changes = []
-                if old_driver_id != data.get('driver_id'):
-                    cur.execute('SELECT full_name FROM drivers WHERE id = %s', (data.get('driver_id'),))
-                    driver_name = cur.fetchone()
-                    if driver_name:
-                        changes.append(f'назначил водителя {driver_name[0]}')
-                if old_vehicle_id != data.get('vehicle_id'):
-                    cur.execute('SELECT license_plate FROM vehicles WHERE id = %s', (data.get('vehicle_id'),))
-                    vehicle_plate = cur.fetchone()
-                    if vehicle_plate:
-                        changes.append(f'назначил автомобиль {vehicle_plate[0]}')
-                
-                if changes:
-                    description = f'{" и ".join(changes)} в заказе {old_order_number}'
+            except psycopg2.errors.UniqueViolation as e:
+                if not is_duplicate_order_number(e):
+                    raise
+                return duplicate_number_response(data.get('order_number'))
+            updated = cur.fetchone()
+            if not updated:
+                return version_conflict_response(cur, item_id)
+            
+            user_role = body_data.get('user_role', 'Пользователь')
+            user_name = body_data.get('user_name', user_role)
+            changes = []
+            if old_driver_id != data.get('driver_id'):
+                cur.execute('SELECT full_name FROM drivers WHERE id = %s', (data.get('driver_id'),))
+                driver_name = cur.fetchone()
+                if driver_name:
+                    changes.append(f'назначил водителя {driver_name[0]}')
+            if old_vehicle_id != data.get('vehicle_id'):
+                execute_prepared(cur, 'vehicle_plate_by_id', (data.get('vehicle_id'),))
+                vehicle_plate = cur.fetchone()
+                if vehicle_plate:
+                    changes.append(f'назначил автомобиль {vehicle_plate[0]}')
+            
+            if changes:
+                description = f'{" и ".join(changes)} в заказе {old_order_number}'
+                execute_prepared(cur, 'activity_log_insert', (item_id, user_role, user_name, 'update_order', description))
+            
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': dumps({'success': True, 'version': updated[0]}),
+                'isBase64Encoded': False
+            }
+        
+        elif resource == 'vehicle':
+            cur.execute('''
+                UPDATE vehicles SET 
+                    license_plate = %s, 
+                    model = %s, 
+                    capacity = %s, 
+                    status = %s,
+                    vehicle_brand = %s,
+                    trailer_plate = %s,
+                    body_type = %s,
+                    company_name = %s,
+                    driver_id = %s,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE id = %s
+            ''', (
+                data.get('license_plate'), 
+                data.get('vehicle_brand'), 
+                data.get('body_type', ''), 
+                data.get('status', 'available'),
+                data.get('vehicle_brand'),
+                data.get('trailer_plate'),
+                data.get('body_type'),
+                data.get('company_name'),
+                data.get('driver_id'),
+                item_id
+            ))
+            refresh_order_summary_for_vehicle(cur, item_id)
+            
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': dumps({'success': True}),
+                'isBase64Encoded': False
+            }
+        
+        elif resource == 'customer':
+            cur.execute('''
+                UPDATE customers SET company_name = %s, inn = %s, kpp = %s, legal_address = %s,
+                                   director_name = %s, delivery_address = %s, nickname = %s,
+                                   contact_person = %s, phone = %s, email = %s
+                WHERE id = %s
+            ''', (data.get('company_name'), data.get('inn'), data.get('kpp'), 
+                  data.get('legal_address'), data.get('director_name'), data.get('delivery_address'),
+                  data.get('nickname'), data.get('contact_person'), data.get('phone'), 
+                  data.get('email'), item_id))
+            refresh_order_summary_for_customer(cur, item_id)
+            
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': dumps({'success': True}),
+                'isBase64Encoded': False
+            }
+        
+        elif resource == 'customer_address':
+            if data.get('is_primary'):
+                cur.execute('''
+                    SELECT customer_id FROM customer_delivery_addresses WHERE id = %s
+                ''', (item_id,))
+                customer_row = cur.fetchone()
+                if customer_row:
                     cur.execute('''
-                        INSERT INTO activity_log (order_id, user_role, user_name, action_type, description)
-                        VALUES (%s, %s, %s, %s, %s)
-                    ''', (item_id, user_role, user_name, 'update_order', description))
-                
-                conn.commit()
-                
+                        UPDATE customer_delivery_addresses 
+                        SET is_primary = false 
+                        WHERE customer_id = %s
+                    ''', (customer_row[0],))
+            
+            cur.execute('''
+                UPDATE customer_delivery_addresses 
+                SET address_name = %s, address = %s, contact_person = %s, phone = %s, is_primary = %s
+                WHERE id = %s
+            ''', (data.get('address_name'), data.get('address'), data.get('contact_person'),
+                  data.get('phone'), data.get('is_primary', False), item_id))
+            
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': dumps({'success': True}),
+                'isBase64Encoded': False
+            }
+        
+        elif resource == 'client':
+            cur.execute('''
+                UPDATE clients SET name = %s, contact_person = %s, phone = %s, email = %s, address = %s
+                WHERE id = %s
+            ''', (data.get('name'), data.get('contact_person'), data.get('phone'), 
+                  data.get('email'), data.get('address'), item_id))
+            
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': dumps({'success': True}),
+                'isBase64Encoded': False
+            }
+        
+        elif resource == 'user':
+            cur.execute('''
+                UPDATE users SET full_name = %s, email = %s, phone = %s, role = %s, is_active = %s, updated_at = CURRENT_TIMESTAMP
+                WHERE id = %s
+            ''', (data.get('full_name'), data.get('email'), data.get('phone'),
+                  data.get('role'), data.get('is_active'), item_id))
+            
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': dumps({'success': True}),
+                'isBase64Encoded': False
+            }
+        
+        elif resource == 'driver':
+            # Формируем full_name из компонентов для совместимости
+            full_name_parts = [
+                data.get('last_name', ''),
+                data.get('first_name', ''),
+                data.get('middle_name', '')
+            ]
+            full_name = ' '.join([p for p in full_name_parts if p]).strip() or 'Не указано'
+            
+            cur.execute('''
+                UPDATE drivers 
+                SET full_name = %s,
+                    last_name = %s, first_name = %s, middle_name = %s,
+                    phone = %s, additional_phone = %s,
+                    passport_series = %s, passport_number = %s,
+                    passport_issued_by = %s, passport_issue_date = %s,
+                    license_series = %s, license_number = %s,
+                    license_issued_by = %s, license_issue_date = %s,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE id = %s
+            ''', (
+                full_name,
+                data.get('last_name'), data.get('first_name'), data.get('middle_name'),
+                data.get('phone'), data.get('additional_phone'),
+                data.get('passport_series'), data.get('passport_number'),
+                data.get('passport_issued_by'), data.get('passport_issue_date'),
+                data.get('license_series'), data.get('license_number'),
+                data.get('license_issued_by'), data.get('license_issue_date'),
+                item_id
+            ))
+            refresh_order_summary_for_driver(cur, item_id)
+            
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': dumps({'success': True}),
+                'isBase64Encoded': False
+            }
+    
+    elif method == 'DELETE':
+        body_data = json.loads(event.get('body', '{}'))
+        resource = body_data.get('resource')
+        item_id = body_data.get('id')
+        
+        if resource == 'order':
+            soft_delete_order(cur, item_id)
+        elif resource == 'driver':
+            # Проверка связи с заказами
+            cur.execute('SELECT COUNT(*) FROM orders WHERE driver_id = %s AND deleted_at IS NULL', (item_id,))
+            orders_count = cur.fetchone()[0]
+            if orders_count > 0:
                 return {
-                    'statusCode': 200,
+                    'statusCode': 400,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': True}),
+                    'body': dumps({'error': 'Невозможно удалить водителя. Он задействован в заказах.'}),
                     'isBase64Encoded': False
                 }
             
-            elif resource == 'vehicle':
-                cur.execute('''
-                    UPDATE vehicles SET 
-                        license_plate = %s, 
-                        model = %s, 
-                        capacity = %s, 
-                        status = %s,
-                        vehicle_brand = %s,
-                        trailer_plate = %s,
-                        body_type = %s,
-                        company_name = %s,
-                        driver_id = %s,
-                        updated_at = CURRENT_TIMESTAMP
-                    WHERE id = %s
-                ''', (
-                    data.get('license_plate'), 
-                    data.get('vehicle_brand'), 
-                    data.get('body_type', ''), 
-                    data.get('status', 'available'),
-                    data.get('vehicle_brand'),
-                    data.get('trailer_plate'),
-                    data.get('body_type'),
-                    data.get('company_name'),
-                    data.get('driver_id'),
-                    item_id
-                ))
-                conn.commit()
-                
+            # Проверка связи с автомобилями
+            cur.execute('SELECT COUNT(*) FROM vehicles WHERE driver_id = %s', (item_id,))
+            vehicles_count = cur.fetchone()[0]
+            if vehicles_count > 0:
+                cur.execute('SELECT license_plate FROM vehicles WHERE driver_id = %s LIMIT 3', (item_id,))
+                vehicles = [row[0] for row in cur.fetchall()]
+                vehicles_str = ', '.join(vehicles)
                 return {
-                    'statusCode': 200,
+                    'statusCode': 400,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': True}),
+                    'body': dumps({'error': f'Невозможно удалить водителя. Он привязан к автомобилям: {vehicles_str}'}),
                     'isBase64Encoded': False
                 }
             
-            elif resource == 'customer':
-                cur.execute('''
-                    UPDATE customers SET company_name = %s, inn = %s, kpp = %s, legal_address = %s,
-                                       director_name = %s, delivery_address = %s, nickname = %s,
-                                       contact_person = %s, phone = %s, email = %s
-                    WHERE id = %s
-                ''', (data.get('company_name'), data.get('inn'), data.get('kpp'), 
-                      data.get('legal_address'), data.get('director_name'), data.get('delivery_address'),
-                      data.get('nickname'), data.get('contact_person'), data.get('phone'), 
-                      data.get('email'), item_id))
-                conn.commit()
-                
+            detach_deleted_orders(cur, 'driver_id', item_id)
+            cur.execute('DELETE FROM drivers WHERE id = %s', (item_id,))
+        elif resource == 'vehicle':
+            # Проверка связи с заказами
+            cur.execute('SELECT COUNT(*) FROM orders WHERE vehicle_id = %s AND deleted_at IS NULL', (item_id,))
+            orders_count = cur.fetchone()[0]
+            if orders_count > 0:
+                cur.execute('SELECT order_number FROM orders WHERE vehicle_id = %s AND deleted_at IS NULL LIMIT 3', (item_id,))
+                orders = [row[0] for row in cur.fetchall()]
+                orders_str = ', '.join(orders)
                 return {
-                    'statusCode': 200,
+                    'statusCode': 400,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': True}),
+                    'body': dumps({'error': f'Невозможно удалить автомобиль. Он задействован в заказах: {orders_str}'}),
                     'isBase64Encoded': False
                 }
             
-            elif resource == 'customer_address':
-                if data.get('is_primary'):
-                    cur.execute('''
-                        SELECT customer_id FROM customer_delivery_addresses WHERE id = %s
-                    ''', (item_id,))
-                    customer_row = cur.fetchone()
-                    if customer_row:
-                        cur.execute('''
-                            UPDATE customer_delivery_addresses 
-                            SET is_primary = false 
-                            WHERE customer_id = %s
-                        ''', (customer_row[0],))
-                
-                cur.execute('''
-                    UPDATE customer_delivery_addresses 
-                    SET address_name = %s, address = %s, contact_person = %s, phone = %s, is_primary = %s
-                    WHERE id = %s
-                ''', (data.get('address_name'), data.get('address'), data.get('contact_person'),
-                      data.get('phone'), data.get('is_primary', False), item_id))
-                conn.commit()
-                
+            # Проверка связи с этапами заказов
+            cur.execute('''
+                SELECT COUNT(*) FROM order_transport_stages s
+                JOIN orders o ON o.id = s.order_id
+                WHERE s.vehicle_id = %s AND o.deleted_at IS NULL
+            ''', (item_id,))
+            stages_count = cur.fetchone()[0]
+            if stages_count > 0:
                 return {
-                    'statusCode': 200,
+                    'statusCode': 400,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': True}),
+                    'body': dumps({'error': 'Невозможно удалить автомобиль. Он используется в этапах доставки заказов.'}),
                     'isBase64Encoded': False
                 }
             
-            elif resource == 'client':
-                cur.execute('''
-                    UPDATE clients SET name = %s, contact_person = %s, phone = %s, email = %s, address = %s
-                    WHERE id = %s
-                ''', (data.get('name'), data.get('contact_person'), data.get('phone'), 
-                      data.get('email'), data.get('address'), item_id))
-                conn.commit()
-                
+            detach_deleted_orders(cur, 'vehicle_id', item_id)
+            cur.execute('DELETE FROM vehicles WHERE id = %s', (item_id,))
+        elif resource == 'client':
+            # Проверка связи с заказами
+            cur.execute('SELECT COUNT(*) FROM orders WHERE client_id = %s AND deleted_at IS NULL', (item_id,))
+            orders_count = cur.fetchone()[0]
+            if orders_count > 0:
+                cur.execute('SELECT order_number FROM orders WHERE client_id = %s AND deleted_at IS NULL LIMIT 3', (item_id,))
+                orders = [row[0] for row in cur.fetchall()]
+                orders_str = ', '.join(orders)
                 return {
-                    'statusCode': 200,
+                    'statusCode': 400,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': True}),
+                    'body': dumps({'error': f'Невозможно удалить перевозчика. Он задействован в заказах: {orders_str}'}),
                     'isBase64Encoded': False
                 }
             
-            elif resource == 'user':
-                cur.execute('''
-                    UPDATE users SET full_name = %s, email = %s, phone = %s, role = %s, is_active = %s, updated_at = CURRENT_TIMESTAMP
-                    WHERE id = %s
-                ''', (data.get('full_name'), data.get('email'), data.get('phone'),
-                      data.get('role'), data.get('is_active'), item_id))
-                conn.commit()
-                
+            # Проверка связи с автомобилями
+            cur.execute('SELECT COUNT(*) FROM vehicles WHERE company_name = (SELECT name FROM clients WHERE id = %s)', (item_id,))
+            vehicles_count = cur.fetchone()[0]
+            if vehicles_count > 0:
+                cur.execute('SELECT license_plate FROM vehicles WHERE company_name = (SELECT name FROM clients WHERE id = %s) LIMIT 3', (item_id,))
+                vehicles = [row[0] for row in cur.fetchall()]
+                vehicles_str = ', '.join(vehicles)
                 return {
-                    'statusCode': 200,
+                    'statusCode': 400,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': True}),
+                    'body': dumps({'error': f'Невозможно удалить перевозчика. К нему привязаны автомобили: {vehicles_str}'}),
                     'isBase64Encoded': False
                 }
             
-            elif resource == 'driver':
-                # Формируем full_name из компонентов для совместимости
-                full_name_parts = [
-                    data.get('last_name', ''),
-                    data.get('first_name', ''),
-                    data.get('middle_name', '')
-                ]
-                full_name = ' '.join([p for p in full_name_parts if p]).strip() or 'Не указано'
-                
-                cur.execute('''
-                    UPDATE drivers 
-                    SET full_name = %s,
-                        last_name = %s, first_name = %s, middle_name = %s,
-                        phone = %s, additional_phone = %s,
-                        passport_series = %s, passport_number = %s,
-                        passport_issued_by = %s, passport_issue_date = %s,
-                        license_series = %s, license_number = %s,
-                        license_issued_by = %s, license_issue_date = %s,
-                        updated_at = CURRENT_TIMESTAMP
-                    WHERE id = %s
-                ''', (
-                    full_name,
-                    data.get('last_name'), data.get('first_name'), data.get('middle_name'),
-                    data.get('phone'), data.get('additional_phone'),
-                    data.get('passport_series'), data.get('passport_number'),
-                    data.get('passport_issued_by'), data.get('passport_issue_date'),
-                    data.get('license_series'), data.get('license_number'),
-                    data.get('license_issued_by'), data.get('license_issue_date'),
-                    item_id
-                ))
-                conn.commit()
-                
+            detach_deleted_orders(cur, 'client_id', item_id)
+            cur.execute('DELETE FROM clients WHERE id = %s', (item_id,))
+        elif resource == 'customer':
+            # Проверка связи с заказами через customer_items
+            cur.execute('''
+                SELECT COUNT(*) FROM orders 
+                WHERE customer_items::text LIKE %s AND deleted_at IS NULL
+            ''', (f'%"customer_id": {item_id}%',))
+            orders_count = cur.fetchone()[0]
+            if orders_count > 0:
                 return {
-                    'statusCode': 200,
+                    'statusCode': 400,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': True}),
+                    'body': dumps({'error': 'Невозможно удалить заказчика. Он используется в заказах.'}),
                     'isBase64Encoded': False
                 }
-        
-        elif method == 'DELETE':
-            body_data = json.loads(event.get('body', '{}'))
-            resource = body_data.get('resource')
-            item_id = body_data.get('id')
-            
-            if resource == 'order':
-                cur.execute('DELETE FROM order_stages WHERE order_id = %s', (item_id,))
-                cur.execute('DELETE FROM orders WHERE id = %s', (item_id,))
-            elif resource == 'driver':
-                # Проверка связи с заказами
-                cur.execute('SELECT COUNT(*) FROM orders WHERE driver_id = %s', (item_id,))
-                orders_count = cur.fetchone()[0]
-                if orders_count > 0:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Невозможно удалить водителя. Он задействован в заказах.'}),
-                        'isBase64Encoded': False
-                    }
-                
-                # Проверка связи с автомобилями
-                cur.execute('SELECT COUNT(*) FROM vehicles WHERE driver_id = %s', (item_id,))
-                vehicles_count = cur.fetchone()[0]
-                if vehicles_count > 0:
-                    cur.execute('SELECT license_plate FROM vehicles WHERE driver_id = %s LIMIT 3', (item_id,))
-                    vehicles = [row[0] for row in cur.fetchall()]
-                    vehicles_str = ', '.join(vehicles)
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': f'Невозможно удалить водителя. Он привязан к автомобилям: {vehicles_str}'}),
-                        'isBase64Encoded': False
-                    }
-                
-                cur.execute('DELETE FROM drivers WHERE id = %s', (item_id,))
-            elif resource == 'vehicle':
-                # Проверка связи с заказами
-                cur.execute('SELECT COUNT(*) FROM orders WHERE vehicle_id = %s', (item_id,))
-                orders_count = cur.fetchone()[0]
-                if orders_count > 0:
-                    cur.execute('SELECT order_number FROM orders WHERE vehicle_id = %s LIMIT 3', (item_id,))
-                    orders = [row[0] for row in cur.fetchall()]
-                    orders_str = ', '.join(orders)
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': f'Невозможно удалить автомобиль. Он задействован в заказах: {orders_str}'}),
-                        'isBase64Encoded': False
-                    }
-                
-                # Проверка связи с этапами заказов
-                cur.execute('SELECT COUNT(*) FROM order_transport_stages WHERE vehicle_id = %s', (item_id,))
-                stages_count = cur.fetchone()[0]
-                if stages_count > 0:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Невозможно удалить автомобиль. Он используется в этапах доставки заказов.'}),
-                        'isBase64Encoded': False
-                    }
-                
-                cur.execute('DELETE FROM vehicles WHERE id = %s', (item_id,))
-            elif resource == 'client':
-                # Проверка связи с заказами
-                cur.execute('SELECT COUNT(*) FROM orders WHERE client_id = %s', (item_id,))
-                orders_count = cur.fetchone()[0]
-                if orders_count > 0:
-                    cur.execute('SELECT order_number FROM orders WHERE client_id = %s LIMIT 3', (item_id,))
-                    orders = [row[0] for row in cur.fetchall()]
-                    orders_str = ', '.join(orders)
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': f'Невозможно удалить перевозчика. Он задействован в заказах: {orders_str}'}),
-                        'isBase64Encoded': False
-                    }
-                
-                # Проверка связи с автомобилями
-                cur.execute('SELECT COUNT(*) FROM vehicles WHERE company_name = (SELECT name FROM clients WHERE id = %s)', (item_id,))
-                vehicles_count = cur.fetchone()[0]
-                if vehicles_count > 0:
-                    cur.execute('SELECT license_plate FROM vehicles WHERE company_name = (SELECT name FROM clients WHERE id = %s) LIMIT 3', (item_id,))
-                    vehicles = [row[0] for row in cur.fetchall()]
-                    vehicles_str = ', '.join(vehicles)
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': f'Невозможно удалить перевозчика. К нему привязаны автомобили: {vehicles_str}'}),
-                        'isBase64Encoded': False
-                    }
-                
-                cur.execute('DELETE FROM clients WHERE id = %s', (item_id,))
-            elif resource == 'customer':
-                # Проверка связи с заказами через customer_items
-                cur.execute('''
-                    SELECT COUNT(*) FROM orders 
-                    WHERE customer_items::text LIKE %s
-                ''', (f'%"customer_id": {item_id}%',))
-                orders_count = cur.fetchone()[0]
-                if orders_count > 0:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Невозможно удалить заказчика. Он используется в заказах.'}),
-                        'isBase64Encoded': False
-                    }
-                
-                # Удаляем связанные адреса доставки
-                cur.execute('DELETE FROM customer_delivery_addresses WHERE customer_id = %s', (item_id,))
-                cur.execute('DELETE FROM customers WHERE id = %s', (item_id,))
-            elif resource == 'customer_address':
-                cur.execute('DELETE FROM customer_delivery_addresses WHERE id = %s', (item_id,))
-            elif resource == 'user':
-                cur.execute('DELETE FROM users WHERE id = %s', (item_id,))
-            
-            conn.commit()
             
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'success': True}),
-                'isBase64Encoded': False
-            }
+            # Удаляем связанные адреса доставки
+            cur.execute('DELETE FROM customer_delivery_addresses WHERE customer_id = %s', (item_id,))
+            cur.execute('DELETE FROM customers WHERE id = %s', (item_id,))
+        elif resource == 'customer_address':
+            cur.execute('DELETE FROM customer_delivery_addresses WHERE id = %s', (item_id,))
+        elif resource == 'user':
+            cur.execute('DELETE FROM users WHERE id = %s', (item_id,))
         
         return {
-            'statusCode': 405,
+            'statusCode': 200,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Method not allowed'}),
+            'body': dumps({'success': True}),
             'isBase64Encoded': False
         }
     
-    finally:
-        cur.close()
-        conn.close()
\ No newline at end of file
+    return {
+        'statusCode': 405,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': dumps({'error': 'Method not allowed'}),
+        'isBase64Encoded': False
+    }
\ No newline at end of file
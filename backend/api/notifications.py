@@ -0,0 +1,28 @@
+import json
+import os
+from typing import Any, Dict
+
+# Облачная функция backend/telegram: рассылка уведомлений о событиях заказа
+# (при запуске через server/wsgi.py - её маршрут /telegram/)
+TELEGRAM_NOTIFY_URL = os.environ.get(
+    'TELEGRAM_NOTIFY_URL', 'https://functions.poehali.dev/a5ca5f70-a100-4290-9d7c-54189ae3319e'
+)
+
+
+def notify_telegram(payload: Dict[str, Any]) -> None:
+    '''
+    Отправляет событие в функцию telegram. Ошибки сети не влияют на ответ API,
+    поэтому игнорируются. Вызывается через UnitOfWork.after_release - уже без
+    открытого соединения с базой.
+    '''
+    import urllib.request
+
+    try:
+        request = urllib.request.Request(
+            TELEGRAM_NOTIFY_URL,
+            data=json.dumps(payload).encode('utf-8'),
+            headers={'Content-Type': 'application/json'}
+        )
+        urllib.request.urlopen(request, timeout=5)
+    except Exception:
+        pass
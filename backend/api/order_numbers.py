@@ -0,0 +1,117 @@
+import os
+from typing import Any, Dict, Optional, Tuple
+
+from response_utils import dumps
+
+# direction хранится в VARCHAR(10) (V0002)
+MAX_DIRECTION_LENGTH = 10
+# Уникальный индекс orders.order_number (V0012)
+ORDER_NUMBER_CONSTRAINT = 'uq_orders_order_number'
+
+# Номер, выданный форме и не использованный за это время, выдаётся снова
+RESERVATION_TTL_MINUTES = int(os.environ.get('ORDER_NUMBER_RESERVATION_TTL_MINUTES', '60'))
+# Неиспользованные резервы старше этого удаляются (номер больше не выдаётся)
+RESERVATION_KEEP_DAYS = int(os.environ.get('ORDER_NUMBER_RESERVATION_KEEP_DAYS', '7'))
+# Сколько устаревших резервов удаляет каждое выделение номера
+RESERVATION_CLEANUP_BATCH = 50
+
+# Самый старый просроченный резерв того же направления и даты, если номер так и
+# не занят заказом (в том числе введённым вручную)
+RECLAIM_RESERVATION = '''
+    UPDATE order_number_reservations
+    SET reserved_at = CURRENT_TIMESTAMP
+    WHERE order_number = (
+        SELECT r.order_number FROM order_number_reservations r
+        WHERE r.order_number LIKE %(prefix)s
+          AND r.consumed_at IS NULL
+          AND r.reserved_at < CURRENT_TIMESTAMP - make_interval(mins => %(ttl)s)
+          AND NOT EXISTS (SELECT 1 FROM orders o WHERE o.order_number = r.order_number)
+        ORDER BY r.reserved_at
+        LIMIT 1
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING order_number
+'''
+
+CLEANUP_STALE_RESERVATIONS = '''
+    DELETE FROM order_number_reservations
+    WHERE ctid IN (
+        SELECT ctid FROM order_number_reservations
+        WHERE consumed_at IS NULL
+          AND reserved_at < CURRENT_TIMESTAMP - make_interval(days => %s)
+        LIMIT %s
+    )
+'''
+
+
+def valid_direction(direction: str) -> bool:
+    return direction.isalpha() and len(direction) <= MAX_DIRECTION_LENGTH
+
+
+def allocate_order_number(cur: Any, direction: str, date_str: str) -> Tuple[str, str]:
+    '''
+    Атомарно выделяет следующий номер заказа для направления и даты.
+    Сначала повторно выдаётся резерв, не использованный за RESERVATION_TTL_MINUTES,
+    иначе счётчик увеличивается одним INSERT ... ON CONFLICT по первичному ключу,
+    поэтому два оператора одновременно не получат одинаковый номер. Совпадение с
+    номером, введённым вручную, отсекает уникальный индекс orders.order_number.
+    Returns: (порядковый номер '001', полный номер 'EU19102026-001')
+    '''
+    cur.execute(CLEANUP_STALE_RESERVATIONS, (RESERVATION_KEEP_DAYS, RESERVATION_CLEANUP_BATCH))
+
+    cur.execute(RECLAIM_RESERVATION, {'prefix': f'{direction}{date_str}-%', 'ttl': RESERVATION_TTL_MINUTES})
+    row = cur.fetchone()
+    if row:
+        order_number = row[0]
+        return order_number.rsplit('-', 1)[1], order_number
+
+    cur.execute('''
+        INSERT INTO order_number_sequences (direction, date_key, last_value)
+        VALUES (%s, %s, 1)
+        ON CONFLICT (direction, date_key) DO UPDATE
+        SET last_value = order_number_sequences.last_value + 1,
+            updated_at = CURRENT_TIMESTAMP
+        RETURNING last_value
+    ''', (direction, date_str))
+
+    next_number = str(cur.fetchone()[0]).zfill(3)
+    order_number = f'{direction}{date_str}-{next_number}'
+
+    cur.execute('''
+        INSERT INTO order_number_reservations (order_number)
+        VALUES (%s)
+        ON CONFLICT (order_number) DO NOTHING
+    ''', (order_number,))
+
+    return next_number, order_number
+
+
+def consume_order_number(cur: Any, order_number: Optional[str], order_id: int) -> None:
+    '''
+    Отмечает зарезервированный номер как использованный созданным заказом.
+    Номера, введённые вручную, резерва не имеют и просто пропускаются.
+    '''
+    if not order_number:
+        return
+
+    cur.execute('''
+        UPDATE order_number_reservations
+        SET consumed_at = CURRENT_TIMESTAMP, order_id = %s
+        WHERE order_number = %s AND consumed_at IS NULL
+    ''', (order_id, order_number))
+
+
+def is_duplicate_order_number(error: Any) -> bool:
+    '''
+    Нарушение уникальности именно номера заказа (а не другого индекса)
+    '''
+    return getattr(error.diag, 'constraint_name', None) == ORDER_NUMBER_CONSTRAINT
+
+
+def duplicate_number_response(order_number: Optional[str]) -> Dict[str, Any]:
+    return {
+        'statusCode': 409,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': dumps({'success': False, 'message': f'Заказ с номером {order_number} уже существует'}),
+        'isBase64Encoded': False
+    }
@@ -0,0 +1,127 @@
+from typing import Any, Dict, Iterable, List
+
+# Три независимых запроса по набору заказов (= ANY): этапы, таможенные пункты
+# и промежуточные точки этих этапов. Синхронный путь выполняет их подряд,
+# асинхронный (async_api.py) - одним конвейером (pipeline)
+STAGES_QUERY = '''
+    SELECT
+        s.id,
+        s.order_id,
+        s.stage_number,
+        s.from_location || ' → ' || s.to_location as stage_name,
+        s.from_location,
+        s.to_location,
+        s.vehicle_id,
+        s.driver_id,
+        s.notes,
+        s.status,
+        s.carrier,
+        s.phone,
+        s.border_crossing,
+        v.license_plate,
+        v.model as vehicle_model,
+        d.last_name || ' ' || d.first_name as driver_name,
+        d.phone as driver_phone,
+        d.additional_phone as driver_additional_phone,
+        s.planned_departure::date as planned_departure,
+        s.planned_arrival,
+        s.actual_departure,
+        s.actual_arrival,
+        s.version
+    FROM order_transport_stages s
+    LEFT JOIN vehicles v ON s.vehicle_id = v.id
+    LEFT JOIN drivers d ON s.driver_id = d.id
+    WHERE s.order_id = ANY(%s)
+    ORDER BY s.order_id, s.stage_number
+'''
+
+CUSTOMS_QUERY = '''
+    SELECT cp.id, cp.stage_id, cp.customs_name
+    FROM order_customs_points cp
+    WHERE cp.stage_id IN (SELECT id FROM order_transport_stages WHERE order_id = ANY(%s))
+    ORDER BY cp.stage_id, cp.id
+'''
+
+WAYPOINTS_QUERY = '''
+    SELECT w.id, w.stage_id, w.waypoint_order, w.customer_id, w.delivery_address_id, w.location,
+           w.waypoint_type, w.planned_time, w.actual_time, w.cargo_description, w.notes
+    FROM stage_waypoints w
+    WHERE w.stage_id IN (SELECT id FROM order_transport_stages WHERE order_id = ANY(%s))
+    ORDER BY w.stage_id, w.waypoint_order
+'''
+
+
+def group_order_stages(order_ids: List[int], stages: Iterable[Dict[str, Any]],
+                       customs: Iterable[Dict[str, Any]],
+                       waypoints: Iterable[Dict[str, Any]]) -> Dict[int, List[Dict[str, Any]]]:
+    '''
+    Собирает строки трёх запросов в этапы заказов через словари.
+    Returns: {order_id: [этапы в формате ответа resource=order_stages]}
+    '''
+    stages_by_order = {order_id: [] for order_id in order_ids}
+
+    customs_by_stage: Dict[int, List[Dict[str, Any]]] = {}
+    for customs_point in customs:
+        customs_by_stage.setdefault(customs_point['stage_id'], []).append(
+            {'id': customs_point['id'], 'customs_name': customs_point['customs_name']}
+        )
+
+    waypoints_by_stage: Dict[int, List[Dict[str, Any]]] = {}
+    for waypoint in waypoints:
+        waypoint = dict(waypoint)
+        waypoints_by_stage.setdefault(waypoint.pop('stage_id'), []).append(waypoint)
+
+    for stage in stages:
+        formatted_stage = {
+            'id': stage['id'],
+            'stage_number': stage['stage_number'],
+            'stage_name': f"Этап {stage['stage_number']}: {stage['stage_name']}",
+            'from_location': stage['from_location'],
+            'to_location': stage['to_location'],
+            'planned_departure': stage.get('planned_departure'),
+            'vehicle_id': stage['vehicle_id'],
+            'driver_id': stage['driver_id'],
+            'driver_phone': stage.get('driver_phone') or '',
+            'driver_additional_phone': stage.get('driver_additional_phone') or '',
+            'customs_points': customs_by_stage.get(stage['id'], []),
+            'waypoints': waypoints_by_stage.get(stage['id'], []),
+            'notes': stage.get('notes') or '',
+            'carrier': stage.get('carrier'),
+            'phone': stage.get('phone'),
+            'border_crossing': stage.get('border_crossing'),
+            'description': f"{stage['driver_name']} | {stage['license_plate']} {stage['vehicle_model']}" if stage.get('driver_name') else '',
+            'is_completed': stage['status'] == 'completed',
+            'completed_by': None,
+            'completed_at': stage.get('actual_arrival'),
+            'version': stage['version']
+        }
+
+        if stage.get('notes'):
+            formatted_stage['description'] += f"\n{stage['notes']}"
+
+        stages_by_order.setdefault(stage['order_id'], []).append(formatted_stage)
+
+    return stages_by_order
+
+
+def fetch_dicts(cur: Any, query: str, params: Any) -> List[Dict[str, Any]]:
+    cur.execute(query, params)
+    columns = [desc[0] for desc in cur.description]
+    return [dict(zip(columns, row)) for row in cur.fetchall()]
+
+
+def load_order_stages(cur: Any, order_ids: List[int]) -> Dict[int, List[Dict[str, Any]]]:
+    '''
+    Загружает этапы, таможенные пункты и промежуточные точки для набора заказов
+    тремя запросами (= ANY) и группирует их по заказу через словари.
+    Returns: {order_id: [этапы в формате ответа resource=order_stages]}
+    '''
+    if not order_ids:
+        return {}
+
+    return group_order_stages(
+        order_ids,
+        fetch_dicts(cur, STAGES_QUERY, (order_ids,)),
+        fetch_dicts(cur, CUSTOMS_QUERY, (order_ids,)),
+        fetch_dicts(cur, WAYPOINTS_QUERY, (order_ids,))
+    )
@@ -0,0 +1,106 @@
+import json
+from typing import Any, List
+
+from prepared import execute_prepared, register_statement
+
+# Пересчитывает строки order_summary одним запросом для набора заказов:
+# заказчики из customer_items, первый этап с автомобилем, водителем,
+# перевозчиком/телефоном/границей и количество этапов
+ORDER_SUMMARY_UPSERT = '''
+    INSERT INTO order_summary (
+        order_id, customer_display, route_from, route_to,
+        license_plate, vehicle_model, vehicle_id, driver_name, driver_id,
+        carrier, phone, border_crossing, stage_count, updated_at
+    )
+    SELECT
+        o.id,
+        COALESCE((
+            SELECT string_agg(
+                cu.nickname || CASE WHEN COALESCE(ci.item->>'note', '') <> ''
+                                    THEN ' (' || (ci.item->>'note') || ')'
+                                    ELSE '' END,
+                ', ' ORDER BY ci.ord)
+            FROM jsonb_array_elements(
+                CASE WHEN jsonb_typeof(o.customer_items) = 'array'
+                     THEN o.customer_items ELSE '[]'::jsonb END
+            ) WITH ORDINALITY AS ci(item, ord)
+            JOIN customers cu ON cu.id::text = ci.item->>'customer_id'
+        ), '—'),
+        fs.from_location, fs.to_location,
+        fs.license_plate, fs.vehicle_model, fs.vehicle_id, fs.driver_name, fs.driver_id,
+        fs.carrier, fs.phone, fs.border_crossing,
+        (SELECT COUNT(*) FROM order_transport_stages sc WHERE sc.order_id = o.id),
+        CURRENT_TIMESTAMP
+    FROM orders o
+    LEFT JOIN LATERAL (
+        SELECT s.from_location, s.to_location,
+               s.carrier, s.phone, s.border_crossing,
+               v.license_plate, v.model AS vehicle_model, v.id AS vehicle_id,
+               d.full_name AS driver_name, d.id AS driver_id
+        FROM order_transport_stages s
+        LEFT JOIN vehicles v ON s.vehicle_id = v.id
+        LEFT JOIN drivers d ON s.driver_id = d.id
+        WHERE s.order_id = o.id
+        ORDER BY s.stage_number
+        LIMIT 1
+    ) fs ON true
+    WHERE o.id = ANY(%s)
+    ON CONFLICT (order_id) DO UPDATE SET
+        customer_display = EXCLUDED.customer_display,
+        route_from = EXCLUDED.route_from,
+        route_to = EXCLUDED.route_to,
+        license_plate = EXCLUDED.license_plate,
+        vehicle_model = EXCLUDED.vehicle_model,
+        vehicle_id = EXCLUDED.vehicle_id,
+        driver_name = EXCLUDED.driver_name,
+        driver_id = EXCLUDED.driver_id,
+        carrier = EXCLUDED.carrier,
+        phone = EXCLUDED.phone,
+        border_crossing = EXCLUDED.border_crossing,
+        stage_count = EXCLUDED.stage_count,
+        updated_at = EXCLUDED.updated_at
+'''
+
+register_statement('order_summary_refresh', ORDER_SUMMARY_UPSERT)
+
+
+def refresh_order_summary(cur: Any, order_ids: List[int]) -> None:
+    '''
+    Обновляет read-модель списка заказов для переданных заказов.
+    Вызывается в той же транзакции, что и запись заказа или этапов.
+    '''
+    order_ids = [int(order_id) for order_id in order_ids if order_id]
+    if not order_ids:
+        return
+    execute_prepared(cur, 'order_summary_refresh', (order_ids,))
+
+
+def refresh_order_summary_for_driver(cur: Any, driver_id: int) -> None:
+    '''
+    Пересчитывает заказы, в первом этапе которых указан водитель (после переименования)
+    '''
+    cur.execute('SELECT order_id FROM order_summary WHERE driver_id = %s', (driver_id,))
+    refresh_order_summary(cur, [row[0] for row in cur.fetchall()])
+
+
+def refresh_order_summary_for_vehicle(cur: Any, vehicle_id: int) -> None:
+    '''
+    Пересчитывает заказы, в первом этапе которых указан автомобиль
+    '''
+    cur.execute('SELECT order_id FROM order_summary WHERE vehicle_id = %s', (vehicle_id,))
+    refresh_order_summary(cur, [row[0] for row in cur.fetchall()])
+
+
+def refresh_order_summary_for_customer(cur: Any, customer_id: int) -> None:
+    '''
+    Пересчитывает заказы, где заказчик есть в customer_items.
+    customer_id в JSON встречается и числом, и строкой.
+    '''
+    cur.execute('''
+        SELECT id FROM orders
+        WHERE customer_items @> %s::jsonb OR customer_items @> %s::jsonb
+    ''', (
+        json.dumps([{'customer_id': int(customer_id)}]),
+        json.dumps([{'customer_id': str(customer_id)}])
+    ))
+    refresh_order_summary(cur, [row[0] for row in cur.fetchall()])
@@ -0,0 +1,65 @@
+import os
+import weakref
+from typing import Any, Dict, Sequence, Set, Tuple
+
+# Включается только при пуле соединений (server/wsgi.py): облачная функция открывает
+# соединение на запрос, и PREPARE там лишь добавляет круг до базы без повторного использования
+PREPARED_ENABLED = os.environ.get('PREPARED_STATEMENTS', '0') == '1'
+
+# name -> (SQL с %s для обычного выполнения, SQL с $n для PREPARE)
+_registry: Dict[str, Tuple[str, str]] = {}
+
+# соединение -> (pid бэкенда, имена подготовленных на нём запросов)
+_prepared: 'weakref.WeakKeyDictionary[Any, Tuple[int, Set[str]]]' = weakref.WeakKeyDictionary()
+
+
+def register_statement(name: str, sql: str) -> None:
+    '''
+    Регистрирует именованный запрос; плейсхолдеры %s по порядку становятся $1, $2, ...
+    '''
+    parts = sql.split('%s')
+    numbered = parts[0] + ''.join(f'${index}{part}' for index, part in enumerate(parts[1:], 1))
+    _registry[name] = (sql, numbered)
+
+
+def execute_prepared(cur: Any, name: str, params: Sequence[Any]) -> None:
+    '''
+    Выполняет зарегистрированный запрос через EXECUTE. PREPARE делается лениво,
+    один раз на соединение; после переподключения (новый pid бэкенда) -
+    заново. Без PREPARED_STATEMENTS=1 (облачная функция без пула, pgbouncer
+    в режиме transaction) выполняется обычный запрос.
+    '''
+    sql, numbered = _registry[name]
+    if not PREPARED_ENABLED:
+        cur.execute(sql, params)
+        return
+
+    conn = cur.connection
+    backend_pid = conn.get_backend_pid()
+    pid, names = _prepared.get(conn, (None, None))
+    if pid != backend_pid:
+        names = set()
+        _prepared[conn] = (backend_pid, names)
+
+    if name not in names:
+        cur.execute(f'PREPARE {name} AS {numbered}')
+        names.add(name)
+
+    placeholders = ', '.join(['%s'] * len(params))
+    cur.execute(f'EXECUTE {name} ({placeholders})' if params else f'EXECUTE {name}', params)
+
+
+register_statement('activity_log_insert', '''
+    INSERT INTO activity_log (order_id, user_role, user_name, action_type, description)
+    VALUES (%s, %s, %s, %s, %s)
+''')
+register_statement('vehicle_plate_by_id', 'SELECT license_plate FROM vehicles WHERE id = %s')
+register_statement('driver_name_by_id', 'SELECT last_name, first_name FROM drivers WHERE id = %s')
+register_statement('customer_nickname_by_id', 'SELECT nickname FROM customers WHERE id = %s')
+register_statement('client_name_by_id', 'SELECT name FROM clients WHERE id = %s')
+register_statement('stage_waypoint_insert', '''
+    INSERT INTO stage_waypoints (
+        stage_id, waypoint_order, customer_id, delivery_address_id, location, waypoint_type,
+        planned_time, cargo_description, notes
+    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+''')
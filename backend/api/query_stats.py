@@ -0,0 +1,133 @@
+import json
+import os
+import random
+import re
+import time
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+import psycopg2.extensions
+
+SAMPLE_RATE = float(os.environ.get('QUERY_STATS_SAMPLE_RATE', '0.1'))
+N_PLUS_ONE_THRESHOLD = int(os.environ.get('QUERY_STATS_N_PLUS_ONE', '5'))
+SERVER_TIMING = os.environ.get('QUERY_STATS_SERVER_TIMING', '') == '1'
+
+_current: ContextVar[Optional['QueryStats']] = ContextVar('query_stats', default=None)
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_statement(query: Any) -> str:
+    '''
+    Форма запроса: без лишних пробелов, литералы заменены на ?
+    '''
+    if isinstance(query, bytes):
+        query = query.decode('utf-8', 'replace')
+    query = str(query)
+    return _WHITESPACE.sub(' ', _LITERALS.sub('?', query)).strip()
+
+
+class QueryStats:
+    '''
+    Статистика SQL-запросов одного HTTP-запроса
+    '''
+
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.statements: List[Dict[str, Any]] = []
+
+    def record(self, query: Any, duration: float, rowcount: int) -> None:
+        self.statements.append({
+            'statement': normalize_statement(query),
+            'duration_ms': duration * 1000,
+            'rows': rowcount
+        })
+
+    def summary(self) -> Dict[str, Any]:
+        shapes: Dict[str, int] = {}
+        for statement in self.statements:
+            shapes[statement['statement']] = shapes.get(statement['statement'], 0) + 1
+        suspected = [
+            {'statement': shape[:300], 'count': count}
+            for shape, count in shapes.items() if count >= N_PLUS_ONE_THRESHOLD
+        ]
+        return {
+            'queries': len(self.statements),
+            'db_ms': round(sum(s['duration_ms'] for s in self.statements), 2),
+            'total_ms': round((time.perf_counter() - self.started) * 1000, 2),
+            'rows': sum(max(s['rows'], 0) for s in self.statements),
+            'n_plus_one': sorted(suspected, key=lambda item: -item['count'])
+        }
+
+
+class InstrumentedCursor(psycopg2.extensions.cursor):
+    '''
+    Курсор, записывающий текст, длительность и число строк каждого запроса
+    в статистику текущего HTTP-запроса
+    '''
+
+    def execute(self, query, vars=None):
+        stats = _current.get()
+        if stats is None:
+            return super().execute(query, vars)
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            stats.record(query, time.perf_counter() - started, self.rowcount)
+
+
+def start_request() -> Optional[QueryStats]:
+    '''
+    Включает сбор статистики для запроса с вероятностью QUERY_STATS_SAMPLE_RATE
+    '''
+    stats = QueryStats() if SAMPLE_RATE > 0 and random.random() < SAMPLE_RATE else None
+    _current.set(stats)
+    return stats
+
+
+def current_stats() -> Optional[QueryStats]:
+    '''
+    Статистика текущего запроса - для запросов не через InstrumentedCursor (psycopg 3)
+    '''
+    return _current.get()
+
+
+def finish_request(stats: Optional[QueryStats], event: Dict[str, Any], response: Dict[str, Any]) -> Dict[str, Any]:
+    '''
+    Пишет сводку в лог одной JSON-строкой и при QUERY_STATS_SERVER_TIMING=1
+    добавляет заголовок Server-Timing
+    '''
+    _current.set(None)
+    if stats is None:
+        return response
+
+    summary = stats.summary()
+    query_params = event.get('queryStringParameters') or {}
+    action = None
+    if event.get('body'):
+        try:
+            action = json.loads(event['body']).get('action')
+        except (ValueError, AttributeError):
+            action = None
+
+    print(json.dumps({
+        'event': 'request_queries',
+        'method': event.get('httpMethod'),
+        'resource': query_params.get('resource'),
+        'action': action,
+        'status': response.get('statusCode'),
+        **summary
+    }, ensure_ascii=False))
+
+    if not SERVER_TIMING:
+        return response
+
+    headers = dict(response.get('headers') or {})
+    headers['Server-Timing'] = (
+        f'db;dur={summary["db_ms"]};desc="{summary["queries"]} queries", '
+        f'total;dur={summary["total_ms"]}'
+    )
+    headers['Timing-Allow-Origin'] = '*'
+    return {**response, 'headers': headers}
@@ -0,0 +1,141 @@
+import os
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import psycopg2
+
+READ_URL = os.environ.get('DATABASE_READ_URL')
+# Сколько секунд после записи с токеном-временем читать с основной базы
+REPLICA_PIN_SECONDS = float(os.environ.get('REPLICA_PIN_SECONDS', '5'))
+
+READ_TOKEN_HEADER = 'X-Read-After'
+READ_SOURCE_HEADER = 'X-Read-Source'
+
+# GET-ресурсы, которые только читают; остальные (last_order_number,
+# active_sessions, telegram_settings) пишут или должны видеть свежие данные
+REPLICA_RESOURCES = {
+    'orders', 'drivers', 'vehicles', 'clients', 'customers', 'customer_addresses',
+    'order_stages', 'stats', 'activity_log', 'users', 'roles', 'contract_applications',
+    'export', 'search', 'availability', 'utilization'
+}
+
+WRITE_METHODS = ('POST', 'PUT', 'DELETE')
+
+
+def read_token(event: Dict[str, Any]) -> Optional[Tuple[str, Any]]:
+    '''
+    Токен последней записи клиента из заголовка X-Read-After:
+    lsn:<pg_lsn> (выдаёт сервер после записи) или ts:<unix time>.
+    Returns: ('lsn', '0/16B3748'), ('ts', 1700000000.0) или None
+    '''
+    headers = event.get('headers') or {}
+    value = next((value for name, value in headers.items() if name.lower() == READ_TOKEN_HEADER.lower()), None)
+    if not value:
+        return None
+    kind, _, raw = value.strip().partition(':')
+    if kind == 'lsn' and raw:
+        return ('lsn', raw)
+    if kind == 'ts':
+        try:
+            return ('ts', float(raw))
+        except ValueError:
+            return None
+    return None
+
+
+CAUGHT_UP_QUERY = 'SELECT pg_is_in_recovery(), pg_last_wal_replay_lsn() >= %s::pg_lsn'
+
+
+def replica_caught_up(conn: Any, lsn: str) -> bool:
+    '''
+    Проиграла ли реплика WAL до lsn. На основной базе (не в recovery) - всегда да
+    '''
+    cur = conn.cursor()
+    try:
+        cur.execute(CAUGHT_UP_QUERY, (lsn,))
+        in_recovery, reached = cur.fetchone()
+    except psycopg2.DataError:
+        conn.rollback()
+        return False
+    finally:
+        cur.close()
+    conn.rollback()
+    return not in_recovery or bool(reached)
+
+
+def replica_eligible(event: Dict[str, Any]) -> Tuple[bool, Optional[str]]:
+    '''
+    Можно ли прочитать запрос с реплики: читающий GET без свежего токена-времени.
+    Returns: (можно ли, LSN, до которого реплика должна дойти, или None)
+    '''
+    resource = (event.get('queryStringParameters') or {}).get('resource', 'orders')
+    if event.get('httpMethod', 'GET') != 'GET' or resource not in REPLICA_RESOURCES:
+        return False, None
+    token = read_token(event)
+    if token and token[0] == 'ts' and time.time() - token[1] < REPLICA_PIN_SECONDS:
+        return False, None
+    return True, token[1] if token and token[0] == 'lsn' else None
+
+
+def choose_connect(event: Dict[str, Any], connect_primary: Callable[[], Any],
+                   connect_replica: Optional[Callable[[], Any]]) -> Tuple[Callable[[], Any], Dict[str, Any]]:
+    '''
+    Выбирает базу для запроса. Читающие GET идут на реплику, если она настроена
+    и уже видит последнюю запись клиента; записи, остальные GET, отставшая или
+    недоступная реплика - на основную базу. Решение принимается лениво, при
+    первом обращении к соединению. Returns: (connect, route), route['source']
+    после подключения - 'primary' или 'replica'
+    '''
+    route: Dict[str, Any] = {'source': 'primary', 'token': None}
+    eligible, lsn = replica_eligible(event) if connect_replica is not None else (False, None)
+    if not eligible:
+        return connect_primary, route
+
+    def connect() -> Any:
+        try:
+            conn = connect_replica()
+        except psycopg2.OperationalError:
+            return connect_primary()
+        if lsn and not replica_caught_up(conn, lsn):
+            conn.close()
+            return connect_primary()
+        route['source'] = 'replica'
+        return conn
+
+    return connect, route
+
+
+def track_write_token(event: Dict[str, Any], uow: Any, route: Dict[str, Any]) -> None:
+    '''
+    Для записей при настроенной реплике запоминает LSN основной базы после коммита -
+    клиент возвращает его в X-Read-After, и его чтения не уходят на отставшую реплику
+    '''
+    if not READ_URL or event.get('httpMethod') not in WRITE_METHODS:
+        return
+
+    def remember_lsn(conn: Any) -> None:
+        cur = conn.cursor()
+        try:
+            cur.execute('SELECT pg_current_wal_lsn()')
+            route['token'] = f'lsn:{cur.fetchone()[0]}'
+        except psycopg2.Error:
+            route['token'] = f'ts:{time.time():.3f}'
+        finally:
+            cur.close()
+
+    uow.on_commit(remember_lsn)
+
+
+def add_route_headers(event: Dict[str, Any], response: Dict[str, Any], route: Dict[str, Any]) -> Dict[str, Any]:
+    '''
+    X-Read-After с токеном записи и X-Read-Source у читающих запросов
+    '''
+    if not READ_URL:
+        return response
+    headers = dict(response.get('headers') or {})
+    if route.get('token'):
+        headers[READ_TOKEN_HEADER] = route['token']
+    if event.get('httpMethod', 'GET') == 'GET':
+        headers[READ_SOURCE_HEADER] = route['source']
+    headers['Access-Control-Expose-Headers'] = f'{READ_TOKEN_HEADER}, {READ_SOURCE_HEADER}'
+    return {**response, 'headers': headers}
@@ -1,4 +1,80 @@
+import base64
+import gzip
 import json
+from datetime import date, datetime
+from decimal import Decimal
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+DATE_FORMAT = '%Y-%m-%d'
+DATETIME_FORMAT = '%d.%m.%Y %H:%M'
+COMPRESSION_MIN_BYTES = 1024
+
+
+def encode_value(value):
+    '''
+    Типизированное кодирование значений из строк БД:
+    date -> 2026-10-19, datetime -> 19.10.2026 14:30, Decimal -> число
+    '''
+    if isinstance(value, datetime):
+        return value.strftime(DATETIME_FORMAT)
+    if isinstance(value, date):
+        return value.strftime(DATE_FORMAT)
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+def dumps(data) -> str:
+    '''
+    Сериализация тела ответа; использует orjson, если он установлен
+    '''
+    if orjson is not None:
+        return orjson.dumps(
+            data,
+            default=encode_value,
+            option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+        ).decode('utf-8')
+    return json.dumps(data, default=encode_value)
+
+
+def fetch_rows(cur, query_params, dictionary_columns=()):
+    '''
+    Строки результата запроса в формате, запрошенном клиентом:
+    по умолчанию - список словарей; format=columnar - заголовок с именами колонок
+    и массивы значений, повторяющиеся строки из dictionary_columns кодируются
+    индексами в словаре значений
+    '''
+    columns = [desc[0] for desc in cur.description]
+    rows = cur.fetchall()
+
+    if (query_params or {}).get('format') != 'columnar':
+        return [dict(zip(columns, row)) for row in rows]
+
+    encoded = {columns.index(name): {} for name in dictionary_columns if name in columns}
+    if encoded:
+        rows = [list(row) for row in rows]
+        for row in rows:
+            for index, values in encoded.items():
+                value = row[index]
+                if value is not None:
+                    row[index] = values.setdefault(value, len(values))
+
+    return {
+        'format': 'columnar',
+        'columns': columns,
+        'rows': rows,
+        'dictionaries': {columns[index]: list(values) for index, values in encoded.items()}
+    }
+
 
 def cors_headers():
     return {
@@ -12,7 +88,7 @@ def options_response():
         'headers': {
             'Access-Control-Allow-Origin': '*',
             'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
-            'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
+            'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, Idempotency-Key, X-Read-After',
             'Access-Control-Max-Age': '86400'
         },
         'body': '',
@@ -23,7 +99,7 @@ def success_response(data):
     return {
         'statusCode': 200,
         'headers': cors_headers(),
-        'body': json.dumps(data),
+        'body': dumps(data),
         'isBase64Encoded': False
     }
 
@@ -31,6 +107,51 @@ def error_response(status_code, message):
     return {
         'statusCode': status_code,
         'headers': cors_headers(),
-        'body': json.dumps({'error': message}),
+        'body': dumps({'error': message}),
         'isBase64Encoded': False
     }
+
+
+def accepted_encodings(event):
+    '''
+    Кодировки из заголовка Accept-Encoding (без учёта регистра), q=0 исключаются
+    '''
+    headers = event.get('headers') or {}
+    header = next((value for name, value in headers.items() if name.lower() == 'accept-encoding'), '') or ''
+    encodings = set()
+    for part in header.split(','):
+        name, _, params = part.strip().partition(';')
+        if params.strip().replace(' ', '') in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            continue
+        if name:
+            encodings.add(name.strip().lower())
+    return encodings
+
+
+def compress_response(event, response):
+    '''
+    Сжимает тело ответа brotli или gzip по Accept-Encoding клиента.
+    Небольшие и уже закодированные ответы возвращаются без изменений.
+    '''
+    body = response.get('body')
+    if response.get('isBase64Encoded') or not isinstance(body, str) or len(body) < COMPRESSION_MIN_BYTES:
+        return response
+
+    encodings = accepted_encodings(event)
+    raw = body.encode('utf-8')
+    if brotli is not None and 'br' in encodings:
+        encoding, compressed = 'br', brotli.compress(raw, quality=5)
+    elif 'gzip' in encodings or '*' in encodings:
+        encoding, compressed = 'gzip', gzip.compress(raw, compresslevel=6)
+    else:
+        return response
+
+    headers = dict(response.get('headers') or {})
+    headers['Content-Encoding'] = encoding
+    headers['Vary'] = 'Accept-Encoding'
+    return {
+        **response,
+        'headers': headers,
+        'body': base64.b64encode(compressed).decode('ascii'),
+        'isBase64Encoded': True
+    }
@@ -0,0 +1,144 @@
+import re
+from typing import Any, Dict, List, Optional
+
+# Каждый тип ищется по tsvector (GIN) и по подстроке через pg_trgm (GIN),
+# ранг - лучшее из ts_rank и similarity по ключевым полям
+SEARCH_QUERIES = {
+    'order': '''
+        SELECT 'order' AS type, o.id, o.id AS order_id,
+               o.order_number AS title,
+               concat_ws(' · ', o.invoice, o.track_number) AS subtitle,
+               GREATEST(
+                   ts_rank(o.search_vector, to_tsquery('simple', %(tsquery)s)),
+                   similarity(coalesce(o.order_number, ''), %(q)s),
+                   similarity(coalesce(o.invoice, ''), %(q)s),
+                   similarity(coalesce(o.track_number, ''), %(q)s)
+               ) AS rank
+        FROM orders o
+        WHERE o.deleted_at IS NULL
+          AND (o.search_vector @@ to_tsquery('simple', %(tsquery)s)
+               OR o.order_number ILIKE %(pattern)s
+               OR o.invoice ILIKE %(pattern)s
+               OR o.track_number ILIKE %(pattern)s)
+        ORDER BY rank DESC
+        LIMIT %(window)s
+    ''',
+    'stage': '''
+        SELECT 'stage' AS type, s.id, s.order_id,
+               o.order_number AS title,
+               s.from_location || ' → ' || s.to_location AS subtitle,
+               GREATEST(
+                   ts_rank(s.search_vector, to_tsquery('simple', %(tsquery)s)),
+                   similarity(coalesce(s.from_location, ''), %(q)s),
+                   similarity(coalesce(s.to_location, ''), %(q)s)
+               ) AS rank
+        FROM order_transport_stages s
+        JOIN orders o ON o.id = s.order_id
+        WHERE o.deleted_at IS NULL
+          AND (s.search_vector @@ to_tsquery('simple', %(tsquery)s)
+               OR s.from_location ILIKE %(pattern)s
+               OR s.to_location ILIKE %(pattern)s)
+        ORDER BY rank DESC
+        LIMIT %(window)s
+    ''',
+    'customer': '''
+        SELECT 'customer' AS type, c.id, NULL::INTEGER AS order_id,
+               coalesce(c.nickname, c.company_name) AS title,
+               concat_ws(' · ', c.company_name, c.inn) AS subtitle,
+               GREATEST(
+                   ts_rank(c.search_vector, to_tsquery('simple', %(tsquery)s)),
+                   similarity(coalesce(c.nickname, ''), %(q)s),
+                   similarity(coalesce(c.company_name, ''), %(q)s),
+                   similarity(coalesce(c.inn, ''), %(q)s)
+               ) AS rank
+        FROM customers c
+        WHERE c.search_vector @@ to_tsquery('simple', %(tsquery)s)
+           OR c.nickname ILIKE %(pattern)s
+           OR c.company_name ILIKE %(pattern)s
+           OR c.inn ILIKE %(pattern)s
+        ORDER BY rank DESC
+        LIMIT %(window)s
+    ''',
+    'driver': '''
+        SELECT 'driver' AS type, d.id, NULL::INTEGER AS order_id,
+               d.full_name AS title,
+               concat_ws(' · ', d.phone, d.additional_phone) AS subtitle,
+               GREATEST(
+                   ts_rank(d.search_vector, to_tsquery('simple', %(tsquery)s)),
+                   similarity(coalesce(d.full_name, ''), %(q)s),
+                   similarity(coalesce(d.phone, ''), %(q)s)
+               ) AS rank
+        FROM drivers d
+        WHERE d.search_vector @@ to_tsquery('simple', %(tsquery)s)
+           OR d.full_name ILIKE %(pattern)s
+           OR d.phone ILIKE %(pattern)s
+           OR d.additional_phone ILIKE %(pattern)s
+        ORDER BY rank DESC
+        LIMIT %(window)s
+    ''',
+    'vehicle': '''
+        SELECT 'vehicle' AS type, v.id, NULL::INTEGER AS order_id,
+               v.license_plate AS title,
+               concat_ws(' · ', v.vehicle_brand, v.trailer_plate) AS subtitle,
+               GREATEST(
+                   ts_rank(v.search_vector, to_tsquery('simple', %(tsquery)s)),
+                   similarity(coalesce(v.license_plate, ''), %(q)s),
+                   similarity(coalesce(v.trailer_plate, ''), %(q)s)
+               ) AS rank
+        FROM vehicles v
+        WHERE v.search_vector @@ to_tsquery('simple', %(tsquery)s)
+           OR v.license_plate ILIKE %(pattern)s
+           OR v.trailer_plate ILIKE %(pattern)s
+        ORDER BY rank DESC
+        LIMIT %(window)s
+    '''
+}
+
+
+def build_tsquery(q: str) -> Optional[str]:
+    '''
+    Превращает пользовательский ввод в префиксный tsquery: "ев 123" -> "ев:* & 123:*"
+    '''
+    tokens = re.findall(r'\w+', q.lower())
+    if not tokens:
+        return None
+    return ' & '.join(f'{token}:*' for token in tokens)
+
+
+def search_entities(cur: Any, q: str, types: List[str], limit: int, offset: int) -> Dict[str, Any]:
+    '''
+    Ранжированный поиск по выбранным типам с пагинацией.
+    Каждый подзапрос ограничен окном offset + limit + 1, поэтому
+    объединение не зависит от общего размера таблиц.
+    '''
+    tsquery = build_tsquery(q)
+    if not tsquery:
+        return {'results': [], 'has_more': False}
+
+    escaped = q.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    params = {
+        'q': q,
+        'tsquery': tsquery,
+        'pattern': f'%{escaped}%',
+        'window': offset + limit + 1,
+        'limit': limit + 1,
+        'offset': offset
+    }
+
+    parts = [f'({SEARCH_QUERIES[t]})' for t in types if t in SEARCH_QUERIES]
+    if not parts:
+        return {'results': [], 'has_more': False}
+
+    cur.execute(f'''
+        SELECT type, id, order_id, title, subtitle, rank
+        FROM ({' UNION ALL '.join(parts)}) found
+        ORDER BY rank DESC, type, id
+        LIMIT %(limit)s OFFSET %(offset)s
+    ''', params)
+
+    columns = [desc[0] for desc in cur.description]
+    results = [dict(zip(columns, row)) for row in cur.fetchall()]
+    for result in results:
+        result['rank'] = round(float(result['rank']), 4)
+
+    return {'results': results[:limit], 'has_more': len(results) > limit}
@@ -0,0 +1,100 @@
+import os
+import threading
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+from db_schema import current_schema
+from response_utils import accepted_encodings
+
+SINGLE_FLIGHT = os.environ.get('SINGLE_FLIGHT', '1') != '0'
+
+# Читающие GET, одинаковые запросы которых можно обслужить одним выполнением
+COALESCED_RESOURCES = {
+    'orders', 'stats', 'customers', 'drivers', 'vehicles', 'clients', 'activity_log',
+    'users', 'roles', 'order_stages', 'search', 'availability', 'utilization', 'contract_applications'
+}
+
+
+class Flight:
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.response: Optional[Dict[str, Any]] = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    '''
+    Одновременные запросы с одинаковым ключом ждут выполнения первого (ведущего)
+    и получают его ответ - один запрос к базе и одно сериализованное тело на всех.
+    Ответ не кэшируется: следующий запрос после завершения выполняется заново.
+    '''
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._flights: Dict[Hashable, Flight] = {}
+        self.executions = 0
+        self.coalesced = 0
+
+    def do(self, key: Hashable, work: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = Flight()
+                self._flights[key] = flight
+                self.executions += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            headers = {**(flight.response.get('headers') or {}), 'X-Single-Flight': 'coalesced'}
+            return {**flight.response, 'headers': headers}
+
+        try:
+            flight.response = work()
+            return flight.response
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+
+    def counters(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'executions': self.executions,
+                'coalesced': self.coalesced,
+                'in_flight': len(self._flights)
+            }
+
+
+flights = SingleFlight()
+
+
+def flight_key(event: Dict[str, Any]) -> Optional[Tuple[Any, ...]]:
+    '''
+    Ключ запроса: схема филиала, resource, отсортированные параметры, токен
+    X-Read-After (read-your-writes) и принимаемые кодировки (тело ответа уже сжато).
+    None - запрос не объединяется
+    '''
+    if event.get('httpMethod', 'GET') != 'GET':
+        return None
+    query_params = event.get('queryStringParameters') or {}
+    resource = query_params.get('resource', 'orders')
+    if resource not in COALESCED_RESOURCES:
+        return None
+    headers = event.get('headers') or {}
+    token = next((value for name, value in headers.items() if name.lower() == 'x-read-after'), None)
+    params = tuple(sorted((name, str(value).strip()) for name, value in query_params.items() if name != 'resource'))
+    return (current_schema(), resource, params, token, tuple(sorted(accepted_encodings(event))))
+
+
+def coalesce(event: Dict[str, Any], work: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+    key = flight_key(event) if SINGLE_FLIGHT else None
+    if key is None:
+        return work()
+    return flights.do(key, work)
@@ -0,0 +1,96 @@
+import os
+from typing import Any, Optional
+
+from asset_usage import refresh_asset_usage, usage_spans
+
+# Через сколько дней после мягкого удаления заказ удаляется физически и сколько заказов за транзакцию
+PURGE_AFTER_DAYS = int(os.environ.get('ORDER_PURGE_AFTER_DAYS', '30'))
+PURGE_BATCH_SIZE = int(os.environ.get('ORDER_PURGE_BATCH_SIZE', '200'))
+
+STAGE_ASSET_COLUMNS = ('vehicle_id', 'driver_id')
+
+# Этапы, точки маршрута, таможня, документы, журнал и order_summary
+# удаляются каскадом по внешним ключам (V0009)
+PURGE_BATCH = '''
+    DELETE FROM orders
+    WHERE id IN (
+        SELECT id FROM orders
+        WHERE deleted_at < CURRENT_TIMESTAMP - make_interval(days => %(after_days)s)
+        ORDER BY deleted_at
+        LIMIT %(batch_size)s
+        FOR UPDATE SKIP LOCKED
+    )
+'''
+
+
+def soft_delete_order(cur: Any, order_id: int) -> Optional[str]:
+    '''
+    Помечает заказ удалённым одним UPDATE; списки, поиск, экспорт и проверки
+    занятости его больше не видят. Загрузка автомобилей и водителей заказа
+    пересчитывается сразу. Returns: номер заказа или None, если заказа нет
+    '''
+    cur.execute('''
+        UPDATE orders SET deleted_at = CURRENT_TIMESTAMP
+        WHERE id = %s AND deleted_at IS NULL
+        RETURNING order_number
+    ''', (order_id,))
+    row = cur.fetchone()
+    if not row:
+        return None
+
+    refresh_asset_usage(cur, usage_spans(cur, order_ids=[order_id]))
+    return row[0]
+
+
+def detach_deleted_orders(cur: Any, column: str, asset_id: int) -> None:
+    '''
+    Снимает ссылки мягко удалённых заказов и их этапов на удаляемого водителя,
+    автомобиль или перевозчика (column - driver_id, vehicle_id или client_id).
+    Удалённые заказы не блокируют удаление справочника, а внешние ключи не
+    мешают ему до физической очистки
+    '''
+    cur.execute(f'UPDATE orders SET {column} = NULL WHERE {column} = %s AND deleted_at IS NOT NULL', (asset_id,))
+    if column in STAGE_ASSET_COLUMNS:
+        cur.execute(f'''
+            UPDATE order_transport_stages s SET {column} = NULL
+            FROM orders o
+            WHERE o.id = s.order_id AND o.deleted_at IS NOT NULL AND s.{column} = %s
+        ''', (asset_id,))
+
+
+def purge_deleted_orders(conn: Any, after_days: Optional[int] = None, batch_size: Optional[int] = None,
+                         max_batches: Optional[int] = None) -> int:
+    '''
+    Физически удаляет заказы, помеченные удалёнными больше after_days дней назад.
+    Каждая пачка - отдельная короткая транзакция; SKIP LOCKED не даёт двум
+    запущенным очисткам ждать друг друга. Returns: число удалённых заказов
+    '''
+    after_days = PURGE_AFTER_DAYS if after_days is None else after_days
+    batch_size = batch_size or PURGE_BATCH_SIZE
+    purged = 0
+    batches = 0
+    cur = conn.cursor()
+    try:
+        while max_batches is None or batches < max_batches:
+            cur.execute(PURGE_BATCH, {'after_days': after_days, 'batch_size': batch_size})
+            deleted = cur.rowcount
+            conn.commit()
+            purged += deleted
+            batches += 1
+            if deleted < batch_size:
+                break
+    finally:
+        cur.close()
+    return purged
+
+
+if __name__ == '__main__':
+    # Очистка только по расписанию, не через API: python backend/api/soft_delete.py
+    import psycopg2
+    from db_schema import bind_schema
+
+    connection = bind_schema(psycopg2.connect(os.environ['DATABASE_URL']))
+    try:
+        print(f'purged orders: {purge_deleted_orders(connection)}')
+    finally:
+        connection.close()
@@ -0,0 +1,22 @@
+from typing import Any, Dict, Optional
+
+NOTE_MARKERS = {
+    'carrier': 'Перевозчик:',
+    'phone': 'Тел:',
+    'border_crossing': 'Граница:'
+}
+
+
+def stage_carrier_fields(stage: Dict[str, Any]) -> Dict[str, Optional[str]]:
+    '''
+    Перевозчик, телефон и граница этапа: из явных полей запроса,
+    а для старых клиентов - разбором примечания один раз при записи
+    '''
+    notes = stage.get('notes') or ''
+    fields = {}
+    for field, marker in NOTE_MARKERS.items():
+        value = stage.get(field)
+        if not value and marker in notes:
+            value = notes.split(marker)[1].split(',')[0].strip()
+        fields[field] = value or None
+    return fields
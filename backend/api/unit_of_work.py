@@ -0,0 +1,112 @@
+import os
+import random
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import psycopg2.errors
+
+RETRY_ATTEMPTS = int(os.environ.get('DB_RETRY_ATTEMPTS', '3'))
+RETRY_BASE_DELAY = float(os.environ.get('DB_RETRY_BASE_DELAY', '0.05'))
+
+# Ошибки, после которых запрос можно безопасно повторить целиком
+RETRYABLE_ERRORS = (psycopg2.errors.SerializationFailure, psycopg2.errors.DeadlockDetected)
+
+
+class UnitOfWork:
+    '''
+    Соединение и транзакция одного HTTP-запроса. Соединение открывается при первом
+    обращении и отдаётся в release(): коммит, если ответ успешный, иначе откат.
+    Сетевые побочные эффекты (Telegram и т.п.) регистрируются через after_release
+    и выполняются только после того, как соединение отпущено.
+    Обработчики не коммитят сами: иначе откат и повтор после сбоя сериализации
+    затронули бы только часть работы. Явный release(commit=True) - только перед
+    исходящим запросом, когда база больше не нужна.
+    '''
+
+    def __init__(self, connect: Callable[[], Any]) -> None:
+        self._connect = connect
+        self._conn = None
+        self._cursor = None
+        self._released = False
+        self._after_release: List[Tuple[Callable[..., Any], Tuple[Any, ...]]] = []
+        self._on_commit: List[Callable[[Any], Any]] = []
+
+    @property
+    def connection(self) -> Any:
+        if self._released:
+            raise RuntimeError('connection already released')
+        if self._conn is None:
+            self._conn = self._connect()
+        return self._conn
+
+    @property
+    def released(self) -> bool:
+        return self._released
+
+    @property
+    def cursor(self) -> Any:
+        if self._cursor is None:
+            self._cursor = self.connection.cursor()
+        return self._cursor
+
+    def after_release(self, callback: Callable[..., Any], *args: Any) -> None:
+        self._after_release.append((callback, args))
+
+    def on_commit(self, callback: Callable[[Any], Any]) -> None:
+        '''
+        callback(connection) вызывается сразу после успешного коммита, до закрытия соединения
+        '''
+        self._on_commit.append(callback)
+
+    def release(self, commit: bool = True) -> None:
+        '''
+        Завершает транзакцию и закрывает соединение. Повторный вызов ничего не делает.
+        '''
+        if self._released:
+            return
+        self._released = True
+        conn, self._conn, self._cursor = self._conn, None, None
+        if conn is None:
+            return
+        try:
+            if commit:
+                conn.commit()
+                for callback in self._on_commit:
+                    callback(conn)
+            elif not conn.closed:
+                conn.rollback()
+        finally:
+            conn.close()
+
+    def run_after_release(self) -> None:
+        callbacks, self._after_release = self._after_release, []
+        for callback, args in callbacks:
+            callback(*args)
+
+
+def run_in_unit_of_work(connect: Callable[[], Any], work: Callable[[UnitOfWork], Dict[str, Any]],
+                        attempts: Optional[int] = None) -> Dict[str, Any]:
+    '''
+    Выполняет work(uow) в отдельной единице работы. Ответ со statusCode < 400
+    коммитится, остальные и исключения откатываются. Сбой сериализации и
+    взаимоблокировка повторяются до attempts раз с экспоненциальной задержкой;
+    отложенные побочные эффекты неудачных попыток отбрасываются.
+    '''
+    attempts = attempts or RETRY_ATTEMPTS
+    for attempt in range(1, attempts + 1):
+        uow = UnitOfWork(connect)
+        try:
+            response = work(uow)
+            uow.release(commit=response.get('statusCode', 200) < 400)
+        except RETRYABLE_ERRORS:
+            uow.release(commit=False)
+            if attempt == attempts:
+                raise
+            time.sleep(RETRY_BASE_DELAY * (2 ** (attempt - 1)) * (1 + random.random()))
+            continue
+        except BaseException:
+            uow.release(commit=False)
+            raise
+
+        uow.run_after_release()
+        return response
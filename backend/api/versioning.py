@@ -0,0 +1,99 @@
+from typing import Any, Dict, Optional
+
+from order_stages import load_order_stages
+from response_utils import dumps
+
+# Оптимистическая блокировка: у orders и order_transport_stages есть version (V0011).
+# Запись с expected_version выполняется условным UPDATE ... WHERE version = expected_version;
+# если строку успели изменить, клиент получает 409 и текущее состояние заказа.
+# Полная перезапись заказа (update_order, PUT resource=order) без expected_version
+# отклоняется (428); действия над отдельными этапами принимают её необязательно.
+
+
+def parse_expected_version(value: Any) -> Optional[int]:
+    '''
+    expected_version из тела запроса: None, если не передана.
+    Raises: ValueError, если это не целое число
+    '''
+    if value is None or value == '':
+        return None
+    if isinstance(value, bool):
+        raise ValueError('expected_version must be an integer')
+    return int(value)
+
+
+def bump_order_version(cur: Any, order_id: int, expected_version: Optional[int] = None) -> Optional[int]:
+    '''
+    Увеличивает версию заказа, если она равна expected_version (или та не задана).
+    Вызывается и при изменении этапов, чтобы устаревшая форма заказа не затёрла их.
+    Returns: новая версия или None при конфликте / отсутствии заказа
+    '''
+    cur.execute('''
+        UPDATE orders SET version = version + 1
+        WHERE id = %(order_id)s AND deleted_at IS NULL
+          AND (%(expected)s::int IS NULL OR version = %(expected)s::int)
+        RETURNING version
+    ''', {'order_id': order_id, 'expected': expected_version})
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def load_order_state(cur: Any, order_id: int) -> Optional[Dict[str, Any]]:
+    '''
+    Текущее состояние заказа с этапами - то, что нужно клиенту, чтобы слить правки
+    '''
+    cur.execute('''
+        SELECT id, order_number, order_date::date AS order_date, status, client_id,
+               customer_items, invoice, track_number, cargo_type, cargo_weight, notes, version
+        FROM orders
+        WHERE id = %s AND deleted_at IS NULL
+    ''', (order_id,))
+    row = cur.fetchone()
+    if not row:
+        return None
+    columns = [desc[0] for desc in cur.description]
+    order = dict(zip(columns, row))
+    order['stages'] = load_order_stages(cur, [order['id']])[order['id']]
+    return order
+
+
+def version_conflict_response(cur: Any, order_id: int) -> Dict[str, Any]:
+    '''
+    409 с текущим состоянием заказа или 404, если заказа уже нет
+    '''
+    current = load_order_state(cur, order_id)
+    if current is None:
+        return {
+            'statusCode': 404,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': dumps({'success': False, 'message': 'Заказ не найден'}),
+            'isBase64Encoded': False
+        }
+    return {
+        'statusCode': 409,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': dumps({
+            'success': False,
+            'message': 'Заказ изменён другим пользователем',
+            'current': current
+        }),
+        'isBase64Encoded': False
+    }
+
+
+def invalid_version_response() -> Dict[str, Any]:
+    return {
+        'statusCode': 400,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': dumps({'success': False, 'message': 'expected_version must be an integer'}),
+        'isBase64Encoded': False
+    }
+
+
+def missing_version_response() -> Dict[str, Any]:
+    return {
+        'statusCode': 428,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': dumps({'success': False, 'message': 'expected_version is required'}),
+        'isBase64Encoded': False
+    }
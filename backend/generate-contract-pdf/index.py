@@ -4,15 +4,23 @@ import base64
 from datetime import datetime
 from io import BytesIO
 import psycopg2
-from reportlab.lib.pagesizes import A4
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.units import mm
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-from reportlab.lib import colors
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-from reportlab.lib.enums import TA_CENTER, TA_LEFT, TA_RIGHT
-import boto3
+from psycopg2 import sql
+
+# Схема развёртывания; запросы без префикса схемы, привязка через search_path.
+# Одинаковая копия в telegram, telegram-webhook и generate-contract-pdf: функции
+# деплоятся по отдельности и не импортируют backend/api/db_schema.py. Облачная
+# функция обслуживает одну схему (DB_SCHEMA); в server/wsgi.py get_db_connection
+# подменяется общим пулом, который привязывает схему филиала (X-Tenant) при выдаче
+DB_SCHEMA = os.environ.get('DB_SCHEMA')
+
+def get_db_connection():
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    if DB_SCHEMA:
+        cur = conn.cursor()
+        cur.execute(sql.SQL('SET search_path TO {}, public').format(sql.Identifier(DB_SCHEMA)))
+        cur.close()
+        conn.commit()
+    return conn
 
 def handler(event, context):
     """
@@ -55,8 +63,7 @@ def handler(event, context):
             'isBase64Encoded': False
         }
     
-    dsn = os.environ.get('DATABASE_URL')
-    conn = psycopg2.connect(dsn)
+    conn = get_db_connection()
     cur = conn.cursor()
     
     # Получаем данные договора с полными данными заказчика и перевозчика
@@ -76,9 +83,9 @@ def handler(event, context):
             ca.payment_amount, ca.payment_without_vat, ca.payment_terms, ca.payment_documents,
             ca.driver_name, ca.driver_license, ca.driver_passport, ca.driver_passport_issued,
             ca.vehicle_number, ca.trailer_number, ca.transport_conditions
-        FROM t_p96093837_transport_portal_fir.contract_applications ca
-        LEFT JOIN t_p96093837_transport_portal_fir.customers cust ON ca.customer_id = cust.id
-        LEFT JOIN t_p96093837_transport_portal_fir.clients cl ON ca.carrier_id = cl.id
+        FROM contract_applications ca
+        LEFT JOIN customers cust ON ca.customer_id = cust.id
+        LEFT JOIN clients cl ON ca.carrier_id = cl.id
         WHERE ca.id = %s
     ''', (contract_id,))
     
@@ -118,7 +125,29 @@ def handler(event, context):
         'transport_conditions': row[38]
     }
     
-    # Генерируем PDF
+    pdf_data = build_contract_pdf(data)
+    cdn_url = upload_contract_pdf(contract_id, pdf_data)
+    
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({'success': True, 'url': cdn_url}),
+        'isBase64Encoded': False
+    }
+
+
+def build_contract_pdf(data):
+    """
+    Собирает PDF договора-заявки. reportlab импортируется здесь, а не на уровне
+    модуля: OPTIONS и ошибки валидации не платят за его загрузку
+    """
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.lib.units import mm
+    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+    from reportlab.lib import colors
+    from reportlab.lib.enums import TA_CENTER
+    
     buffer = BytesIO()
     doc = SimpleDocTemplate(buffer, pagesize=A4, rightMargin=20*mm, leftMargin=20*mm, topMargin=15*mm, bottomMargin=15*mm)
     
@@ -260,9 +289,16 @@ def handler(event, context):
     
     doc.build(story)
     
-    # Загружаем в S3
     pdf_data = buffer.getvalue()
     buffer.close()
+    return pdf_data
+
+
+def upload_contract_pdf(contract_id, pdf_data):
+    """
+    Загружает PDF в S3 и возвращает ссылку на CDN
+    """
+    import boto3
     
     s3 = boto3.client('s3',
         endpoint_url='https://bucket.poehali.dev',
@@ -279,10 +315,4 @@ def handler(event, context):
     )
     
     cdn_url = f"https://cdn.poehali.dev/projects/{os.environ['AWS_ACCESS_KEY_ID']}/bucket/{filename}"
-    
-    return {
-        'statusCode': 200,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({'success': True, 'url': cdn_url}),
-        'isBase64Encoded': False
-    }
\ No newline at end of file
+    return cdn_url
@@ -1,13 +1,26 @@
 import json
 import os
 import psycopg2
+from psycopg2 import sql
 import urllib.request
 import urllib.parse
 from typing import Dict, Any
 
+# Схема развёртывания; запросы без префикса схемы, привязка через search_path.
+# Одинаковая копия в telegram, telegram-webhook и generate-contract-pdf: функции
+# деплоятся по отдельности и не импортируют backend/api/db_schema.py. Облачная
+# функция обслуживает одну схему (DB_SCHEMA); в server/wsgi.py get_db_connection
+# подменяется общим пулом, который привязывает схему филиала (X-Tenant) при выдаче
+DB_SCHEMA = os.environ.get('DB_SCHEMA')
+
 def get_db_connection():
-    dsn = os.environ['DATABASE_URL']
-    return psycopg2.connect(dsn)
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    if DB_SCHEMA:
+        cur = conn.cursor()
+        cur.execute(sql.SQL('SET search_path TO {}, public').format(sql.Identifier(DB_SCHEMA)))
+        cur.close()
+        conn.commit()
+    return conn
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
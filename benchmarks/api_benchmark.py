@@ -0,0 +1,432 @@
+'''
+Нагрузочный бенчмарк backend/api: handler вызывается в процессе с синтетическими
+событиями для каждого resource и action, база - локальный PostgreSQL.
+
+Запуск:
+    python benchmarks/api_benchmark.py --dsn postgresql://localhost/transport_bench \
+        --seed --orders 20000 --iterations 50 --output bench_output.json
+    python benchmarks/api_benchmark.py --dsn ... --compare bench_output.json
+
+--seed пересоздаёт схему bench_transport (benchmarks/schema.sql + db_migrations/V0002+)
+и заполняет её синтетическими данными; без --seed используется уже заполненная схема.
+База берётся только из --dsn или BENCH_DATABASE_URL (не из DATABASE_URL развёртывания);
+нелокальная база требует --i-know-this-drops.
+На каждый сценарий считаются пропускная способность, p50/p95/p99, число SQL-запросов
+и пиковый объём выделенной памяти (tracemalloc, отдельный проход).
+'''
+import argparse
+import glob
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+import urllib.request
+from datetime import datetime
+
+import psycopg2
+import psycopg2.extensions
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(ROOT, 'backend', 'api'))
+
+BENCH_SCHEMA = 'bench_transport'
+LOCAL_HOSTS = ('', 'localhost', '127.0.0.1', '::1')
+
+
+class CountingCursor(psycopg2.extensions.cursor):
+    '''
+    Курсор, считающий выполненные запросы для текущего сценария
+    '''
+    executed = 0
+
+    def execute(self, query, vars=None):
+        CountingCursor.executed += 1
+        return super().execute(query, vars)
+
+
+def add_dsn_arguments(parser):
+    parser.add_argument('--dsn', default=os.environ.get('BENCH_DATABASE_URL'))
+    parser.add_argument('--i-know-this-drops', action='store_true',
+                        help=f'разрешить нелокальную базу: --seed удаляет схему {BENCH_SCHEMA}')
+
+
+def is_local_dsn(dsn):
+    '''
+    Локальный хост (TCP или unix-сокет) или база с bench/test в имени
+    '''
+    params = psycopg2.extensions.parse_dsn(dsn)
+    host = params.get('host', '')
+    dbname = params.get('dbname', '')
+    return host in LOCAL_HOSTS or host.startswith('/') or 'bench' in dbname or 'test' in dbname
+
+
+def check_dsn(parser, args):
+    if not args.dsn:
+        parser.error('--dsn или BENCH_DATABASE_URL обязателен')
+    if not is_local_dsn(args.dsn) and not args.i_know_this_drops:
+        parser.error('база не похожа на локальную; для неё нужен --i-know-this-drops')
+
+
+def connect(dsn, **kwargs):
+    '''
+    Соединение со схемой бенчмарка в search_path на уровне сессии
+    '''
+    return psycopg2.connect(dsn, options=f'-c search_path={BENCH_SCHEMA},public', **kwargs)
+
+
+def apply_schema(dsn):
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True
+    cur = conn.cursor()
+    cur.execute(f'DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE')
+    cur.execute(f'CREATE SCHEMA {BENCH_SCHEMA}')
+    cur.execute(f'SET search_path TO {BENCH_SCHEMA}, public')
+
+    files = [os.path.join(ROOT, 'benchmarks', 'schema.sql')]
+    files += sorted(glob.glob(os.path.join(ROOT, 'db_migrations', 'V*.sql')))
+    for path in files:
+        with open(path, encoding='utf-8') as f:
+            sql = f.read()
+        if sql.strip():
+            cur.execute(sql)
+    cur.close()
+    conn.close()
+
+
+def seed(dsn, orders):
+    '''
+    Синтетические данные: на каждые 100 заказов ~2 заказчика, 1 водитель и 1 автомобиль,
+    по 2 этапа на заказ, по точке и таможне на этап, по 3 записи журнала на заказ
+    '''
+    customers = max(orders // 50, 10)
+    drivers = max(orders // 100, 10)
+    vehicles = drivers
+    clients = max(orders // 500, 5)
+
+    conn = connect(dsn)
+    cur = conn.cursor()
+    statements = [
+        ('INSERT INTO clients (name, contact_person, phone, inn) '
+         "SELECT 'Перевозчик ' || i, 'Контакт ' || i, '+7900' || lpad(i::text, 7, '0'), lpad(i::text, 10, '7') "
+         'FROM generate_series(1, %(clients)s) i'),
+        ('INSERT INTO customers (company_name, nickname, inn, kpp, phone, email) '
+         "SELECT 'ООО Цветы ' || i, 'Заказчик' || i, lpad(i::text, 10, '5'), lpad(i::text, 9, '1'), "
+         "'+7911' || lpad(i::text, 7, '0'), 'c' || i || '@example.com' "
+         'FROM generate_series(1, %(customers)s) i'),
+        ('INSERT INTO drivers (full_name, last_name, first_name, phone, status) '
+         "SELECT 'Иванов' || i || ' Иван', 'Иванов' || i, 'Иван', '+7921' || lpad(i::text, 7, '0'), 'available' "
+         'FROM generate_series(1, %(drivers)s) i'),
+        ('INSERT INTO vehicles (license_plate, model, vehicle_brand, trailer_plate, company_name, driver_id, status) '
+         "SELECT 'А' || lpad(i::text, 3, '0') || 'ВС77', 'Actros', 'Mercedes', 'ВУ' || lpad(i::text, 4, '0') || '77', "
+         "'Перевозчик ' || (1 + i %% %(clients)s), i, 'available' "
+         'FROM generate_series(1, %(vehicles)s) i'),
+        ('INSERT INTO orders (order_number, client_id, order_date, status, customer_items, cargo_type, cargo_weight, invoice, track_number) '
+         "SELECT 'EU' || to_char(d, 'DDMMYYYY') || '-' || lpad(i::text, 6, '0'), 1 + i %% %(clients)s, d, "
+         "(ARRAY['pending', 'in_transit', 'delivered'])[1 + i %% 3], "
+         "jsonb_build_array(jsonb_build_object('customer_id', 1 + i %% %(customers)s, 'note', '')), "
+         "'Цветы', 1000 + i %% 500, 'INV-' || i, 'TRK' || lpad(i::text, 8, '0') "
+         "FROM generate_series(1, %(orders)s) i, LATERAL (SELECT DATE '2024-01-01' + (i %% 1000) AS d) dd"),
+        ('INSERT INTO order_transport_stages (order_id, stage_number, vehicle_id, driver_id, from_location, to_location, '
+         'planned_departure, planned_arrival, distance_km, notes, status, carrier, phone, border_crossing) '
+         "SELECT o.id, n, 1 + (o.id + n) %% %(vehicles)s, 1 + (o.id + n) %% %(drivers)s, "
+         "(ARRAY['Амстердам', 'Брест', 'Москва'])[n], (ARRAY['Брест', 'Москва', 'Казань'])[n], "
+         "o.order_date + (n || ' days')::interval, o.order_date + ((n + 1) || ' days')::interval, 800, "
+         "'Перевозчик: ТК ' || o.id %% 20 || ', Тел: +7900' || o.id %% 1000 || ', Граница: Брест', "
+         "CASE WHEN o.status = 'delivered' THEN 'completed' ELSE 'planned' END, "
+         "'ТК ' || o.id %% 20, '+7900' || o.id %% 1000, 'Брест' "
+         'FROM orders o, generate_series(1, 2) n'),
+        ('INSERT INTO stage_waypoints (stage_id, waypoint_order, customer_id, location, waypoint_type, planned_time) '
+         "SELECT s.id, 1, 1 + s.order_id %% %(customers)s, 'Склад ' || s.id %% 100, 'unloading', s.planned_arrival "
+         'FROM order_transport_stages s'),
+        ('INSERT INTO order_customs_points (order_id, stage_id, customs_name, country) '
+         "SELECT s.order_id, s.id, 'Брест-Козловичи', 'BY' FROM order_transport_stages s"),
+        ('INSERT INTO activity_log (order_id, user_role, user_name, action_type, description, created_at) '
+         "SELECT o.id, 'Логист', 'Логист ' || n, (ARRAY['create_order', 'add_stage', 'update_order_info'])[n], "
+         "'действие ' || n || ' в заказе ' || o.order_number, o.order_date + (n || ' hours')::interval "
+         'FROM orders o, generate_series(1, 3) n'),
+        ("INSERT INTO users (username, full_name, role, login, password, is_active) "
+         "SELECT 'user' || i, 'Пользователь ' || i, (ARRAY['admin', 'logist'])[1 + i %% 2], 'user' || i, 'secret', true "
+         'FROM generate_series(1, 20) i'),
+        ("INSERT INTO roles (role_name, display_name, permissions) VALUES "
+         "('admin', 'Администратор', '{}'::jsonb), ('logist', 'Логист', '{}'::jsonb)"),
+        ('INSERT INTO customer_delivery_addresses (customer_id, address_name, address, is_primary) '
+         "SELECT c.id, 'Склад', 'г. Москва, ул. ' || c.id, true FROM customers c"),
+        ('INSERT INTO contract_applications (contract_number, contract_date, customer_id, carrier_id, loading_address, unloading_address) '
+         "SELECT 'Д-' || i, DATE '2024-01-01' + i %% 365, 1 + i %% %(customers)s, 1 + i %% %(clients)s, 'Амстердам', 'Москва' "
+         'FROM generate_series(1, 200) i')
+    ]
+    params = {'orders': orders, 'customers': customers, 'drivers': drivers,
+              'vehicles': vehicles, 'clients': clients}
+    for sql in statements:
+        cur.execute(sql, params)
+
+    from order_summary import refresh_order_summary
+    cur.execute('SELECT id FROM orders')
+    refresh_order_summary(cur, [row[0] for row in cur.fetchall()])
+    conn.commit()
+    cur.execute('ANALYZE')
+    conn.commit()
+    cur.close()
+    conn.close()
+    return params
+
+
+def get_event(query=None, body=None, method='GET'):
+    return {
+        'httpMethod': method,
+        'path': '/',
+        'headers': {},
+        'queryStringParameters': query or {},
+        'body': json.dumps(body) if body is not None else None
+    }
+
+
+def order_version_reader(dsn):
+    '''
+    Текущая версия заказа для expected_version в сценариях перезаписи заказа
+    '''
+    conn = connect(dsn)
+    conn.autocommit = True
+
+    def read(order_id):
+        cur = conn.cursor()
+        cur.execute('SELECT version FROM orders WHERE id = %s', (order_id,))
+        row = cur.fetchone()
+        cur.close()
+        return row[0] if row else 1
+    return read
+
+
+def build_scenarios(scale, rnd, order_version=lambda order_id: 1):
+    '''
+    Сценарий - (имя, фабрика события); фабрика вызывается на каждой итерации
+    '''
+    orders = scale['orders']
+
+    def order_id():
+        return rnd.randint(1, orders)
+
+    def stage(number):
+        return {
+            'stage_number': number,
+            'from_location': 'Амстердам',
+            'to_location': 'Москва',
+            'vehicle_id': rnd.randint(1, scale['vehicles']),
+            'driver_id': rnd.randint(1, scale['drivers']),
+            'planned_departure': '2026-01-10',
+            'notes': 'Перевозчик: ТК 1, Тел: +79000000000, Граница: Брест',
+            'waypoints': [{'waypoint_order': 1, 'location': 'Склад 1', 'waypoint_type': 'unloading'}],
+            'customs_points': [{'customs_name': 'Брест-Козловичи'}]
+        }
+
+    def new_order():
+        return {
+            'order_number': f'BENCH-{rnd.randint(0, 10 ** 9)}',
+            'order_date': '2026-01-10',
+            'client_id': rnd.randint(1, scale['clients']),
+            'customer_items': [{'customer_id': rnd.randint(1, scale['customers']), 'note': ''}],
+            'cargo_type': 'Цветы',
+            'cargo_weight': 1200
+        }
+
+    def update_order_event(target_id):
+        return get_event(method='POST', body={
+            'action': 'update_order', 'allow_overlap': True, 'order_id': target_id,
+            'expected_version': order_version(target_id), 'order': new_order(), 'stages': [stage(1), stage(2)]
+        })
+
+    resources = [
+        'orders', 'drivers', 'vehicles', 'clients', 'stats', 'activity_log', 'users', 'roles',
+        'customers', 'telegram_settings', 'active_sessions', 'contract_applications'
+    ]
+    scenarios = [(f'GET {name}', lambda name=name: get_event({'resource': name})) for name in resources]
+    scenarios += [
+        ('GET orders columnar', lambda: get_event({'resource': 'orders', 'format': 'columnar'})),
+        ('GET order_stages', lambda: get_event({'resource': 'order_stages', 'order_id': str(order_id())})),
+        ('GET order_stages batch', lambda: get_event({
+            'resource': 'order_stages',
+            'order_ids': ','.join(str(order_id()) for _ in range(50))
+        })),
+        ('GET activity_log order', lambda: get_event({'resource': 'activity_log', 'order_id': str(order_id())})),
+        ('GET customer_addresses', lambda: get_event({
+            'resource': 'customer_addresses', 'customer_id': str(rnd.randint(1, scale['customers']))
+        })),
+        ('GET last_order_number', lambda: get_event({'resource': 'last_order_number', 'direction': 'EU', 'date': '19102026'})),
+        ('GET search', lambda: get_event({'resource': 'search', 'q': rnd.choice(['EU', 'Иванов', 'А01', 'Брест', 'TRK0001'])})),
+        ('GET availability', lambda: get_event({'resource': 'availability', 'from': '2025-03-01', 'to': '2025-03-04'})),
+        ('GET utilization', lambda: get_event({'resource': 'utilization', 'from': '2025-01-01', 'to': '2025-03-31'})),
+        ('POST create_multi_stage_order', lambda: get_event(method='POST', body={
+            'action': 'create_multi_stage_order',
+            'allow_overlap': True,
+            'data': {'order': new_order(), 'stages': [stage(1), stage(2)], 'customs_points': []}
+        })),
+        ('POST update_order', lambda: update_order_event(order_id())),
+        ('POST update_fito_dates', lambda: get_event(method='POST', body={
+            'action': 'update_fito_dates', 'order_id': order_id(), 'data': {'fito_order_date': '2026-01-05'}
+        })),
+        ('POST add_order_stage', lambda: get_event(method='POST', body={
+            'action': 'add_order_stage', 'allow_overlap': True, 'order_id': order_id(), 'stage': stage(3)
+        })),
+        ('POST complete_stage', lambda: get_event(method='POST', body={
+            'action': 'complete_stage', 'stage_id': rnd.randint(1, orders * 2)
+        })),
+        ('POST update_session', lambda: get_event(method='POST', body={
+            'action': 'update_session', 'user_id': rnd.randint(1, 20), 'section_name': 'orders',
+            'full_name': 'Логист', 'role': 'logist'
+        })),
+        ('POST create_driver', lambda: get_event(method='POST', body={
+            'action': 'create_driver', 'data': {'last_name': 'Петров', 'first_name': 'Пётр', 'phone': '+79000000000'}
+        })),
+        ('POST create_vehicle', lambda: get_event(method='POST', body={
+            'action': 'create_vehicle', 'data': {'license_plate': 'В777ВВ77', 'vehicle_brand': 'Volvo'}
+        })),
+        ('POST create_customer', lambda: get_event(method='POST', body={
+            'action': 'create_customer', 'data': {'company_name': 'ООО Бенч', 'nickname': 'Бенч', 'inn': '7700000000'}
+        })),
+        ('POST create_client', lambda: get_event(method='POST', body={
+            'action': 'create_client', 'data': {'name': 'ТК Бенч'}
+        })),
+        ('POST login', lambda: get_event(method='POST', body={
+            'action': 'login', 'username': 'user1', 'password': 'secret'
+        })),
+        ('PUT driver', lambda: get_event(method='PUT', body={
+            'resource': 'driver', 'id': rnd.randint(1, scale['drivers']),
+            'data': {'last_name': 'Иванов', 'first_name': 'Иван', 'phone': '+79000000000'}
+        })),
+        ('PUT customer', lambda: get_event(method='PUT', body={
+            'resource': 'customer', 'id': rnd.randint(1, scale['customers']),
+            'data': {'company_name': 'ООО Цветы', 'nickname': f'Заказчик{rnd.randint(1, 10 ** 6)}'}
+        }))
+    ]
+    return scenarios
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def run_scenario(index_module, make_event, iterations, warmup):
+    for _ in range(warmup):
+        index_module.handler(make_event(), None)
+
+    timings = []
+    statuses = {}
+    CountingCursor.executed = 0
+    started = time.perf_counter()
+    for _ in range(iterations):
+        request_started = time.perf_counter()
+        response = index_module.handler(make_event(), None)
+        timings.append((time.perf_counter() - request_started) * 1000)
+        statuses[response['statusCode']] = statuses.get(response['statusCode'], 0) + 1
+    total = time.perf_counter() - started
+    queries = CountingCursor.executed / iterations
+
+    tracemalloc.start()
+    index_module.handler(make_event(), None)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'iterations': iterations,
+        'throughput_rps': round(iterations / total, 2),
+        'mean_ms': round(statistics.mean(timings), 3),
+        'p50_ms': round(percentile(timings, 50), 3),
+        'p95_ms': round(percentile(timings, 95), 3),
+        'p99_ms': round(percentile(timings, 99), 3),
+        'queries_per_request': round(queries, 2),
+        'peak_alloc_kib': round(peak / 1024, 1),
+        'statuses': {str(code): count for code, count in statuses.items()}
+    }
+
+
+def compare(current, previous_path):
+    with open(previous_path, encoding='utf-8') as f:
+        previous = json.load(f)['scenarios']
+    print(f"\n{'scenario':<34} {'p95 before':>11} {'p95 now':>9} {'change':>8}")
+    for name, result in current.items():
+        before = previous.get(name)
+        if not before:
+            continue
+        change = (result['p95_ms'] - before['p95_ms']) / before['p95_ms'] * 100 if before['p95_ms'] else 0
+        print(f"{name:<34} {before['p95_ms']:>11.2f} {result['p95_ms']:>9.2f} {change:>7.1f}%")
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    add_dsn_arguments(parser)
+    parser.add_argument('--seed', action='store_true', help='пересоздать схему и заполнить данными')
+    parser.add_argument('--orders', type=int, default=10000)
+    parser.add_argument('--iterations', type=int, default=30)
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--only', help='подстрока в имени сценария')
+    parser.add_argument('--output', default='bench_output.json')
+    parser.add_argument('--compare', help='предыдущий JSON с результатами')
+    parser.add_argument('--allow-network', action='store_true',
+                        help='не подменять исходящие HTTP-запросы (Telegram)')
+    args = parser.parse_args()
+
+    check_dsn(parser, args)
+
+    if args.seed:
+        apply_schema(args.dsn)
+        scale = seed(args.dsn, args.orders)
+    else:
+        orders = args.orders
+        scale = {'orders': orders, 'customers': max(orders // 50, 10), 'drivers': max(orders // 100, 10),
+                 'vehicles': max(orders // 100, 10), 'clients': max(orders // 500, 5)}
+
+    if not args.allow_network:
+        def offline_urlopen(*_args, **_kwargs):
+            raise OSError('network disabled in benchmark')
+        urllib.request.urlopen = offline_urlopen
+
+    os.environ['DATABASE_URL'] = args.dsn
+    os.environ['DB_SCHEMA'] = BENCH_SCHEMA
+    import index
+    index.get_db_connection = lambda: connect(args.dsn, cursor_factory=CountingCursor)
+
+    rnd = random.Random(42)
+    results = {}
+    for name, make_event in build_scenarios(scale, rnd, order_version_reader(args.dsn)):
+        if args.only and args.only not in name:
+            continue
+        results[name] = run_scenario(index, make_event, args.iterations, args.warmup)
+        r = results[name]
+        print(f"{name:<34} {r['throughput_rps']:>8.1f} rps  p50 {r['p50_ms']:>8.2f}  "
+              f"p95 {r['p95_ms']:>8.2f}  p99 {r['p99_ms']:>8.2f} ms  "
+              f"{r['queries_per_request']:>6.1f} q  {r['peak_alloc_kib']:>9.1f} KiB")
+
+    report = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'git_revision': git_revision(),
+            'python': platform.python_version(),
+            'scale': scale,
+            'iterations': args.iterations
+        },
+        'scenarios': results
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f'\nрезультаты записаны в {args.output}')
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+'''
+Задержка ресурсов из нескольких независимых запросов (stats, order_stages) в
+трёх режимах:
+  sync         - handler как в облаке: новое соединение psycopg2 на запрос,
+                 запросы по очереди;
+  sync-pooled  - то же на соединении из пула server/pool.py (как server/wsgi.py);
+  async        - async_api: пул psycopg 3, запросы одним конвейером.
+
+Запуск:
+    python benchmarks/async_benchmark.py --dsn postgresql://localhost/transport_bench \
+        [--seed --orders 20000] [--iterations 200]
+
+Выигрыш конвейера растёт с задержкой сети до базы: на localhost он меньше,
+чем до управляемого PostgreSQL в другой зоне.
+'''
+import argparse
+import functools
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(ROOT, 'server'))
+
+from api_benchmark import BENCH_SCHEMA, add_dsn_arguments, apply_schema, check_dsn, connect, get_event, seed  # noqa: E402
+
+
+def measure(call, make_event, iterations, warmup):
+    for _ in range(warmup):
+        call(make_event())
+    latencies = []
+    for _ in range(iterations):
+        event = make_event()
+        started = time.perf_counter()
+        response = call(event)
+        latencies.append((time.perf_counter() - started) * 1000)
+        if response['statusCode'] != 200:
+            raise RuntimeError(f"status {response['statusCode']}: {response['body'][:200]}")
+    latencies.sort()
+    return {
+        'p50_ms': round(statistics.median(latencies), 3),
+        'p95_ms': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 3),
+        'mean_ms': round(statistics.fmean(latencies), 3)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    add_dsn_arguments(parser)
+    parser.add_argument('--seed', action='store_true', help='пересоздать схему и заполнить данными')
+    parser.add_argument('--orders', type=int, default=10000)
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('--output', help='записать результат в JSON')
+    args = parser.parse_args()
+
+    check_dsn(parser, args)
+    if args.seed:
+        apply_schema(args.dsn)
+        seed(args.dsn, args.orders)
+
+    os.environ['DATABASE_URL'] = args.dsn
+    os.environ['DB_SCHEMA'] = BENCH_SCHEMA
+    import async_api
+    import index
+    from pool import ConnectionPool
+    from query_stats import InstrumentedCursor
+
+    rnd = random.Random(42)
+
+    def order_ids(count):
+        return ','.join(str(rnd.randint(1, args.orders)) for _ in range(count))
+
+    scenarios = {
+        'GET stats': lambda: get_event({'resource': 'stats'}),
+        'GET order_stages': lambda: get_event({'resource': 'order_stages', 'order_id': order_ids(1)}),
+        'GET order_stages batch': lambda: get_event({'resource': 'order_stages', 'order_ids': order_ids(20)})
+    }
+
+    connect_per_request = index.get_db_connection
+    pool = ConnectionPool(functools.partial(connect, args.dsn, cursor_factory=InstrumentedCursor))
+
+    def sync_pooled(event):
+        try:
+            return index.handle_request(event, None)
+        finally:
+            pool.release_request()
+
+    modes = {
+        'sync': lambda event: index.handle_request(event, None),
+        'sync-pooled': sync_pooled,
+        'async': lambda event: async_api.run_async(event, None)
+    }
+
+    results = {}
+    print(f"{'scenario':<26} {'mode':<12} {'p50 ms':>8} {'p95 ms':>8} {'mean ms':>8}")
+    for name, make_event in scenarios.items():
+        for mode, call in modes.items():
+            index.get_db_connection = pool.checkout if mode == 'sync-pooled' else connect_per_request
+            result = measure(call, make_event, args.iterations, args.warmup)
+            results.setdefault(name, {})[mode] = result
+            print(f"{name:<26} {mode:<12} {result['p50_ms']:>8.2f} {result['p95_ms']:>8.2f} {result['mean_ms']:>8.2f}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'iterations': args.iterations, 'results': results}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
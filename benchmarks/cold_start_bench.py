@@ -0,0 +1,209 @@
+'''
+Холодный старт облачных функций: для каждой функции и сценария (OPTIONS,
+отклонённый запрос, полный запрос) запускается новый интерпретатор с
+-X importtime, импортирует index.py и вызывает handler один раз.
+
+Запуск:
+    python benchmarks/cold_start_bench.py [--dsn postgresql://localhost/transport_bench] \
+        [--runs 5] [--output benchmarks/results/cold_start.json] [--enforce]
+
+Время до первого ответа - медиана по --runs запускам, от старта процесса до
+возврата handler. Сценарии, которым нужна база, без --dsn пропускаются.
+С --enforce скрипт завершается с кодом 1, если превышен бюджет из
+benchmarks/cold_start_budget.json или в лёгком сценарии загружен тяжёлый модуль
+(например, reportlab на OPTIONS) - так проверку можно запускать в CI.
+'''
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+BUDGET_FILE = os.path.join(ROOT, 'benchmarks', 'cold_start_budget.json')
+RESULTS_DIR = os.path.join(ROOT, 'benchmarks', 'results')
+
+CHILD = '''
+import json, sys, time
+function_dir, event, offline = sys.argv[1], json.loads(sys.argv[2]), sys.argv[3] == '1'
+sys.path.insert(0, function_dir)
+if offline:
+    import urllib.request
+    def offline_urlopen(*_args, **_kwargs):
+        raise OSError('network disabled in benchmark')
+    urllib.request.urlopen = offline_urlopen
+    try:
+        import botocore.client
+        botocore.client.BaseClient._make_api_call = lambda *_args, **_kwargs: {}
+    except ImportError:
+        pass
+modules_before = set(sys.modules)
+started = time.perf_counter()
+import index
+imported = time.perf_counter()
+response = index.handler(event, None)
+finished = time.perf_counter()
+print(json.dumps({
+    'status': response.get('statusCode'),
+    'import_ms': (imported - started) * 1000,
+    'handler_ms': (finished - imported) * 1000,
+    'modules': sorted(set(sys.modules) - modules_before)
+}))
+'''
+
+START_UPDATE = {
+    'update_id': 1,
+    'message': {
+        'message_id': 1,
+        'from': {'id': 1, 'is_bot': False, 'first_name': 'Bench'},
+        'chat': {'id': 1, 'type': 'private'},
+        'date': 1700000000,
+        'text': '/start'
+    }
+}
+
+# функция -> сценарий -> (событие, нужна ли база)
+SCENARIOS = {
+    'api': {
+        'options': ({'httpMethod': 'OPTIONS'}, False),
+        'rejected': ({'httpMethod': 'GET', 'queryStringParameters': {'resource': 'search', 'q': 'a'}}, True),
+        'full': ({'httpMethod': 'GET', 'queryStringParameters': {'resource': 'orders'}}, True)
+    },
+    'generate-contract-pdf': {
+        'options': ({'httpMethod': 'OPTIONS'}, False),
+        'rejected': ({'httpMethod': 'POST', 'body': '{}'}, False),
+        'full': ({'httpMethod': 'POST', 'body': json.dumps({'contract_id': 1})}, True)
+    },
+    'telegram': {
+        'options': ({'httpMethod': 'OPTIONS'}, False),
+        'rejected': ({'httpMethod': 'GET'}, False),
+        'full': ({'httpMethod': 'POST', 'body': json.dumps({
+            'event_type': 'order_created',
+            'order_data': {'order_id': 1, 'order_number': 'BENCH-1', 'route': 'Москва → Минск'}
+        })}, True)
+    },
+    'telegram-webhook': {
+        'options': ({'httpMethod': 'OPTIONS'}, False),
+        'rejected': ({'httpMethod': 'POST', 'body': json.dumps({'update_id': 1})}, False),
+        'full': ({'httpMethod': 'POST', 'body': json.dumps(START_UPDATE)}, True)
+    }
+}
+
+
+def parse_importtime(stderr):
+    '''
+    Разбирает вывод -X importtime: {модуль верхнего уровня: накопленное время, мс}.
+    Вложенные импорты (с отступом) уже учтены во времени родителя.
+    '''
+    packages = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        parts = line[len('import time:'):].split('|')
+        if len(parts) != 3 or not parts[1].strip().isdigit() or parts[2].startswith('  '):
+            continue
+        name = parts[2].strip()
+        packages[name] = packages.get(name, 0) + int(parts[1]) / 1000
+    return packages
+
+
+def run_once(function, event, dsn, offline):
+    env = dict(os.environ)
+    if dsn:
+        env['DATABASE_URL'] = dsn
+    function_dir = os.path.join(ROOT, 'backend', function)
+    started = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', CHILD, function_dir, json.dumps(event), '1' if offline else '0'],
+        cwd=function_dir, env=env, capture_output=True, text=True
+    )
+    elapsed = (time.perf_counter() - started) * 1000
+    if completed.returncode != 0:
+        tail = completed.stderr.strip().splitlines()[-1:] or ['']
+        raise RuntimeError(f'{function}: {tail[0]}')
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    result['first_response_ms'] = elapsed
+    result['imports'] = parse_importtime(completed.stderr)
+    return result
+
+
+def check_budget(function, scenario, result, budget):
+    problems = []
+    limits = budget.get(function, {})
+    limit = limits.get('first_response_ms', {}).get(scenario)
+    if limit is not None and result['first_response_ms'] > limit:
+        problems.append(f"{function}/{scenario}: {result['first_response_ms']:.0f} ms > {limit} ms")
+    if scenario in ('options', 'rejected'):
+        for module in limits.get('forbidden_modules', []):
+            if any(name == module or name.startswith(module + '.') for name in result['modules']):
+                problems.append(f'{function}/{scenario}: загружен {module}')
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dsn', default=os.environ.get('DATABASE_URL'))
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--only', help='имя функции')
+    parser.add_argument('--top', type=int, default=8, help='сколько самых тяжёлых импортов показать')
+    parser.add_argument('--output', default=os.path.join(RESULTS_DIR, 'cold_start.json'))
+    parser.add_argument('--enforce', action='store_true', help='код 1 при нарушении бюджета')
+    parser.add_argument('--allow-network', action='store_true',
+                        help='не отключать urlopen и S3 в полных сценариях')
+    args = parser.parse_args()
+
+    with open(BUDGET_FILE, encoding='utf-8') as f:
+        budget = json.load(f)
+
+    results = {}
+    problems = []
+    for function, scenarios in SCENARIOS.items():
+        if args.only and function != args.only:
+            continue
+        for scenario, (event, needs_db) in scenarios.items():
+            name = f'{function}/{scenario}'
+            if needs_db and not args.dsn:
+                print(f'{name:<34} пропущен: нужна база (--dsn)')
+                continue
+            try:
+                offline = scenario == 'full' and not args.allow_network
+                runs = [run_once(function, event, args.dsn, offline) for _ in range(args.runs)]
+            except RuntimeError as e:
+                print(f'{name:<34} ошибка: {e}')
+                continue
+
+            median = {
+                key: statistics.median(run[key] for run in runs)
+                for key in ('first_response_ms', 'import_ms', 'handler_ms')
+            }
+            heaviest = sorted(runs[-1]['imports'].items(), key=lambda item: -item[1])[:args.top]
+            result = {
+                'status': runs[-1]['status'],
+                **{key: round(value, 2) for key, value in median.items()},
+                'modules': runs[-1]['modules'],
+                'heaviest_imports_ms': {module: round(ms, 2) for module, ms in heaviest}
+            }
+            results[name] = result
+            problems.extend(check_budget(function, scenario, result, budget))
+
+            print(f"{name:<34} {result['status']}  первый ответ {result['first_response_ms']:>8.1f} ms  "
+                  f"import {result['import_ms']:>7.1f} ms  handler {result['handler_ms']:>7.1f} ms")
+            print('    ' + ', '.join(f'{module} {ms:.1f}' for module, ms in heaviest))
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump({'python': sys.version.split()[0], 'runs': args.runs, 'results': results}, f, ensure_ascii=False, indent=2)
+    print(f'\nрезультаты записаны в {args.output}')
+
+    if problems:
+        print('\nнарушения бюджета:')
+        for problem in problems:
+            print(f'  {problem}')
+        if args.enforce:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
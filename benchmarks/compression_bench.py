@@ -0,0 +1,47 @@
+'''
+Размер и время сжатия ответа со списком заказов при разных объёмах:
+без сжатия, gzip и brotli (если установлен)
+Запуск: python benchmarks/compression_bench.py
+'''
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend', 'api'))
+sys.path.insert(0, os.path.dirname(__file__))
+
+import response_utils  # noqa: E402
+from serialization_bench import make_orders  # noqa: E402
+
+SIZES = [5, 50, 500, 5000, 20000]
+
+
+def measure(body, encoding, repeat=5):
+    event = {'headers': {'Accept-Encoding': encoding}}
+    response = {'statusCode': 200, 'headers': {}, 'body': body, 'isBase64Encoded': False}
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = response_utils.compress_response(event, response)
+        timings.append(time.perf_counter() - started)
+    size = len(result['body']) * 3 // 4 if result['isBase64Encoded'] else len(body.encode('utf-8'))
+    return size, min(timings) * 1000
+
+
+def main():
+    encodings = ['gzip'] + (['br'] if response_utils.brotli is not None else [])
+    header = f"{'orders':>7} {'raw KiB':>10}" + ''.join(f" {enc + ' KiB':>10} {enc + ' ms':>8}" for enc in encodings)
+    print(header)
+    for count in SIZES:
+        body = response_utils.dumps({'orders': make_orders(count)})
+        line = f'{count:>7} {len(body.encode("utf-8")) / 1024:>10.1f}'
+        for encoding in encodings:
+            size, elapsed = measure(body, encoding)
+            line += f' {size / 1024:>10.1f} {elapsed:>8.2f}'
+        print(line)
+    if response_utils.brotli is None:
+        print('brotli не установлен - вариант br пропущен')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+'''
+Регрессионная проверка планов: прогоняет сценарии api_benchmark через handler,
+записывает каждый выполненный SQL-запрос (с подставленными параметрами) и
+делает для него EXPLAIN. Проверка падает (код 1), если запрос с условием
+читает таблицу размером от --min-rows строк последовательным сканированием.
+
+Запуск:
+    python benchmarks/explain_check.py --dsn postgresql://localhost/transport_bench --seed --orders 20000
+
+Без --seed используется уже заполненная база. Запросы без параметров
+(полные списки: GET drivers, GET vehicles) читают таблицу целиком по смыслу
+и не проверяются; осознанные исключения перечислены в ALLOWED_SEQ_SCANS.
+'''
+import argparse
+import json
+import os
+import random
+import sys
+import urllib.request
+
+import psycopg2
+import psycopg2.extensions
+
+# До импорта index: запросы должны уходить как есть, а не через EXECUTE
+os.environ['PREPARED_STATEMENTS'] = '0'
+
+from api_benchmark import (  # noqa: E402
+    BENCH_SCHEMA, add_dsn_arguments, apply_schema, build_scenarios, check_dsn, connect, order_version_reader, seed
+)
+from query_stats import normalize_statement  # noqa: E402
+
+# (начало нормализованного запроса, таблица): последовательное чтение ожидаемо
+ALLOWED_SEQ_SCANS = [
+    # Счётчики дашборда по статусу: условие выбирает заметную долю таблицы
+    ('SELECT COUNT(*) FROM orders WHERE status', 'orders'),
+    # Сброс устаревших сессий обновляет почти все строки
+    ('UPDATE user_sessions SET last_activity = CURRENT_TIMESTAMP WHERE last_activity <', 'user_sessions'),
+]
+
+CHECKED_PREFIXES = ('SELECT', 'UPDATE', 'DELETE', 'WITH', 'INSERT INTO order_summary')
+
+
+class RecordingCursor(psycopg2.extensions.cursor):
+    '''
+    Курсор, запоминающий текст каждого выполненного запроса с параметрами
+    '''
+    statements = []
+
+    def execute(self, query, vars=None):
+        try:
+            return super().execute(query, vars)
+        finally:
+            if self.query:
+                RecordingCursor.statements.append(self.query.decode('utf-8', 'replace'))
+
+
+def seq_scans(plan):
+    '''
+    Таблицы, которые план читает последовательным сканированием
+    '''
+    found = []
+    if plan.get('Node Type') == 'Seq Scan':
+        found.append(plan.get('Relation Name'))
+    for child in plan.get('Plans', []):
+        found.extend(seq_scans(child))
+    return found
+
+
+def is_allowed(shape, relation):
+    return any(shape.startswith(prefix) and relation == table for prefix, table in ALLOWED_SEQ_SCANS)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    add_dsn_arguments(parser)
+    parser.add_argument('--seed', action='store_true', help='пересоздать схему и заполнить данными')
+    parser.add_argument('--orders', type=int, default=20000)
+    parser.add_argument('--min-rows', type=int, default=1000,
+                        help='таблицы меньше этого размера можно читать целиком')
+    parser.add_argument('--only', help='подстрока в имени сценария')
+    parser.add_argument('--verbose', action='store_true', help='печатать планы нарушений')
+    args = parser.parse_args()
+
+    check_dsn(parser, args)
+
+    if args.seed:
+        apply_schema(args.dsn)
+        scale = seed(args.dsn, args.orders)
+    else:
+        orders = args.orders
+        scale = {'orders': orders, 'customers': max(orders // 50, 10), 'drivers': max(orders // 100, 10),
+                 'vehicles': max(orders // 100, 10), 'clients': max(orders // 500, 5)}
+
+    def offline_urlopen(*_args, **_kwargs):
+        raise OSError('network disabled in explain check')
+    urllib.request.urlopen = offline_urlopen
+
+    os.environ['DATABASE_URL'] = args.dsn
+    os.environ['DB_SCHEMA'] = BENCH_SCHEMA
+    import index
+    index.get_db_connection = lambda: connect(args.dsn, cursor_factory=RecordingCursor)
+
+    # Запросы каждого сценария: {нормализованный вид: (сценарий, пример с параметрами)}
+    statements = {}
+    for name, make_event in build_scenarios(scale, random.Random(42), order_version_reader(args.dsn)):
+        if args.only and args.only not in name:
+            continue
+        RecordingCursor.statements = []
+        index.handler(make_event(), None)
+        for sql in RecordingCursor.statements:
+            shape = normalize_statement(sql)
+            if shape.startswith(CHECKED_PREFIXES) and '?' in shape:
+                statements.setdefault(shape, (name, sql))
+
+    conn = psycopg2.connect(args.dsn)
+    conn.autocommit = True
+    cur = conn.cursor()
+    cur.execute(f'SET search_path TO {BENCH_SCHEMA}, public')
+    cur.execute('ANALYZE')
+    cur.execute('''
+        SELECT c.relname, c.reltuples
+        FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = %s AND c.relkind = 'r'
+    ''', (BENCH_SCHEMA,))
+    table_rows = dict(cur.fetchall())
+
+    violations = []
+    for shape, (scenario, sql) in sorted(statements.items(), key=lambda item: item[1][0]):
+        try:
+            cur.execute(f'EXPLAIN (FORMAT JSON) {sql}')
+            plan = cur.fetchone()[0][0]['Plan']
+        except psycopg2.Error as e:
+            message = str(e).strip().splitlines()[0]
+            print(f'{scenario:<34} EXPLAIN не выполнен: {message}')
+            violations.append((scenario, shape, {'EXPLAIN error': message}))
+            continue
+        large = [
+            relation for relation in seq_scans(plan)
+            if table_rows.get(relation, 0) >= args.min_rows and not is_allowed(shape, relation)
+        ]
+        status = 'OK' if not large else 'SEQ SCAN ' + ', '.join(sorted(set(large)))
+        print(f'{scenario:<34} {status:<40} {shape[:90]}')
+        if large:
+            violations.append((scenario, shape, plan))
+
+    conn.close()
+
+    print(f'\nпроверено запросов: {len(statements)}, нарушений: {len(violations)}')
+    if violations:
+        if args.verbose:
+            for scenario, shape, plan in violations:
+                print(f'\n{scenario}: {shape}\n{json.dumps(plan, ensure_ascii=False, indent=2)}')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
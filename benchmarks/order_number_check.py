@@ -0,0 +1,109 @@
+'''
+Проверка выделения номеров заказов под конкурентной нагрузкой: --threads потоков
+одновременно вызывают handler с resource=last_order_number для одного направления
+и даты (каждый по --per-thread раз). Выданные номера обязаны быть уникальными и
+идти подряд с 001 без пропусков; каждый должен быть зарезервирован.
+
+Направление каждого запуска новое (случайные буквы), поэтому счётчик начинается с нуля.
+Схема - bench_transport из api_benchmark.py (--seed пересоздаёт её без данных).
+
+Запуск: python benchmarks/order_number_check.py --dsn postgresql://localhost/transport_bench \
+    [--seed] [--threads 16] [--per-thread 5]
+Код 1 при дубликатах, пропусках или ошибках.
+'''
+import argparse
+import json
+import os
+import random
+import string
+import sys
+import threading
+
+from api_benchmark import BENCH_SCHEMA, add_dsn_arguments, apply_schema, check_dsn, connect, get_event
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    add_dsn_arguments(parser)
+    parser.add_argument('--seed', action='store_true', help='пересоздать схему')
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--per-thread', type=int, default=5)
+    args = parser.parse_args()
+
+    check_dsn(parser, args)
+    if args.seed:
+        apply_schema(args.dsn)
+
+    # До импорта index: без реплики и объединения запросов, каждый вызов идёт в базу
+    os.environ['DATABASE_URL'] = args.dsn
+    os.environ['DB_SCHEMA'] = BENCH_SCHEMA
+    os.environ.pop('DATABASE_READ_URL', None)
+    os.environ['SINGLE_FLIGHT'] = '0'
+    import index
+    index.get_db_connection = lambda: connect(args.dsn)
+
+    direction = 'T' + ''.join(random.choices(string.ascii_uppercase, k=7))
+    date_str = '19102026'
+    event = get_event({'resource': 'last_order_number', 'direction': direction, 'date': date_str})
+
+    issued = []
+    errors = []
+    lock = threading.Lock()
+    barrier = threading.Barrier(args.threads)
+
+    def worker():
+        barrier.wait()
+        for _ in range(args.per_thread):
+            try:
+                response = index.handler(dict(event), None)
+                body = json.loads(response['body'])
+                if response['statusCode'] != 200:
+                    raise RuntimeError(f"{response['statusCode']}: {body}")
+                with lock:
+                    issued.append(body['order_number'])
+            except Exception as e:
+                with lock:
+                    errors.append(str(e))
+
+    threads = [threading.Thread(target=worker) for _ in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    total = args.threads * args.per_thread
+    prefix = f'{direction}{date_str}-'
+    numbers = sorted(int(number[len(prefix):]) for number in issued if number.startswith(prefix))
+    duplicates = len(issued) - len(set(issued))
+    missing = sorted(set(range(1, total + 1)) - set(numbers))
+
+    conn = connect(args.dsn)
+    cur = conn.cursor()
+    cur.execute('SELECT COUNT(*) FROM order_number_reservations WHERE order_number LIKE %s', (prefix + '%',))
+    reserved = cur.fetchone()[0]
+    cur.execute('DELETE FROM order_number_reservations WHERE order_number LIKE %s', (prefix + '%',))
+    cur.execute('DELETE FROM order_number_sequences WHERE direction = %s', (direction,))
+    conn.commit()
+    conn.close()
+
+    print(f'направление {direction}: выдано {len(issued)} из {total}, зарезервировано {reserved}')
+    problems = []
+    if errors:
+        problems.append(f'ошибок: {len(errors)} (первая: {errors[0]})')
+    if duplicates:
+        problems.append(f'дубликатов: {duplicates}')
+    if missing:
+        problems.append(f'пропущены номера: {missing[:10]}')
+    if numbers and numbers[-1] > total:
+        problems.append(f'номер больше {total}: {numbers[-1]}')
+    if reserved != len(set(issued)):
+        problems.append(f'резервов {reserved}, а выдано номеров {len(set(issued))}')
+
+    for problem in problems:
+        print(problem)
+    print('OK' if not problems else f'нарушений: {len(problems)}')
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == '__main__':
+    main()
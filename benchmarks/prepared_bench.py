@@ -0,0 +1,100 @@
+'''
+Подготовленные запросы против обычных в двух режимах:
+  на одном соединении (пул server/wsgi.py): экономия на планировании;
+  новое соединение на запрос (облачная функция): PREPARE не переиспользуется
+  и добавляет круг до базы - поэтому там PREPARED_STATEMENTS=0 по умолчанию.
+База должна быть заполнена api_benchmark.py --seed.
+Запуск: python benchmarks/prepared_bench.py --dsn postgresql://localhost/transport_bench \
+    [--calls 2000] [--requests 200 --per-request 2]
+'''
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend', 'api'))
+
+from api_benchmark import add_dsn_arguments, check_dsn, connect  # noqa: E402
+import order_summary  # noqa: E402,F401  регистрирует order_summary_refresh
+import prepared  # noqa: E402
+
+SAMPLE_PARAMS = {
+    'activity_log_insert': (1, 'Логист', 'Бенчмарк', 'bench', 'prepared statement benchmark'),
+    'vehicle_plate_by_id': (1,),
+    'driver_name_by_id': (1,),
+    'customer_nickname_by_id': (1,),
+    'client_name_by_id': (1,),
+    'stage_waypoint_insert': (1, 99, None, None, 'Склад', 'unloading', None, None, None),
+    'order_summary_refresh': ([1, 2, 3, 4, 5],)
+}
+
+
+def planning_time(cur, sql):
+    cur.execute(f'EXPLAIN (ANALYZE, FORMAT JSON) {sql}')
+    return cur.fetchone()[0][0]['Planning Time']
+
+
+def per_request_ms(dsn, execute, requests, per_request):
+    '''
+    Среднее время запроса с новым соединением: подключение, per_request выполнений, откат
+    '''
+    started = time.perf_counter()
+    for _ in range(requests):
+        conn = connect(dsn)
+        cur = conn.cursor()
+        for _ in range(per_request):
+            execute(cur)
+        conn.rollback()
+        conn.close()
+    return (time.perf_counter() - started) / requests * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    add_dsn_arguments(parser)
+    parser.add_argument('--calls', type=int, default=2000)
+    parser.add_argument('--requests', type=int, default=200, help='запросов с новым соединением')
+    parser.add_argument('--per-request', type=int, default=2, help='выполнений запроса за один HTTP-запрос')
+    args = parser.parse_args()
+    check_dsn(parser, args)
+    prepared.PREPARED_ENABLED = True
+
+    conn = connect(args.dsn)
+    cur = conn.cursor()
+    print('одно соединение')
+    print(f"{'statement':<26} {'plain us':>9} {'prepared us':>12} {'plan ms plain':>14} {'plan ms prep':>13}")
+    for name, params in SAMPLE_PARAMS.items():
+        sql, _ = prepared._registry[name]
+
+        started = time.perf_counter()
+        for _ in range(args.calls):
+            cur.execute(sql, params)
+        plain = (time.perf_counter() - started) / args.calls * 1e6
+
+        prepared.execute_prepared(cur, name, params)
+        started = time.perf_counter()
+        for _ in range(args.calls):
+            prepared.execute_prepared(cur, name, params)
+        prepared_us = (time.perf_counter() - started) / args.calls * 1e6
+
+        plan_plain = planning_time(cur, cur.mogrify(sql, params).decode('utf-8'))
+        placeholders = ', '.join(['%s'] * len(params))
+        plan_prepared = planning_time(cur, cur.mogrify(f'EXECUTE {name} ({placeholders})', params).decode('utf-8'))
+        print(f'{name:<26} {plain:>9.1f} {prepared_us:>12.1f} {plan_plain:>14.3f} {plan_prepared:>13.3f}')
+
+    conn.rollback()
+    conn.close()
+
+    print(f'\nновое соединение на запрос, {args.per_request} выполнения за запрос')
+    print(f"{'statement':<26} {'plain ms':>9} {'prepared ms':>12}")
+    for name, params in SAMPLE_PARAMS.items():
+        sql, _ = prepared._registry[name]
+        plain = per_request_ms(args.dsn, lambda cur: cur.execute(sql, params), args.requests, args.per_request)
+        prepared_ms = per_request_ms(
+            args.dsn, lambda cur: prepared.execute_prepared(cur, name, params), args.requests, args.per_request
+        )
+        print(f'{name:<26} {plain:>9.2f} {prepared_ms:>12.2f}')
+
+
+if __name__ == '__main__':
+    main()
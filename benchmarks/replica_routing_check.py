@@ -0,0 +1,153 @@
+'''
+Проверка маршрутизации чтений на реплику с гарантией read-your-writes.
+
+С настоящей репликой (две базы в потоковой репликации):
+    python benchmarks/replica_routing_check.py --dsn postgresql://primary/db --read-dsn postgresql://replica/db
+
+Без реплики - заглушка с задержкой: "реплика" - та же база, но считается, что
+она проиграла WAL только до позиции, которую основная база имела --simulate-lag
+секунд назад:
+    python benchmarks/replica_routing_check.py --dsn postgresql://localhost/transport_bench --simulate-lag 2
+
+Сценарий: создать водителя (POST create_driver), сразу прочитать список
+водителей с токеном X-Read-After из ответа и без него. Чтение с токеном обязано
+видеть водителя; без токена на реплике он может отсутствовать, пока она отстаёт.
+Код 1, если чтение с токеном не увидело запись.
+'''
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+import psycopg2
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(ROOT, 'backend', 'api'))
+
+
+class LagSimulator:
+    '''
+    Запоминает pg_current_wal_lsn() основной базы раз в 50 мс и отвечает, какую
+    позицию "проиграла" бы реплика с задержкой lag секунд
+    '''
+
+    def __init__(self, dsn, lag):
+        self.lag = lag
+        self.samples = []
+        self.conn = psycopg2.connect(dsn)
+        self.conn.autocommit = True
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def sample(self):
+        cur = self.conn.cursor()
+        cur.execute("SELECT pg_current_wal_lsn() - '0/0'::pg_lsn")
+        self.samples.append((time.monotonic(), int(cur.fetchone()[0])))
+        cur.close()
+
+    def run(self):
+        while not self.stopped.wait(0.05):
+            self.sample()
+
+    def start(self):
+        self.sample()
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        self.conn.close()
+
+    def replayed(self):
+        cutoff = time.monotonic() - self.lag
+        positions = [position for taken, position in self.samples if taken <= cutoff]
+        return positions[-1] if positions else 0
+
+    def caught_up(self, _conn, lsn):
+        high, _, low = lsn.partition('/')
+        return self.replayed() >= (int(high, 16) << 32) + int(low, 16)
+
+
+def call(index, method, params=None, body=None, token=None):
+    event = {'httpMethod': method, 'queryStringParameters': params or {}, 'headers': {}}
+    if body is not None:
+        event['body'] = json.dumps(body)
+    if token:
+        event['headers']['X-Read-After'] = token
+    response = index.handler(event, None)
+    return response, json.loads(response['body'] or '{}')
+
+
+def read_drivers(index, token=None):
+    response, body = call(index, 'GET', {'resource': 'drivers'}, token=token)
+    ids = {driver['id'] for driver in body.get('drivers', [])}
+    return response['headers'].get('X-Read-Source'), ids
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dsn', default=os.environ.get('DATABASE_URL'))
+    parser.add_argument('--read-dsn', default=os.environ.get('DATABASE_READ_URL'))
+    parser.add_argument('--simulate-lag', type=float, help='секунды задержки заглушки реплики')
+    args = parser.parse_args()
+
+    if not args.dsn:
+        parser.error('--dsn или DATABASE_URL обязателен')
+    if not args.read_dsn and args.simulate_lag is None:
+        parser.error('нужен --read-dsn или --simulate-lag')
+
+    # До импорта index: READ_URL читается при загрузке модуля replica
+    os.environ['DATABASE_URL'] = args.dsn
+    os.environ['DATABASE_READ_URL'] = args.read_dsn or args.dsn
+    import index
+    import replica
+
+    simulator = None
+    if args.simulate_lag is not None:
+        simulator = LagSimulator(args.dsn, args.simulate_lag)
+        simulator.start()
+        replica.replica_caught_up = simulator.caught_up
+
+    failures = 0
+    try:
+        response, body = call(index, 'POST', body={
+            'action': 'create_driver',
+            'data': {'last_name': 'Replica', 'first_name': f'Check {int(time.time())}'}
+        })
+        driver_id = body.get('id')
+        token = response['headers'].get('X-Read-After')
+        print(f'создан водитель {driver_id}, токен {token}')
+        if not token:
+            print('ответ на запись без X-Read-After')
+            failures += 1
+
+        source, ids = read_drivers(index, token)
+        visible = driver_id in ids
+        print(f'чтение с токеном:   {source:<8} видит запись: {visible}')
+        if not visible:
+            failures += 1
+
+        source, ids = read_drivers(index)
+        print(f'чтение без токена:  {source:<8} видит запись: {driver_id in ids}')
+
+        if simulator:
+            time.sleep(args.simulate_lag + 0.2)
+            source, ids = read_drivers(index, token)
+            print(f'после задержки:     {source:<8} видит запись: {driver_id in ids}')
+            if source != 'replica':
+                print('реплика догнала основную базу, но чтение не ушло на неё')
+                failures += 1
+
+        call(index, 'DELETE', body={'resource': 'driver', 'id': driver_id})
+    finally:
+        if simulator:
+            simulator.stop()
+
+    print('OK' if not failures else f'нарушений: {failures}')
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
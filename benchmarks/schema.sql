@@ -0,0 +1,265 @@
+-- Базовая схема портала для локальных бенчмарков.
+-- В продакшене эти таблицы созданы до V0002 и в db_migrations не описаны;
+-- здесь они восстановлены по запросам из backend/*/index.py.
+
+CREATE TABLE IF NOT EXISTS clients (
+    id SERIAL PRIMARY KEY,
+    name VARCHAR(255) NOT NULL,
+    contact_person VARCHAR(255),
+    phone VARCHAR(50),
+    email VARCHAR(255),
+    address TEXT,
+    full_legal_name TEXT,
+    inn VARCHAR(20),
+    ogrn VARCHAR(20),
+    legal_address TEXT,
+    bank_details TEXT,
+    director_name VARCHAR(255),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS customers (
+    id SERIAL PRIMARY KEY,
+    company_name VARCHAR(255),
+    inn VARCHAR(20),
+    kpp VARCHAR(20),
+    ogrn VARCHAR(20),
+    legal_address TEXT,
+    director_name VARCHAR(255),
+    delivery_address TEXT,
+    nickname VARCHAR(255),
+    full_legal_name TEXT,
+    bank_details TEXT,
+    contact_person VARCHAR(255),
+    phone VARCHAR(50),
+    email VARCHAR(255),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS customer_delivery_addresses (
+    id SERIAL PRIMARY KEY,
+    customer_id INTEGER REFERENCES customers(id),
+    address_name VARCHAR(255),
+    address TEXT,
+    contact_person VARCHAR(255),
+    phone VARCHAR(50),
+    is_primary BOOLEAN DEFAULT false,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS drivers (
+    id SERIAL PRIMARY KEY,
+    full_name VARCHAR(255),
+    last_name VARCHAR(100),
+    first_name VARCHAR(100),
+    middle_name VARCHAR(100),
+    phone VARCHAR(50),
+    additional_phone VARCHAR(50),
+    passport_series VARCHAR(10),
+    passport_number VARCHAR(20),
+    passport_issued_by TEXT,
+    passport_issue_date DATE,
+    license_series VARCHAR(10),
+    license_number VARCHAR(20),
+    license_issued_by TEXT,
+    license_issue_date DATE,
+    status VARCHAR(50) DEFAULT 'available',
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS vehicles (
+    id SERIAL PRIMARY KEY,
+    license_plate VARCHAR(50),
+    model VARCHAR(255),
+    capacity VARCHAR(100),
+    status VARCHAR(50) DEFAULT 'available',
+    vehicle_brand VARCHAR(255),
+    trailer_plate VARCHAR(50),
+    body_type VARCHAR(100),
+    company_name VARCHAR(255),
+    driver_id INTEGER REFERENCES drivers(id),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS orders (
+    id SERIAL PRIMARY KEY,
+    order_number VARCHAR(50),
+    client_id INTEGER REFERENCES clients(id),
+    carrier VARCHAR(255),
+    vehicle_id INTEGER,
+    driver_id INTEGER,
+    route_from TEXT,
+    route_to TEXT,
+    order_date DATE,
+    status VARCHAR(50) DEFAULT 'pending',
+    invoice_number VARCHAR(100),
+    phone VARCHAR(50),
+    border_crossing VARCHAR(255),
+    delivery_address TEXT,
+    overload VARCHAR(100),
+    attachments JSONB DEFAULT '[]'::jsonb,
+    customer_items JSONB DEFAULT '[]'::jsonb,
+    cargo_type VARCHAR(255),
+    cargo_weight NUMERIC(12, 2),
+    invoice VARCHAR(100),
+    track_number VARCHAR(100),
+    notes TEXT,
+    fito_order_date DATE,
+    fito_ready_date DATE,
+    fito_received_date DATE,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS order_stages (
+    id SERIAL PRIMARY KEY,
+    order_id INTEGER REFERENCES orders(id),
+    stage_name VARCHAR(255),
+    stage_order INTEGER,
+    is_completed BOOLEAN DEFAULT false,
+    completed_by VARCHAR(255),
+    completed_at TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS order_transport_stages (
+    id SERIAL PRIMARY KEY,
+    order_id INTEGER REFERENCES orders(id),
+    stage_number INTEGER,
+    vehicle_id INTEGER REFERENCES vehicles(id),
+    driver_id INTEGER REFERENCES drivers(id),
+    from_location TEXT,
+    to_location TEXT,
+    planned_departure TIMESTAMP,
+    planned_arrival TIMESTAMP,
+    actual_departure TIMESTAMP,
+    actual_arrival TIMESTAMP,
+    distance_km NUMERIC(10, 2),
+    notes TEXT,
+    status VARCHAR(50) DEFAULT 'planned',
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS stage_waypoints (
+    id SERIAL PRIMARY KEY,
+    stage_id INTEGER REFERENCES order_transport_stages(id),
+    waypoint_order INTEGER,
+    customer_id INTEGER,
+    delivery_address_id INTEGER,
+    location TEXT,
+    waypoint_type VARCHAR(50),
+    planned_time TIMESTAMP,
+    actual_time TIMESTAMP,
+    cargo_description TEXT,
+    notes TEXT
+);
+
+CREATE TABLE IF NOT EXISTS order_customs_points (
+    id SERIAL PRIMARY KEY,
+    order_id INTEGER,
+    stage_id INTEGER REFERENCES order_transport_stages(id),
+    customs_name VARCHAR(255),
+    country VARCHAR(100),
+    crossing_date DATE,
+    notes TEXT,
+    status VARCHAR(50) DEFAULT 'pending'
+);
+
+CREATE TABLE IF NOT EXISTS order_documents (
+    id SERIAL PRIMARY KEY,
+    order_id INTEGER REFERENCES orders(id),
+    file_url TEXT
+);
+
+CREATE TABLE IF NOT EXISTS phytosanitary_docs (
+    id SERIAL PRIMARY KEY,
+    order_id INTEGER REFERENCES orders(id),
+    file_url TEXT
+);
+
+CREATE TABLE IF NOT EXISTS activity_log (
+    id SERIAL PRIMARY KEY,
+    order_id INTEGER,
+    user_role VARCHAR(100),
+    user_name VARCHAR(255),
+    action_type VARCHAR(100),
+    description TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS users (
+    id SERIAL PRIMARY KEY,
+    username VARCHAR(100),
+    full_name VARCHAR(255),
+    email VARCHAR(255),
+    phone VARCHAR(50),
+    role VARCHAR(50),
+    login VARCHAR(100),
+    password VARCHAR(255),
+    is_active BOOLEAN DEFAULT true,
+    invite_code VARCHAR(50),
+    telegram_chat_id BIGINT,
+    telegram_connected_at TIMESTAMP,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS roles (
+    id SERIAL PRIMARY KEY,
+    role_name VARCHAR(50),
+    display_name VARCHAR(255),
+    permissions JSONB DEFAULT '{}'::jsonb,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS user_sessions (
+    id SERIAL PRIMARY KEY,
+    user_id INTEGER,
+    section_name VARCHAR(100),
+    full_name VARCHAR(255),
+    role VARCHAR(50),
+    is_editing BOOLEAN DEFAULT false,
+    editing_item_id INTEGER,
+    last_activity TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS telegram_bot_settings (
+    id SERIAL PRIMARY KEY,
+    bot_token TEXT,
+    chat_id TEXT,
+    is_active BOOLEAN DEFAULT false,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS contract_applications (
+    id SERIAL PRIMARY KEY,
+    contract_number VARCHAR(100),
+    contract_date DATE,
+    customer_id INTEGER,
+    carrier_id INTEGER,
+    vehicle_type VARCHAR(255),
+    refrigerator BOOLEAN DEFAULT false,
+    cargo_weight NUMERIC(12, 2),
+    cargo_volume NUMERIC(12, 2),
+    transport_mode TEXT,
+    additional_conditions TEXT,
+    loading_address TEXT,
+    loading_date DATE,
+    loading_contact TEXT,
+    unloading_address TEXT,
+    unloading_date DATE,
+    unloading_contact TEXT,
+    payment_amount NUMERIC(12, 2),
+    payment_without_vat BOOLEAN DEFAULT false,
+    payment_terms TEXT,
+    payment_documents TEXT,
+    driver_name VARCHAR(255),
+    driver_license VARCHAR(255),
+    driver_passport VARCHAR(255),
+    driver_passport_issued TEXT,
+    vehicle_number VARCHAR(50),
+    trailer_number VARCHAR(50),
+    transport_conditions TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
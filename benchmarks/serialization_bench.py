@@ -0,0 +1,99 @@
+'''
+Микробенчмарк сериализации списка заказов (10k строк):
+старый путь (strftime в цикле + json.dumps) против response_utils.dumps
+Запуск: python benchmarks/serialization_bench.py [--orders 10000] [--repeat 5]
+'''
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend', 'api'))
+
+import response_utils  # noqa: E402
+
+
+def make_orders(count):
+    base = datetime(2026, 1, 1, 9, 30)
+    orders = []
+    for i in range(count):
+        created = base + timedelta(hours=i)
+        orders.append({
+            'id': i,
+            'order_number': f'EU{created:%d%m%Y}-{i % 1000:03d}',
+            'order_date': created.date(),
+            'status': 'in_transit' if i % 3 else 'pending',
+            'client_name': f'Перевозчик {i % 50}',
+            'client_id': i % 50,
+            'customer_items': [{'customer_id': i % 200, 'note': ''}],
+            'invoice': f'INV-{i}',
+            'track_number': f'TRK{i:08d}',
+            'cargo_type': 'Цветы',
+            'cargo_weight': Decimal('1250.50'),
+            'notes': None,
+            'fito_order_date': created.date(),
+            'fito_ready_date': created.date() + timedelta(days=1),
+            'fito_received_date': None,
+            'customer_display': f'Заказчик {i % 200}',
+            'route_from': 'Амстердам',
+            'route_to': 'Москва',
+            'license_plate': f'А{i % 1000:03d}ВС77',
+            'driver_name': 'Иванов Иван',
+            'stage_count': 2,
+            'created_at': created
+        })
+    return orders
+
+
+def legacy_encode(orders):
+    for order in orders:
+        if order.get('order_date'):
+            order['order_date_display'] = order['order_date'].strftime('%d.%m.%Y')
+            order['order_date'] = order['order_date'].strftime('%Y-%m-%d')
+        for field in ('fito_order_date', 'fito_ready_date', 'fito_received_date'):
+            if order.get(field):
+                order[field] = order[field].strftime('%Y-%m-%d')
+        if order.get('created_at'):
+            order['created_at'] = order['created_at'].strftime('%d.%m.%Y %H:%M')
+        order['cargo_weight'] = float(order['cargo_weight'])
+    return json.dumps({'orders': orders})
+
+
+def measure(label, fn, count, repeat):
+    timings = []
+    size = 0
+    for _ in range(repeat):
+        orders = make_orders(count)
+        started = time.perf_counter()
+        body = fn(orders)
+        timings.append(time.perf_counter() - started)
+        size = len(body.encode('utf-8'))
+    best = min(timings) * 1000
+    print(f'{label:<28} best {best:8.2f} ms   {size / 1024:8.1f} KiB')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--orders', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f'{args.orders} orders, best of {args.repeat}')
+    measure('strftime loop + json.dumps', legacy_encode, args.orders, args.repeat)
+
+    orjson_module = response_utils.orjson
+    response_utils.orjson = None
+    measure('dumps (stdlib json)', lambda orders: response_utils.dumps({'orders': orders}), args.orders, args.repeat)
+    response_utils.orjson = orjson_module
+
+    if orjson_module is not None:
+        measure('dumps (orjson)', lambda orders: response_utils.dumps({'orders': orders}), args.orders, args.repeat)
+    else:
+        print('orjson не установлен - вариант с orjson пропущен')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+'''
+Пропускная способность самостоятельного сервера (server/wsgi.py): --concurrency
+клиентов в потоках отправляют запросы --duration секунд. Печатает запросы в
+секунду, их долю на ядро (--workers воркеров gunicorn) и перцентили задержки.
+
+Запуск:
+    WEB_CONCURRENCY=4 gunicorn -c server/gunicorn.conf.py &
+    python benchmarks/server_throughput.py --url 'http://127.0.0.1:8000/api/?resource=stats' \
+        --concurrency 32 --duration 20 --workers 4
+'''
+import argparse
+import json
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', required=True, action='append', help='можно указать несколько раз')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--workers', type=int, default=1, help='число воркеров сервера (ядер)')
+    parser.add_argument('--output', help='записать результат в JSON')
+    args = parser.parse_args()
+
+    deadline = time.perf_counter() + args.duration
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def client(number):
+        local, failed = [], 0
+        request_index = number
+        while time.perf_counter() < deadline:
+            url = args.url[request_index % len(args.url)]
+            request_index += 1
+            started = time.perf_counter()
+            try:
+                with urllib.request.urlopen(url, timeout=30) as response:
+                    response.read()
+                local.append((time.perf_counter() - started) * 1000)
+            except (urllib.error.URLError, OSError):
+                failed += 1
+        with lock:
+            latencies.extend(local)
+            errors.append(failed)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(client, range(args.concurrency)))
+    elapsed = time.perf_counter() - started
+
+    if not latencies:
+        print('ни одного успешного запроса')
+        return
+
+    result = {
+        'requests': len(latencies),
+        'errors': sum(errors),
+        'rps': round(len(latencies) / elapsed, 1),
+        'rps_per_core': round(len(latencies) / elapsed / args.workers, 1),
+        'p50_ms': round(statistics.median(latencies), 2),
+        'p95_ms': round(percentile(latencies, 0.95), 2),
+        'p99_ms': round(percentile(latencies, 0.99), 2)
+    }
+    print(f"{result['requests']} запросов за {elapsed:.1f} с, ошибок {result['errors']}")
+    print(f"{result['rps']} req/s, {result['rps_per_core']} req/s на ядро")
+    print(f"p50 {result['p50_ms']} ms  p95 {result['p95_ms']} ms  p99 {result['p99_ms']} ms")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'urls': args.url, 'concurrency': args.concurrency, 'workers': args.workers, **result},
+                      f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,28 @@
+-- Счётчики номеров заказов по направлению и дате (EU<ддммгггг>-NNN)
+CREATE TABLE IF NOT EXISTS order_number_sequences (
+    direction VARCHAR(10) NOT NULL,
+    date_key VARCHAR(8) NOT NULL,
+    last_value INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (direction, date_key)
+);
+
+-- Выданные, но ещё не использованные номера
+CREATE TABLE IF NOT EXISTS order_number_reservations (
+    order_number VARCHAR(50) PRIMARY KEY,
+    reserved_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    consumed_at TIMESTAMP,
+    order_id INTEGER
+);
+
+-- Переносим текущие максимальные номера из существующих заказов
+INSERT INTO order_number_sequences (direction, date_key, last_value)
+SELECT
+    substring(order_number FROM '^([A-Za-z]+)[0-9]{8}-'),
+    substring(order_number FROM '^[A-Za-z]+([0-9]{8})-'),
+    MAX(substring(order_number FROM '-([0-9]+)$')::INTEGER)
+FROM orders
+WHERE order_number ~ '^[A-Za-z]+[0-9]{8}-[0-9]+$'
+GROUP BY 1, 2
+ON CONFLICT (direction, date_key) DO UPDATE
+SET last_value = GREATEST(order_number_sequences.last_value, EXCLUDED.last_value);
@@ -0,0 +1,65 @@
+-- Полнотекстовый и триграммный поиск по заказам, заказчикам, водителям и автомобилям
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+ALTER TABLE orders ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (
+        to_tsvector('simple',
+            coalesce(order_number, '') || ' ' ||
+            coalesce(invoice, '') || ' ' ||
+            coalesce(track_number, ''))
+    ) STORED;
+
+ALTER TABLE customers ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (
+        to_tsvector('simple',
+            coalesce(nickname, '') || ' ' ||
+            coalesce(company_name, '') || ' ' ||
+            coalesce(inn, ''))
+    ) STORED;
+
+ALTER TABLE drivers ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (
+        to_tsvector('simple',
+            coalesce(last_name, '') || ' ' ||
+            coalesce(first_name, '') || ' ' ||
+            coalesce(middle_name, '') || ' ' ||
+            coalesce(full_name, '') || ' ' ||
+            coalesce(phone, '') || ' ' ||
+            coalesce(additional_phone, ''))
+    ) STORED;
+
+ALTER TABLE vehicles ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (
+        to_tsvector('simple',
+            coalesce(license_plate, '') || ' ' ||
+            coalesce(trailer_plate, '') || ' ' ||
+            coalesce(vehicle_brand, ''))
+    ) STORED;
+
+ALTER TABLE order_transport_stages ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (
+        to_tsvector('simple',
+            coalesce(from_location, '') || ' ' ||
+            coalesce(to_location, ''))
+    ) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_orders_search_vector ON orders USING GIN (search_vector);
+CREATE INDEX IF NOT EXISTS idx_customers_search_vector ON customers USING GIN (search_vector);
+CREATE INDEX IF NOT EXISTS idx_drivers_search_vector ON drivers USING GIN (search_vector);
+CREATE INDEX IF NOT EXISTS idx_vehicles_search_vector ON vehicles USING GIN (search_vector);
+CREATE INDEX IF NOT EXISTS idx_stages_search_vector ON order_transport_stages USING GIN (search_vector);
+
+-- Триграммы для поиска по подстроке (номера, ИНН, телефоны, госномера)
+CREATE INDEX IF NOT EXISTS idx_orders_order_number_trgm ON orders USING GIN (order_number gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_orders_invoice_trgm ON orders USING GIN (invoice gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_orders_track_number_trgm ON orders USING GIN (track_number gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_customers_nickname_trgm ON customers USING GIN (nickname gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_customers_company_name_trgm ON customers USING GIN (company_name gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_customers_inn_trgm ON customers USING GIN (inn gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_drivers_full_name_trgm ON drivers USING GIN (full_name gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_drivers_phone_trgm ON drivers USING GIN (phone gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_drivers_additional_phone_trgm ON drivers USING GIN (additional_phone gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_vehicles_license_plate_trgm ON vehicles USING GIN (license_plate gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_vehicles_trailer_plate_trgm ON vehicles USING GIN (trailer_plate gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_stages_from_location_trgm ON order_transport_stages USING GIN (from_location gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_stages_to_location_trgm ON order_transport_stages USING GIN (to_location gin_trgm_ops);
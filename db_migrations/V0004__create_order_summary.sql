@@ -0,0 +1,76 @@
+-- Read-модель списка заказов: поля, которые GET resource=orders раньше собирал на каждом чтении
+CREATE TABLE IF NOT EXISTS order_summary (
+    order_id INTEGER PRIMARY KEY REFERENCES orders(id) ON DELETE CASCADE,
+    customer_display TEXT NOT NULL DEFAULT '—',
+    route_from TEXT,
+    route_to TEXT,
+    license_plate VARCHAR(50),
+    vehicle_model VARCHAR(255),
+    vehicle_id INTEGER,
+    driver_name VARCHAR(255),
+    driver_id INTEGER,
+    carrier TEXT,
+    phone TEXT,
+    border_crossing TEXT,
+    stage_count INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_order_summary_driver_id ON order_summary (driver_id);
+CREATE INDEX IF NOT EXISTS idx_order_summary_vehicle_id ON order_summary (vehicle_id);
+CREATE INDEX IF NOT EXISTS idx_orders_customer_items ON orders USING GIN (customer_items jsonb_path_ops);
+CREATE INDEX IF NOT EXISTS idx_orders_order_date ON orders (order_date DESC);
+
+-- Заполняем read-модель для существующих заказов
+INSERT INTO order_summary (
+    order_id, customer_display, route_from, route_to,
+    license_plate, vehicle_model, vehicle_id, driver_name, driver_id,
+    carrier, phone, border_crossing, stage_count, updated_at
+)
+SELECT
+    o.id,
+    COALESCE((
+        SELECT string_agg(
+            cu.nickname || CASE WHEN COALESCE(ci.item->>'note', '') <> ''
+                                THEN ' (' || (ci.item->>'note') || ')'
+                                ELSE '' END,
+            ', ' ORDER BY ci.ord)
+        FROM jsonb_array_elements(
+            CASE WHEN jsonb_typeof(o.customer_items) = 'array'
+                 THEN o.customer_items ELSE '[]'::jsonb END
+        ) WITH ORDINALITY AS ci(item, ord)
+        JOIN customers cu ON cu.id::text = ci.item->>'customer_id'
+    ), '—'),
+    fs.from_location, fs.to_location,
+    fs.license_plate, fs.vehicle_model, fs.vehicle_id, fs.driver_name, fs.driver_id,
+    btrim(substring(fs.notes FROM 'Перевозчик:([^,]*)')),
+    btrim(substring(fs.notes FROM 'Тел:([^,]*)')),
+    btrim(substring(fs.notes FROM 'Граница:([^,]*)')),
+    (SELECT COUNT(*) FROM order_transport_stages sc WHERE sc.order_id = o.id),
+    CURRENT_TIMESTAMP
+FROM orders o
+LEFT JOIN LATERAL (
+    SELECT s.from_location, s.to_location, s.notes,
+           v.license_plate, v.model AS vehicle_model, v.id AS vehicle_id,
+           d.full_name AS driver_name, d.id AS driver_id
+    FROM order_transport_stages s
+    LEFT JOIN vehicles v ON s.vehicle_id = v.id
+    LEFT JOIN drivers d ON s.driver_id = d.id
+    WHERE s.order_id = o.id
+    ORDER BY s.stage_number
+    LIMIT 1
+) fs ON true
+ON CONFLICT (order_id) DO UPDATE SET
+    customer_display = EXCLUDED.customer_display,
+    route_from = EXCLUDED.route_from,
+    route_to = EXCLUDED.route_to,
+    license_plate = EXCLUDED.license_plate,
+    vehicle_model = EXCLUDED.vehicle_model,
+    vehicle_id = EXCLUDED.vehicle_id,
+    driver_name = EXCLUDED.driver_name,
+    driver_id = EXCLUDED.driver_id,
+    carrier = EXCLUDED.carrier,
+    phone = EXCLUDED.phone,
+    border_crossing = EXCLUDED.border_crossing,
+    stage_count = EXCLUDED.stage_count,
+    updated_at = EXCLUDED.updated_at;
@@ -0,0 +1,16 @@
+-- Перевозчик, телефон и пограничный переход этапа - отдельные колонки вместо разбора notes
+ALTER TABLE order_transport_stages ADD COLUMN IF NOT EXISTS carrier TEXT;
+ALTER TABLE order_transport_stages ADD COLUMN IF NOT EXISTS phone TEXT;
+ALTER TABLE order_transport_stages ADD COLUMN IF NOT EXISTS border_crossing TEXT;
+
+-- Разовый перенос из существующих примечаний ("Перевозчик: ..., Тел: ..., Граница: ...")
+UPDATE order_transport_stages
+SET carrier = NULLIF(btrim(substring(notes FROM 'Перевозчик:([^,]*)')), ''),
+    phone = NULLIF(btrim(substring(notes FROM 'Тел:([^,]*)')), ''),
+    border_crossing = NULLIF(btrim(substring(notes FROM 'Граница:([^,]*)')), '')
+WHERE notes LIKE '%Перевозчик:%'
+   OR notes LIKE '%Тел:%'
+   OR notes LIKE '%Граница:%';
+
+CREATE INDEX IF NOT EXISTS idx_stages_carrier ON order_transport_stages (carrier) WHERE carrier IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_stages_border_crossing ON order_transport_stages (border_crossing) WHERE border_crossing IS NOT NULL;
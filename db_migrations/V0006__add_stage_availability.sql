@@ -0,0 +1,22 @@
+-- Период занятости автомобиля и водителя этапом: [planned_departure, planned_arrival).
+-- Без даты прибытия (или если она не позже отправления) этап занимает сутки с момента отправления.
+CREATE EXTENSION IF NOT EXISTS btree_gist;
+
+ALTER TABLE order_transport_stages ADD COLUMN IF NOT EXISTS planned_period tsrange
+    GENERATED ALWAYS AS (
+        CASE
+            WHEN planned_departure IS NULL THEN NULL
+            WHEN planned_arrival IS NULL OR planned_arrival <= planned_departure
+                THEN tsrange(planned_departure, planned_departure + interval '1 day')
+            ELSE tsrange(planned_departure, planned_arrival)
+        END
+    ) STORED;
+
+-- Проверка пересечений и поиск свободных: vehicle_id = ? AND planned_period && ?
+CREATE INDEX IF NOT EXISTS idx_stages_vehicle_period ON order_transport_stages
+    USING gist (vehicle_id, planned_period)
+    WHERE vehicle_id IS NOT NULL AND planned_period IS NOT NULL;
+
+CREATE INDEX IF NOT EXISTS idx_stages_driver_period ON order_transport_stages
+    USING gist (driver_id, planned_period)
+    WHERE driver_id IS NOT NULL AND planned_period IS NOT NULL;
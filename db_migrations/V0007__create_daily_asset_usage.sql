@@ -0,0 +1,63 @@
+-- Дневные сводки загрузки автомобилей и водителей: resource=utilization читает только их.
+-- Строки пересчитываются в API при изменении этапов (asset_usage.refresh_asset_usage).
+CREATE TABLE IF NOT EXISTS daily_asset_usage (
+    asset_type VARCHAR(10) NOT NULL CHECK (asset_type IN ('vehicle', 'driver')),
+    asset_id INTEGER NOT NULL,
+    usage_date DATE NOT NULL,
+    stage_count INTEGER NOT NULL DEFAULT 0,
+    completed_stages INTEGER NOT NULL DEFAULT 0,
+    planned_hours NUMERIC(8, 2) NOT NULL DEFAULT 0,
+    actual_hours NUMERIC(8, 2) NOT NULL DEFAULT 0,
+    distance_km NUMERIC(12, 2) NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (asset_type, asset_id, usage_date)
+);
+
+CREATE INDEX IF NOT EXISTS idx_daily_asset_usage_date ON daily_asset_usage (usage_date, asset_type);
+
+-- Заполняем сводки по существующим этапам
+WITH stage_assets AS (
+    SELECT 'vehicle' AS asset_type, s.vehicle_id AS asset_id, s.status, s.distance_km,
+           s.planned_period, s.actual_departure, s.actual_arrival
+    FROM order_transport_stages s
+    WHERE s.vehicle_id IS NOT NULL
+    UNION ALL
+    SELECT 'driver', s.driver_id, s.status, s.distance_km,
+           s.planned_period, s.actual_departure, s.actual_arrival
+    FROM order_transport_stages s
+    WHERE s.driver_id IS NOT NULL
+),
+periods AS (
+    SELECT asset_type, asset_id, status, distance_km, planned_period,
+           CASE WHEN actual_arrival > actual_departure
+                THEN tsrange(actual_departure, actual_arrival) END AS actual_period
+    FROM stage_assets
+    WHERE COALESCE(status, '') <> 'cancelled'
+),
+stage_days AS (
+    SELECT p.*,
+           usage_day::date AS usage_date,
+           tsrange(usage_day, usage_day + interval '1 day') AS day_range,
+           usage_day = date_trunc('day', COALESCE(lower(p.actual_period), lower(p.planned_period))) AS is_start_day
+    FROM periods p
+    CROSS JOIN LATERAL generate_series(
+        date_trunc('day', LEAST(lower(p.actual_period), lower(p.planned_period))),
+        GREATEST(upper(p.actual_period), upper(p.planned_period)) - interval '1 microsecond',
+        interval '1 day'
+    ) AS usage_day
+    WHERE COALESCE(p.actual_period, p.planned_period) IS NOT NULL
+)
+INSERT INTO daily_asset_usage (
+    asset_type, asset_id, usage_date, stage_count, completed_stages,
+    planned_hours, actual_hours, distance_km, updated_at
+)
+SELECT
+    asset_type, asset_id, usage_date,
+    COUNT(*) FILTER (WHERE is_start_day),
+    COUNT(*) FILTER (WHERE is_start_day AND status = 'completed'),
+    COALESCE(SUM(EXTRACT(EPOCH FROM upper(planned_period * day_range) - lower(planned_period * day_range))), 0) / 3600,
+    COALESCE(SUM(EXTRACT(EPOCH FROM upper(actual_period * day_range) - lower(actual_period * day_range))), 0) / 3600,
+    COALESCE(SUM(distance_km) FILTER (WHERE is_start_day), 0),
+    CURRENT_TIMESTAMP
+FROM stage_days
+GROUP BY asset_type, asset_id, usage_date;
@@ -0,0 +1,52 @@
+-- Индексы под запросы backend/api, telegram и telegram-webhook.
+-- orders(order_date) уже есть: idx_orders_order_date из V0004.
+
+-- Этапы, точки и таможня заказа: load_order_stages, update_order, delete_order
+CREATE INDEX IF NOT EXISTS idx_stages_order_stage_number ON order_transport_stages (order_id, stage_number);
+CREATE INDEX IF NOT EXISTS idx_waypoints_stage_order ON stage_waypoints (stage_id, waypoint_order);
+CREATE INDEX IF NOT EXISTS idx_customs_points_stage_id ON order_customs_points (stage_id);
+CREATE INDEX IF NOT EXISTS idx_customs_points_order_id ON order_customs_points (order_id);
+CREATE INDEX IF NOT EXISTS idx_order_stages_order_id ON order_stages (order_id);
+CREATE INDEX IF NOT EXISTS idx_order_documents_order_id ON order_documents (order_id);
+CREATE INDEX IF NOT EXISTS idx_phytosanitary_docs_order_id ON phytosanitary_docs (order_id);
+
+-- Журнал: по заказу (resource=activity_log&order_id=) и последние 100 записей
+CREATE INDEX IF NOT EXISTS idx_activity_log_order_created ON activity_log (order_id, created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_activity_log_created ON activity_log (created_at DESC);
+
+-- Адреса доставки заказчика
+CREATE INDEX IF NOT EXISTS idx_delivery_addresses_customer_id ON customer_delivery_addresses (customer_id);
+
+-- Активные сессии раздела и сброс устаревших
+CREATE INDEX IF NOT EXISTS idx_user_sessions_section_activity ON user_sessions (section_name, last_activity DESC);
+CREATE INDEX IF NOT EXISTS idx_user_sessions_last_activity ON user_sessions (last_activity);
+
+-- Получатели уведомлений (telegram)
+CREATE INDEX IF NOT EXISTS idx_users_telegram_chat_id ON users (telegram_chat_id) WHERE telegram_chat_id IS NOT NULL;
+
+-- Код приглашения (webhook ищет его как уникальный), логин и имя роли код тоже
+-- считает уникальными (login, JOIN roles ON role_name), но дубликаты здесь не удалить
+-- автоматически: ограничение создаётся, только если их нет.
+-- Уникальность сессий - отдельная миграция V0013 (она удаляет дубликаты).
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM users WHERE invite_code IS NOT NULL GROUP BY invite_code HAVING COUNT(*) > 1) THEN
+        CREATE UNIQUE INDEX IF NOT EXISTS uq_users_invite_code ON users (invite_code) WHERE invite_code IS NOT NULL;
+    ELSE
+        RAISE NOTICE 'users.invite_code has duplicates, uq_users_invite_code not created';
+        CREATE INDEX IF NOT EXISTS idx_users_invite_code ON users (invite_code) WHERE invite_code IS NOT NULL;
+    END IF;
+
+    IF NOT EXISTS (SELECT 1 FROM users WHERE login IS NOT NULL GROUP BY login HAVING COUNT(*) > 1) THEN
+        CREATE UNIQUE INDEX IF NOT EXISTS uq_users_login ON users (login) WHERE login IS NOT NULL;
+    ELSE
+        RAISE NOTICE 'users.login has duplicates, uq_users_login not created';
+        CREATE INDEX IF NOT EXISTS idx_users_login ON users (login);
+    END IF;
+
+    IF NOT EXISTS (SELECT 1 FROM roles GROUP BY role_name HAVING COUNT(*) > 1) THEN
+        CREATE UNIQUE INDEX IF NOT EXISTS uq_roles_role_name ON roles (role_name);
+    ELSE
+        RAISE NOTICE 'roles.role_name has duplicates, uq_roles_role_name not created';
+    END IF;
+END $$;
@@ -0,0 +1,49 @@
+-- Мягкое удаление заказов: пользовательское удаление только проставляет deleted_at,
+-- строки физически удаляет очистка по расписанию (backend/api/soft_delete.py) пачками
+ALTER TABLE orders ADD COLUMN IF NOT EXISTS deleted_at TIMESTAMP;
+
+-- Списки и счётчики читают только живые заказы
+CREATE INDEX IF NOT EXISTS idx_orders_active_order_date ON orders (order_date DESC) WHERE deleted_at IS NULL;
+CREATE INDEX IF NOT EXISTS idx_orders_active_status ON orders (status) WHERE deleted_at IS NULL;
+-- Очередь очистки
+CREATE INDEX IF NOT EXISTS idx_orders_deleted_at ON orders (deleted_at) WHERE deleted_at IS NOT NULL;
+
+-- Зависимые строки удаляются вместе с заказом (и этапом) через ON DELETE CASCADE.
+-- Существующие внешние ключи по этим колонкам пересоздаются; у order_customs_points.order_id
+-- и activity_log.order_id ключей не было, в них могут быть осиротевшие строки,
+-- поэтому ключи создаются NOT VALID: старые строки не проверяются, каскад работает.
+DO $$
+DECLARE
+    fk RECORD;
+    existing RECORD;
+BEGIN
+    FOR fk IN
+        SELECT * FROM (VALUES
+            ('order_transport_stages', 'order_id', 'orders'),
+            ('order_stages', 'order_id', 'orders'),
+            ('order_documents', 'order_id', 'orders'),
+            ('phytosanitary_docs', 'order_id', 'orders'),
+            ('order_customs_points', 'order_id', 'orders'),
+            ('activity_log', 'order_id', 'orders'),
+            ('stage_waypoints', 'stage_id', 'order_transport_stages'),
+            ('order_customs_points', 'stage_id', 'order_transport_stages')
+        ) AS t(table_name, column_name, ref_table)
+    LOOP
+        FOR existing IN
+            SELECT c.conname
+            FROM pg_constraint c
+            JOIN pg_attribute a ON a.attrelid = c.conrelid AND a.attnum = c.conkey[1]
+            WHERE c.contype = 'f'
+              AND c.conrelid = fk.table_name::regclass
+              AND array_length(c.conkey, 1) = 1
+              AND a.attname = fk.column_name
+        LOOP
+            EXECUTE format('ALTER TABLE %I DROP CONSTRAINT %I', fk.table_name, existing.conname);
+        END LOOP;
+
+        EXECUTE format(
+            'ALTER TABLE %I ADD CONSTRAINT %I FOREIGN KEY (%I) REFERENCES %I(id) ON DELETE CASCADE NOT VALID',
+            fk.table_name, fk.table_name || '_' || fk.column_name || '_fkey', fk.column_name, fk.ref_table
+        );
+    END LOOP;
+END $$;
@@ -0,0 +1,14 @@
+-- Ключи идемпотентности POST-действий создания: хэш тела запроса и сохранённый ответ.
+-- Повтор с тем же ключом получает ответ из таблицы; просроченные строки удаляются по expires_at
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    idempotency_key VARCHAR(255) NOT NULL,
+    action VARCHAR(100) NOT NULL,
+    request_hash CHAR(64) NOT NULL,
+    status_code INTEGER,
+    response JSONB,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    expires_at TIMESTAMP NOT NULL,
+    PRIMARY KEY (idempotency_key, action)
+);
+
+CREATE INDEX IF NOT EXISTS idx_idempotency_keys_expires_at ON idempotency_keys (expires_at);
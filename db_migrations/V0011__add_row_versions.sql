@@ -0,0 +1,4 @@
+-- Версии строк для оптимистической блокировки: каждая запись увеличивает version,
+-- запись с expected_version выполняется только если версия не изменилась
+ALTER TABLE orders ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 1;
+ALTER TABLE order_transport_stages ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 1;
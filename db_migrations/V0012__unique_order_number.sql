@@ -0,0 +1,15 @@
+-- Номер заказа уникален: выделенный номер не совпадёт с введённым вручную
+-- (index.py отвечает 409 по имени индекса). Дубликаты не исправить автоматически:
+-- индекс создаётся, только если их нет.
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM orders WHERE order_number IS NOT NULL GROUP BY order_number HAVING COUNT(*) > 1) THEN
+        CREATE UNIQUE INDEX IF NOT EXISTS uq_orders_order_number ON orders (order_number) WHERE order_number IS NOT NULL;
+    ELSE
+        RAISE NOTICE 'orders.order_number has duplicates, uq_orders_order_number not created';
+    END IF;
+END $$;
+
+-- Поиск просроченных неиспользованных резервов (повторная выдача и очистка)
+CREATE INDEX IF NOT EXISTS idx_order_number_reservations_pending
+    ON order_number_reservations (reserved_at) WHERE consumed_at IS NULL;
@@ -0,0 +1,10 @@
+-- Одна сессия на пользователя и раздел: update_session делает upsert по
+-- (user_id, section_name). Очистка данных: у повторяющихся сессий остаётся
+-- только запись с последней активностью, остальные удаляются.
+DELETE FROM user_sessions s
+USING user_sessions newer
+WHERE s.user_id = newer.user_id
+  AND s.section_name = newer.section_name
+  AND (COALESCE(s.last_activity, '-infinity'), s.id) < (COALESCE(newer.last_activity, '-infinity'), newer.id);
+
+CREATE UNIQUE INDEX IF NOT EXISTS uq_user_sessions_user_section ON user_sessions (user_id, section_name);
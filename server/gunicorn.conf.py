@@ -0,0 +1,14 @@
+# gunicorn -c server/gunicorn.conf.py
+import multiprocessing
+import os
+
+chdir = os.path.dirname(os.path.abspath(__file__))
+wsgi_app = 'wsgi:application'
+bind = os.environ.get('BIND', '0.0.0.0:8000')
+
+# Воркер на ядро; внутри воркера потоки делят пул соединений (DB_POOL_SIZE >= threads)
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+threads = int(os.environ.get('WEB_THREADS', '8'))
+worker_class = 'gthread'
+timeout = 60
+keepalive = 5
@@ -0,0 +1,99 @@
+import queue
+import threading
+from typing import Any, Callable, List, Optional
+
+import psycopg2
+import psycopg2.extensions
+
+
+class PooledConnection(psycopg2.extensions.connection):
+    '''
+    Соединение из пула: close() возвращает его в пул, а не закрывает.
+    Код функций (UnitOfWork.release, conn.close() в telegram) менять не нужно
+    '''
+    pool: Optional['ConnectionPool'] = None
+    # Схема, привязанная к соединению (db_schema.bind_schema)
+    bound_schema: Optional[str] = None
+
+    def close(self) -> None:
+        if self.pool is not None:
+            self.pool.checkin(self)
+        else:
+            super().close()
+
+    def discard(self) -> None:
+        super().close()
+
+
+class ConnectionPool:
+    '''
+    Пул соединений одного процесса-воркера. checkout() отдаёт свободное
+    соединение или открывает новое, пока их меньше max_size, иначе ждёт.
+    Соединения, взятые в запросе и не возвращённые (исключение в функции),
+    забираются release_request() после ответа.
+    on_connect вызывается для нового соединения, on_checkout - при каждой выдаче
+    (привязка схемы филиала текущего запроса).
+    '''
+
+    def __init__(self, connect: Callable[..., Any], max_size: int = 10, timeout: float = 30,
+                 on_connect: Optional[Callable[[Any], Any]] = None,
+                 on_checkout: Optional[Callable[[Any], Any]] = None) -> None:
+        self._connect = connect
+        self._on_connect = on_connect
+        self._on_checkout = on_checkout
+        self._idle: 'queue.LifoQueue[Any]' = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._timeout = timeout
+        self._local = threading.local()
+
+    def _borrowed(self) -> List[Any]:
+        if not hasattr(self._local, 'borrowed'):
+            self._local.borrowed = []
+        return self._local.borrowed
+
+    def checkout(self) -> Any:
+        if not self._slots.acquire(timeout=self._timeout):
+            raise psycopg2.OperationalError('connection pool exhausted')
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = None
+        if conn is None or conn.closed:
+            try:
+                conn = self._connect(connection_factory=PooledConnection)
+                if self._on_connect:
+                    self._on_connect(conn)
+            except BaseException:
+                self._slots.release()
+                raise
+            conn.pool = self
+        if self._on_checkout:
+            try:
+                self._on_checkout(conn)
+            except BaseException:
+                conn.discard()
+                self._slots.release()
+                raise
+        self._borrowed().append(conn)
+        return conn
+
+    def checkin(self, conn: Any) -> None:
+        borrowed = self._borrowed()
+        if conn not in borrowed:
+            # Уже возвращено (повторный close())
+            return
+        borrowed.remove(conn)
+        try:
+            if conn.closed:
+                return
+            if conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+            self._idle.put(conn)
+        except psycopg2.Error:
+            conn.discard()
+        finally:
+            self._slots.release()
+
+    def release_request(self) -> None:
+        for conn in list(self._borrowed()):
+            self.checkin(conn)
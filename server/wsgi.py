@@ -0,0 +1,212 @@
+'''
+Самостоятельный запуск облачных функций одним долгоживущим процессом.
+Функции backend/<name>/index.py монтируются как маршруты /<name>/...:
+/api, /telegram, /telegram-webhook, /generate-contract-pdf. HTTP-запрос
+переводится в event того же вида, что даёт среда функций, ответ handler -
+обратно в HTTP. Соединения с базой берутся из пула процесса и переживают
+запросы (вместе с подготовленными запросами prepared.py). Пул общий для
+филиалов: схема из X-Tenant (DB_TENANT_SCHEMAS, см. db_schema.py)
+привязывается при каждой выдаче соединения.
+
+Разработка (один процесс, поток на запрос):
+    DATABASE_URL=postgresql://localhost/transport python server/wsgi.py --port 8000
+
+Нагрузка (воркер на ядро, потоки внутри воркера):
+    gunicorn -c server/gunicorn.conf.py
+
+Уведомления API по умолчанию уходят в облачную функцию telegram; при
+самостоятельном запуске задайте TELEGRAM_NOTIFY_URL=http://127.0.0.1:8000/telegram/.
+'''
+import argparse
+import base64
+import functools
+import importlib.util
+import json
+import os
+import sys
+import threading
+import traceback
+import uuid
+from http import HTTPStatus
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import parse_qs
+
+import psycopg2
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(ROOT, 'backend', 'api'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Соединения пула переживают запросы - подготовленные запросы (prepared.py)
+# переиспользуются; задаётся до импорта функций
+os.environ.setdefault('PREPARED_STATEMENTS', '1')
+
+from db_schema import UnknownTenant, bind_schema, request_schema, use_schema  # noqa: E402
+from pool import ConnectionPool  # noqa: E402
+from query_stats import InstrumentedCursor  # noqa: E402
+
+FUNCTIONS = ['api', 'telegram', 'telegram-webhook', 'generate-contract-pdf']
+
+# Соединений на воркер: по одному на поток плюс запас на чтение с реплики
+POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '10'))
+POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', '30'))
+
+
+def load_function(name: str) -> Any:
+    '''
+    Импортирует backend/<name>/index.py под уникальным именем модуля
+    '''
+    path = os.path.join(ROOT, 'backend', name, 'index.py')
+    spec = importlib.util.spec_from_file_location(f"function_{name.replace('-', '_')}", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class Functions:
+    '''
+    Функции и пулы соединений процесса. Создаются при первом запросе -
+    уже после fork воркера, чтобы соединения не делились между процессами
+    '''
+
+    def __init__(self) -> None:
+        self.modules: Dict[str, Any] = {}
+        self.pools: List[ConnectionPool] = []
+        self._lock = threading.Lock()
+
+    def _make_pool(self, dsn: str) -> ConnectionPool:
+        pool = ConnectionPool(
+            functools.partial(psycopg2.connect, dsn, cursor_factory=InstrumentedCursor),
+            max_size=POOL_SIZE, timeout=POOL_TIMEOUT, on_checkout=bind_schema
+        )
+        self.pools.append(pool)
+        return pool
+
+    def load(self) -> Dict[str, Any]:
+        with self._lock:
+            if self.modules:
+                return self.modules
+            primary = self._make_pool(os.environ['DATABASE_URL'])
+            modules = {name: load_function(name) for name in FUNCTIONS}
+            for module in modules.values():
+                module.get_db_connection = primary.checkout
+            if os.environ.get('DATABASE_READ_URL'):
+                modules['api'].get_read_connection = self._make_pool(os.environ['DATABASE_READ_URL']).checkout
+            self.modules = modules
+            return modules
+
+    def release_request(self) -> None:
+        for pool in self.pools:
+            pool.release_request()
+
+
+functions = Functions()
+
+
+def build_event(environ: Dict[str, Any], path: str) -> Dict[str, Any]:
+    '''
+    HTTP-запрос WSGI -> event облачной функции
+    '''
+    headers = {
+        key[5:].replace('_', '-').title(): value
+        for key, value in environ.items() if key.startswith('HTTP_')
+    }
+    if environ.get('CONTENT_TYPE'):
+        headers['Content-Type'] = environ['CONTENT_TYPE']
+
+    query = parse_qs(environ.get('QUERY_STRING', ''), keep_blank_values=True)
+    event: Dict[str, Any] = {
+        'httpMethod': environ.get('REQUEST_METHOD', 'GET'),
+        'path': path,
+        'headers': headers,
+        'queryStringParameters': {name: values[-1] for name, values in query.items()},
+        'isBase64Encoded': False,
+        'requestContext': {
+            'requestId': str(uuid.uuid4()),
+            'identity': {'sourceIp': environ.get('REMOTE_ADDR')}
+        }
+    }
+
+    length = int(environ.get('CONTENT_LENGTH') or 0)
+    raw = environ['wsgi.input'].read(length) if length else b''
+    if raw:
+        try:
+            event['body'] = raw.decode('utf-8')
+        except UnicodeDecodeError:
+            event['body'] = base64.b64encode(raw).decode('ascii')
+            event['isBase64Encoded'] = True
+    return event
+
+
+def error_response(status_code: int, message: str) -> Dict[str, Any]:
+    return {
+        'statusCode': status_code,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({'error': message}),
+        'isBase64Encoded': False
+    }
+
+
+def application(environ: Dict[str, Any], start_response: Callable[..., Any]) -> Iterable[bytes]:
+    name, _, rest = (environ.get('PATH_INFO') or '/').lstrip('/').partition('/')
+    modules = functions.load()
+    module = modules.get(name)
+
+    if module is None:
+        response = error_response(404, f'unknown function: {name}')
+    else:
+        event = build_event(environ, '/' + rest)
+        context = SimpleNamespace(request_id=event['requestContext']['requestId'], function_name=name)
+        try:
+            # Схема филиала запроса: пул привязывает её к каждому выданному соединению
+            with use_schema(request_schema(event)):
+                response = module.handler(event, context)
+        except UnknownTenant as e:
+            response = error_response(400, str(e))
+        except Exception:
+            traceback.print_exc()
+            response = error_response(500, 'Internal server error')
+        finally:
+            functions.release_request()
+
+    body = response.get('body') or ''
+    if response.get('isBase64Encoded'):
+        payload = base64.b64decode(body)
+    else:
+        payload = body.encode('utf-8') if isinstance(body, str) else body
+
+    status_code = int(response.get('statusCode', 200))
+    headers: List[Tuple[str, str]] = [
+        (header, str(value)) for header, value in (response.get('headers') or {}).items()
+        if header.lower() != 'content-length'
+    ]
+    headers.append(('Content-Length', str(len(payload))))
+    start_response(f'{status_code} {HTTPStatus(status_code).phrase}', headers)
+    return [payload]
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    from socketserver import ThreadingMixIn
+    from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    args = parser.parse_args(argv)
+
+    class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+        daemon_threads = True
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *_args: Any, **_kwargs: Any) -> None:
+            pass
+
+    with make_server(args.host, args.port, application,
+                     server_class=ThreadingWSGIServer, handler_class=QuietHandler) as server:
+        print(f'serving {", ".join("/" + name for name in FUNCTIONS)} on http://{args.host}:{args.port}')
+        server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
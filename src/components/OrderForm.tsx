@@ -500,6 +500,7 @@ export default function OrderForm({ open, onClose, onSuccess, editOrder, clients
         body: JSON.stringify({
           action: 'update_order',
           order_id: editOrder.id,
+          expected_version: editOrder.version,
           user_role: userRole,
           user_name: userName,
           order: {
@@ -521,6 +522,7 @@ export default function OrderForm({ open, onClose, onSuccess, editOrder, clients
             }
             
             return {
+              id: stage.id.startsWith('existing_') ? parseInt(stage.id.replace('existing_', '')) : undefined,
               stage_number: stage.stage_number,
               vehicle_id: parseInt(stage.vehicle_id),
               driver_id: parseInt(stage.driver_id),
@@ -545,6 +547,11 @@ export default function OrderForm({ open, onClose, onSuccess, editOrder, clients
       const result = await response.json();
       console.log('Update order response:', response.status, result);
       
+      if (response.status === 409) {
+        toast.error('Заказ изменён другим пользователем. Закройте форму и откройте заказ заново');
+        return;
+      }
+      
       if (!response.ok) {
         console.error('Failed to update order:', response.status, result);
         throw new Error(`Failed to update order: ${response.status}`);